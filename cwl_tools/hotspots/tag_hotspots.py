@@ -9,12 +9,13 @@
 
 from __future__ import division
 
-import re
 import sys
-import csv
 import time
 import logging
 import argparse
+from operator import itemgetter
+
+from python_tools.util import read_parsed_cache, write_parsed_cache
 
 
 logging.basicConfig(
@@ -31,6 +32,9 @@ MUTATION_KEYS = [
     'Tumor_Seq_Allele2'
 ]
 
+# Number of tagged MAF lines that are buffered before each write
+WRITE_BATCH_SIZE = 100000
+
 
 def parse_arguments():
     """
@@ -43,10 +47,43 @@ def parse_arguments():
     parser.add_argument('-itxt', '--input_hotspot', action='store', dest='input_txt', required=True, type=str, help='Input txt file which has hotspots')
     parser.add_argument('-o','--output_maf', action='store', dest='output_maf', required=True, type=str, help='Output maf file name')
     parser.add_argument('-outdir', '--out_dir', action='store', dest='out_dir', required=False, type=str, help='Full Path to the output dir.')
+    parser.add_argument('--hotspot_index', action='store', dest='hotspot_index', default='', type=str, help='Path of the prebuilt hotspot index, the hotspots are parsed on every run if not given')
     args = parser.parse_args()
     return args
 
 
+def read_hotspots(hotspot_file):
+    """
+    Parse the hotspots txt file into a frozenset of (Chromosome, Start_Position, Reference_Allele, Tumor_Seq_Allele2)
+
+    :param hotspot_file: tab-separated file with a header that includes the MUTATION_KEYS columns
+    :return: frozenset of tuples of strings
+    """
+    with open(hotspot_file, 'r') as infile:
+        header = next(infile).rstrip('\r\n').split('\t')
+        get_key = itemgetter(*[header.index(k) for k in MUTATION_KEYS])
+        return frozenset(
+            get_key(line.rstrip('\r\n').split('\t')) for line in infile if line.strip('\r\n')
+        )
+
+
+def load_hotspots(hotspot_file, index_file=''):
+    """
+    Load the hotspot index, from its prebuilt binary copy at index_file if that is up to date with the hotspots txt file
+
+    :param hotspot_file: hotspots txt file
+    :param index_file: path of the prebuilt index, nothing is written if not given
+    :return: frozenset of (Chromosome, Start_Position, Reference_Allele, Tumor_Seq_Allele2) tuples
+    """
+    if not index_file:
+        return read_hotspots(hotspot_file)
+    hotspots = read_parsed_cache(index_file, hotspot_file)
+    if hotspots is None:
+        hotspots = read_hotspots(hotspot_file)
+        write_parsed_cache(index_file, hotspot_file, hotspots)
+    return hotspots
+
+
 def tag_hotspots(args):
     """
     Tagging module entrypoint
@@ -55,30 +92,34 @@ def tag_hotspots(args):
     """
     logger.info("tag_hotspots: Started the run for tagging hotspots")
 
-    # Load hotspots into a set for easy lookup by chr:pos:ref:alt, and store AA position changed
-    hotspots = set()
-    with open(args.input_txt, 'r') as infile:
-        reader = csv.DictReader(infile, delimiter='\t')
-        for row in reader:
-            key = ':'.join([row[k] for k in MUTATION_KEYS])
-            hotspots.add(tuple(key))
+    hotspots = load_hotspots(args.input_txt, getattr(args, 'hotspot_index', ''))
 
-    # Parse through input MAF, and create a new one with an extra column tagging hotspots
+    # Stream through input MAF, and create a new one with an extra column tagging hotspots.
+    #  Lines are split on tabs and written back as they are, with the tag appended.
     with open(args.input_maf, 'r') as infile:
         with open(args.output_maf, 'w') as outfile:
 
             # Todo: Comment lines are tossed, though they may need to be retained in some use cases
-            filtered_rows = (row for row in infile if not row.startswith('#'))
-            reader = csv.DictReader(filtered_rows, delimiter='\t')
-            writer = csv.DictWriter(outfile, delimiter='\t', lineterminator='\n', fieldnames=reader.fieldnames + ["hotspot_whitelist"])
-            writer.writeheader()
-
-            for row in reader:
-                row['hotspot_whitelist'] = 'FALSE'
-                key = ':'.join([row[k] for k in MUTATION_KEYS])
-                if tuple(key) in hotspots:
-                    row['hotspot_whitelist'] = 'TRUE'
-                writer.writerow(row)
+            rows = (line.rstrip('\r\n') for line in infile if not line.startswith('#'))
+            header = next(rows)
+            columns = header.split('\t')
+            n_columns = len(columns)
+            get_key = itemgetter(*[columns.index(k) for k in MUTATION_KEYS])
+            outfile.write(header + '\thotspot_whitelist\n')
+
+            lines = []
+            for row in rows:
+                if not row:
+                    continue
+                fields = row.split('\t')
+                if len(fields) < n_columns:
+                    row += '\t' * (n_columns - len(fields))
+                    fields = row.split('\t')
+                lines.append(row + ('\tTRUE\n' if get_key(fields) in hotspots else '\tFALSE\n'))
+                if len(lines) == WRITE_BATCH_SIZE:
+                    outfile.writelines(lines)
+                    lines = []
+            outfile.writelines(lines)
 
     logger.info('tag_hotspots: Finished the run for tagging hotspots.')
 
@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 import pandas as pd
 
 from cwl_tools.hotspots import tag_hotspots
@@ -22,5 +24,43 @@ def main():
     os.unlink(output_filename)
 
 
+def test_hotspot_index():
+    """
+    Hotspots should only be indexed at --hotspot_index, and the index rebuilt when the hotspots change
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        hotspot_file = os.path.join(tmp_dir, 'hotspots.txt')
+        index_file = os.path.join(tmp_dir, 'hotspots.index')
+        output_filename = os.path.join(tmp_dir, 'tagged.maf')
+        shutil.copy('test_hotspots.maf', hotspot_file)
+        mock_args = ArgparseMock({
+            'input_maf': 'test.maf',
+            'input_txt': hotspot_file,
+            'output_maf': output_filename,
+            'hotspot_index': ''
+        })
+
+        tag_hotspots.tag_hotspots(mock_args)
+        assert ('1', '123456', 'A', 'G') in tag_hotspots.load_hotspots(hotspot_file)
+        assert sorted(os.listdir(tmp_dir)) == ['hotspots.txt', 'tagged.maf']
+
+        mock_args.hotspot_index = index_file
+        tag_hotspots.tag_hotspots(mock_args)
+        assert os.path.isfile(index_file)
+        assert tag_hotspots.load_hotspots(hotspot_file, index_file) == tag_hotspots.load_hotspots(hotspot_file)
+        actual = pd.read_csv(output_filename, sep='\t', comment='#')
+        assert actual['hotspot_whitelist'].tolist() == [True, False]
+
+        with open(hotspot_file, 'a') as f:
+            f.write('\nTP53\t2\t7891011\t7891011\tA\tG\n')
+        os.utime(hotspot_file, (0, 0))
+        tag_hotspots.tag_hotspots(mock_args)
+        actual = pd.read_csv(output_filename, sep='\t', comment='#')
+        assert actual['hotspot_whitelist'].tolist() == [True, True]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
 if __name__ == '__main__':
     main()
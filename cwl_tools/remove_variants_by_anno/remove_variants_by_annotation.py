@@ -11,8 +11,10 @@ import pandas as pd
 import logging
 import argparse
 import time
-import re
+from collections import namedtuple
 #import sys
+
+from python_tools.maf_reader import read_maf
         
 logging.basicConfig(
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -20,8 +22,64 @@ logging.basicConfig(
         level=logging.DEBUG)
 logger = logging.getLogger('remove_variants_by_annotation_w_hotspots')        
         
+#Non-exonic variants that are kept when they fall in one of these regions.
+#Chromosome, Start and End are optional (None): a region without a window covers the whole gene.
+#A variant is in a window if its Start_Position or End_Position is in [Start, End].
+RescueRegion = namedtuple('RescueRegion', ['Hugo_Symbol', 'Variant_Classification', 'Chromosome', 'Start', 'End'])
+
+DEFAULT_RESCUE_REGIONS = [
+    #MET exon 14 skipping, exon 14 +/- 100bp
+    RescueRegion('MET', ('Splice_Region', 'Intron'), None, 116411903-100, 116412043+100),
+    #TERT promoter
+    RescueRegion('TERT', ("5'Flank",), None, None, None),
+]
+
+RESCUE_REGION_COLUMNS = list(RescueRegion._fields)
+
 #Can add here: Check Hotspot List
 
+def read_rescue_regions(rescue_regions_file):
+    """
+    Read rescue regions from a tab-separated file with the RESCUE_REGION_COLUMNS header.
+    Variant_Classification may list several classifications separated by commas,
+    and Chromosome, Start and End may be left blank.
+    """
+    df_regions = pd.read_csv(rescue_regions_file, sep='\t', header=0, dtype=str, keep_default_na=False)
+    if list(df_regions.columns.values) != RESCUE_REGION_COLUMNS:
+        raise Exception('Rescue regions file should have the following in the header (in order): ' + ', '.join(RESCUE_REGION_COLUMNS))
+    return [
+        RescueRegion(
+            region.Hugo_Symbol,
+            tuple(region.Variant_Classification.split(',')),
+            region.Chromosome or None,
+            int(region.Start) if region.Start else None,
+            int(region.End) if region.End else None)
+        for region in df_regions.itertuples(index=False)
+    ]
+
+
+def in_rescue_regions(df_maf, rescue_regions):
+    """
+    Boolean mask of the variants in any of the rescue regions, evaluated column-wise one region at a time
+    """
+    start = df_maf['Start_Position'].values
+    end = df_maf['End_Position'].values
+    in_regions = pd.Series(False, index=df_maf.index)
+    for region in rescue_regions:
+        in_region = (
+            df_maf['Variant_Classification'].isin(region.Variant_Classification) &
+            (df_maf['Hugo_Symbol'] == region.Hugo_Symbol)
+        )
+        if region.Chromosome is not None:
+            in_region &= (df_maf['Chromosome'].astype(str) == region.Chromosome)
+        if region.Start is not None or region.End is not None:
+            lower = region.Start if region.Start is not None else -float('inf')
+            upper = region.End if region.End is not None else float('inf')
+            in_region &= ((start >= lower) & (start <= upper)) | ((end >= lower) & (end <= upper))
+        in_regions |= in_region
+    return in_regions
+
+
 #Check RefSeq list
 def check_interval(input_interval):
     try:
@@ -54,36 +112,29 @@ def check_interval(input_interval):
 #optional Input: RefSeq file
 #output: kept.maf, Dropped.maf, notingenomicrange.maf
 def filter_by_annotation(args):
-    df_input = pd.read_csv(args.input_maf,sep='\t', header=1)
+    df_input = read_maf(args.input_maf, categorical=True, header=1)
     keep_exonic = ['Missense_Mutation', 'Nonsense_Mutation', 'Splice_Site', 'Frame_Shift_Ins', 'Frame_Shift_Del', 'In_Frame_Ins', 'In_Frame_Del', 'Translation_Start_Site', 'Nonstop_Mutation', 'Silent']
 
     Bool_exon = df_input['Variant_Classification'].isin(keep_exonic)
 
-    Bool_MET =  (
-                    df_input['Variant_Classification'].isin(["Splice_Region", "Intron"]) &
-                    (df_input['Hugo_Symbol']=='MET') &
-                    (
-                        (
-                            (df_input["Start_Position"].apply(int) >= 116411903-100) &
-                            (df_input["Start_Position"].apply(int) <= 116412043+100)
-                        ) | (
-                            (df_input["End_Position"].apply(int) >= 116411903-100) &
-                            (df_input["End_Position"].apply(int) <= 116412043+100)
-                        )
-                    )
-                 )
-
-    Bool_TERT = (df_input['Variant_Classification']=="5'Flank") & (df_input['Hugo_Symbol']== 'TERT')
+    rescue_regions = DEFAULT_RESCUE_REGIONS
+    if getattr(args, 'rescue_regions', ''):
+        rescue_regions = read_rescue_regions(args.rescue_regions)
+    Bool_rescued = in_rescue_regions(df_input, rescue_regions)
+
     #Removes based on Annotations
-    df_kept = df_input[Bool_exon|Bool_MET|Bool_TERT]
-    df_drop = df_input[~(Bool_exon|Bool_MET|Bool_TERT)]
+    df_kept = df_input[Bool_exon|Bool_rescued]
+    df_drop = df_input[~(Bool_exon|Bool_rescued)]
     df_notinGenomicRange=pd.DataFrame(columns=df_input.columns.tolist())
 
     # if interval file is provided and df_kept is not empty
     if args.input_interval and not df_kept.empty:
-        intervals=check_interval(args.input_interval)
-        # Remove based on genomic Range
-        Bool_inGenomicRange = df_kept['all_effects'].fillna('NA').apply(lambda x: any([y in intervals for y in re.split(',|;',x)]))
+        intervals=frozenset(check_interval(args.input_interval))
+        # Remove based on genomic Range: keep variants with any canonical transcript among all_effects
+        all_effects = df_kept['all_effects'].fillna('NA').astype(str).values
+        Bool_inGenomicRange = pd.Series(
+            [not intervals.isdisjoint(effects.replace(';', ',').split(',')) for effects in all_effects],
+            index=df_kept.index)
         df_notinGenomicRange = df_kept[~(Bool_inGenomicRange)]
         df_kept=df_kept[(Bool_inGenomicRange)]
 
@@ -103,6 +154,7 @@ def parse_arguments():
     parser.add_argument('-kept','--kept_output_maf', required=True, type=str, help='Output maf of kept variants file name')
     parser.add_argument('-dropped','--dropped_output_maf', required=True, type=str, help='Output maf file name of dropped variants that are nonexonic')
     parser.add_argument('-dropped_NGR','--dropped_NGR_output_maf', required=True, type=str, help='Output maf file name of dropped variants not in Genomic Range')        
+    parser.add_argument('-rescue', '--rescue_regions', required=False, default='', type=str, help='Optional: Input txt file of the regions where non-exonic variants are kept (defaults to MET exon 14 and the TERT promoter)')
     args = parser.parse_args()
     return args
 
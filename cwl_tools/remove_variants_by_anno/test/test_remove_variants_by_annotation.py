@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+
+from cwl_tools.remove_variants_by_anno import remove_variants_by_annotation
+from python_tools.util import ArgparseMock
+
+
+MAF = (
+    '#version 2.4\n'
+    'Hugo_Symbol\tChromosome\tStart_Position\tEnd_Position\tVariant_Classification\tall_effects\n'
+    'MET\t7\t116411850\t116411850\tIntron\tMET,intron_variant,,ENST00000397752,NM_000245.2\n'
+    'MET\t7\t116411700\t116411700\tIntron\tMET,intron_variant,,ENST00000397752,NM_000245.2\n'
+    'TERT\t5\t1295228\t1295228\t5\'Flank\tTERT,upstream_gene_variant,,ENST00000310581,NM_198253.2\n'
+    'EGFR\t7\t55249071\t55249071\tMissense_Mutation\tEGFR,missense_variant,p.T790M,ENST00000275493,NM_005228.3;EGFR-AS1,intron_variant,,ENST00000442411,\n'
+    'EGFR\t7\t55249071\t55249071\tMissense_Mutation\tEGFR,missense_variant,p.T790M,ENST00000455089,\n'
+)
+
+
+def test_filter_by_annotation():
+    """
+    Non-exonic variants should only be kept in the rescue regions, and kept variants
+    should be on one of the canonical transcripts of the interval file
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        maf_file = os.path.join(tmp_dir, 'test.maf')
+        with open(maf_file, 'w') as f:
+            f.write(MAF)
+        interval_file = os.path.join(tmp_dir, 'intervals.txt')
+        with open(interval_file, 'w') as f:
+            f.write('RefSeq\nNM_000245.2\nNM_198253.2\nNM_005228.3\n')
+
+        mock_args = ArgparseMock({'input_maf': maf_file, 'input_interval': interval_file})
+        df_drop, df_notinGenomicRange, df_kept = remove_variants_by_annotation.filter_by_annotation(mock_args)
+        assert df_drop['Start_Position'].tolist() == [116411700]
+        assert df_notinGenomicRange['all_effects'].str.contains('ENST00000455089').all()
+        assert df_kept['Hugo_Symbol'].tolist() == ['MET', 'TERT', 'EGFR']
+
+        # Configured rescue regions replace the default MET and TERT ones
+        rescue_regions_file = os.path.join(tmp_dir, 'rescue_regions.txt')
+        with open(rescue_regions_file, 'w') as f:
+            f.write('Hugo_Symbol\tVariant_Classification\tChromosome\tStart\tEnd\n')
+            f.write('MET\tIntron,Splice_Region\t7\t116411600\t116411750\n')
+        mock_args = ArgparseMock({'input_maf': maf_file, 'input_interval': '', 'rescue_regions': rescue_regions_file})
+        df_drop, df_notinGenomicRange, df_kept = remove_variants_by_annotation.filter_by_annotation(mock_args)
+        assert df_kept['Start_Position'].tolist() == [116411700, 55249071, 55249071]
+        assert df_notinGenomicRange.empty
+    finally:
+        shutil.rmtree(tmp_dir)
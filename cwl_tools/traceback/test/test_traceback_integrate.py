@@ -0,0 +1,59 @@
+import pandas as pd
+
+from cwl_tools.traceback.traceback_integrate import genotyped_in_patient, merge_simplex_duplex
+
+
+def test_merge_simplex_duplex():
+    """
+    SIMPLEX metrics should be added to the DUPLEX genotype of the same sample and variant,
+    whatever the order of the genotypes
+    """
+    tbf = pd.DataFrame({
+        '#Run': ['R1'] * 6,
+        'MRN': ['C-AAA'] * 6,
+        'Sample': ['S1_STANDARD', 'S2_DUPLEX', 'S2_DUPLEX', 'S2_SIMPLEX', 'S2_SIMPLEX', 'S3_DUPLEX'],
+        'Accession': ['A'] * 6,
+        'Chr': ['7'] * 6,
+        'Pos': ['100', '100', '200', '200', '100', '100'],
+        'Ref': ['C'] * 6,
+        'Alt': ['T'] * 6,
+        'DP': [10, 20, 30, 40, 50, 0],
+        'RD': [9, 19, 28, 40, 49, 0],
+        'AD': [1, 1, 2, 0, 1, 0],
+        'VF': [0.1, 0.05, 0.067, 0.0, 0.02, 0.0],
+    })
+    merged = merge_simplex_duplex(tbf)
+    assert merged.columns.tolist() == tbf.columns.tolist()
+    assert merged['Sample'].tolist() == ['S1_STANDARD', 'S2_DUPLEX', 'S2_DUPLEX', 'S3_DUPLEX']
+    assert merged['Pos'].tolist() == ['100', '100', '200', '100']
+    assert merged['DP'].tolist() == [10, 70, 70, 0]
+    assert merged['RD'].tolist() == [9, 68, 68, 0]
+    assert merged['AD'].tolist() == [1, 2, 2, 0]
+    assert merged['VF'].tolist() == [0.1, 2 / 70.0, 2 / 70.0, 0.0]
+
+
+def test_genotyped_in_patient():
+    """
+    Variants should only be tagged by genotypes of another sample of the same patient
+    that pass the VF threshold of their bam type
+    """
+    tbf = pd.DataFrame({
+        'MRN': ['C-AAA', 'C-AAA', 'C-AAA1', 'C-AAA', 'C-BBB'],
+        'Sample': ['S1_STANDARD', 'S2_STANDARD', 'C-AAA1-T_STANDARD', 'S3_DUPLEX', 'S4_DUPLEX'],
+        'Pos': ['100', '200', '300', '400', '500'],
+        'Ref': ['C'] * 5,
+        'Alt': ['T'] * 5,
+        'VF': [0.1, 0.1, 0.1, 0.005, 0.01],
+    })
+    variants = pd.DataFrame({
+        'Sample': ['S1', 'S2', 'C-AAA-T', 'S1', 'S1', 'S5', 'S2'],
+        'Start': ['100', '100', '300', '400', '500', '100', '200'],
+        'Ref': ['C'] * 7,
+        'Alt': ['T'] * 7,
+    })
+    sample_metadata = pd.DataFrame({
+        'Sample': ['S1', 'S2', 'C-AAA-T', 'S5'],
+        'MRN': ['C-AAA', 'C-AAA', 'C-AAA', 'C-AAA'],
+    })
+    is_genotyped = genotyped_in_patient(variants, tbf, sample_metadata, control_samples=['S5'])
+    assert is_genotyped.tolist() == [False, True, False, True, False, False, False]
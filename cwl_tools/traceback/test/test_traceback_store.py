@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+from cwl_tools.traceback import traceback_store
+from cwl_tools.traceback.traceback_inputs import group_mutations_maf, plan_genotyping
+from cwl_tools.traceback.traceback_integrate import record_traceback
+
+
+TITLE_FILE = (
+    'Pool\tSample\tPatient_ID\tAccessionID\tClass\n'
+    '{run}\t{sample}\tC-AAA\tACC1\tTumor\n'
+    '{run}\tC-BBB-L001-d\tC-BBB\tACC2\tTumor\n'
+)
+MUTATIONS = (
+    'Gene\tChrom\tStart\tRef\tAlt\tSample\tNormalUsed\tSD_T_RefCount\tSD_T_AltCount\tN_RefCount\tN_AltCount\tVariantClass\n'
+    'EGFR\t7\t55249071\tC\tT\t{sample}\tN1\t100\t5\t50\t0\tMissense_Mutation\n'
+)
+
+
+def write_run(tmp_dir, run, sample):
+    title_file = os.path.join(tmp_dir, run + '_title_file.txt')
+    with open(title_file, 'w') as f:
+        f.write(TITLE_FILE.format(run=run, sample=sample))
+    mutations_file = os.path.join(tmp_dir, run + '_ExonicFiltered.txt')
+    with open(mutations_file, 'w') as f:
+        f.write(MUTATIONS.format(sample=sample))
+    silent_file = os.path.join(tmp_dir, run + '_SilentFiltered.txt')
+    with open(silent_file, 'w') as f:
+        f.write(MUTATIONS.split('\n')[0] + '\n')
+    return title_file, mutations_file, silent_file
+
+
+def test_store_patients():
+    """
+    Records should be replaced on their key, and queried by patient
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        conn = traceback_store.open_store(os.path.join(tmp_dir, 'traceback.db'))
+        mutations = pd.DataFrame({
+            c: ['', '', ''] for c in traceback_store.MUTATION_COLUMNS
+        }).assign(
+            Chromosome='7',
+            Start_Position='55249071',
+            Reference_Allele='C',
+            Tumor_Seq_Allele2='T',
+            Tumor_Sample_Barcode=['C-AAA-L001-d', 'C-AAA-L001-d', 'C-BBB-L001-d'],
+            Run=['R1', 'R2', 'R1'],
+            MRN=['C-AAA', 'C-AAA', 'C-BBB'],
+            t_alt_count='5',
+        )
+        traceback_store.add_mutations(conn, mutations)
+        traceback_store.add_mutations(conn, mutations.iloc[:1].assign(t_alt_count='6'))
+
+        stored = traceback_store.query_mutations(conn, ['C-AAA'])
+        assert stored['Run'].tolist() == ['R2', 'R1']
+        assert stored['t_alt_count'].tolist() == ['5', '6']
+        assert traceback_store.query_mutations(conn, []).empty
+
+        traceback_store.MAX_QUERY_PARAMETERS = 1
+        assert len(traceback_store.query_mutations(conn, ['C-AAA', 'C-BBB', 'C-CCC'])) == 3
+        conn.close()
+    finally:
+        traceback_store.MAX_QUERY_PARAMETERS = 900
+        shutil.rmtree(tmp_dir)
+
+
+def test_traceback_inputs_from_store():
+    """
+    A later run should get the prior mutations of its patients from the store,
+    once they have been recorded after integration
+    """
+    tmp_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        store_file = os.path.join(tmp_dir, 'traceback.db')
+        first_run = write_run(tmp_dir, 'R1', 'C-AAA-L001-d')
+        second_run = write_run(tmp_dir, 'R2', 'C-AAA-L002-d')
+        os.chdir(tmp_dir)
+
+        group_mutations_maf(first_run[0], None, first_run[1], first_run[2], store_file)
+        record_traceback(store_file, 'traceback_inputs.maf', [('C-AAA', 'R1'), ('C-BBB', 'R1')])
+
+        # A run that is not integrated leaves nothing in the store
+        group_mutations_maf(second_run[0], None, second_run[1], second_run[2], store_file)
+        conn = traceback_store.open_store(store_file)
+        assert traceback_store.query_mutations(conn, ['C-AAA'])['Run'].tolist() == ['R1']
+        conn.close()
+
+        group_mutations_maf(second_run[0], None, second_run[1], second_run[2], store_file)
+        traceback_inputs = pd.read_csv('traceback_inputs.maf', sep='\t', dtype=str)
+        assert traceback_inputs['Tumor_Sample_Barcode'].tolist() == ['C-AAA-L002-d', 'C-AAA-L001-d']
+        assert traceback_inputs['Run'].tolist() == ['R2', 'R1']
+        assert traceback_inputs['Start_Position'].unique().tolist() == ['55249071']
+        record_traceback(store_file, 'traceback_inputs.maf', [('C-AAA', 'R2'), ('C-BBB', 'R2')])
+
+        # Re-running a project replaces its records instead of duplicating them
+        group_mutations_maf(second_run[0], None, second_run[1], second_run[2], store_file)
+        assert len(pd.read_csv('traceback_inputs.maf', sep='\t', dtype=str)) == 2
+
+        # and drops the mutations that it no longer has
+        with open(second_run[1], 'w') as f:
+            f.write(MUTATIONS.split('\n')[0] + '\n')
+        group_mutations_maf(second_run[0], None, second_run[1], second_run[2], store_file)
+        record_traceback(store_file, 'traceback_inputs.maf', [('C-AAA', 'R2'), ('C-BBB', 'R2')])
+        conn = traceback_store.open_store(store_file)
+        assert traceback_store.query_mutations(conn, ['C-AAA'])['Run'].tolist() == ['R1']
+        conn.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+
+def test_plan_genotyping():
+    """
+    All bams of a patient should be genotyped at the unique sites of that patient only
+    """
+    tmp_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        store_file = os.path.join(tmp_dir, 'traceback.db')
+        first_run = write_run(tmp_dir, 'R1', 'C-AAA-L001-d')
+        second_run = write_run(tmp_dir, 'R2', 'C-AAA-L002-d')
+        os.chdir(tmp_dir)
+        group_mutations_maf(first_run[0], None, first_run[1], first_run[2], store_file)
+        record_traceback(store_file, 'traceback_inputs.maf', [('C-AAA', 'R1'), ('C-BBB', 'R1')])
+        traceback_maf = group_mutations_maf(second_run[0], None, second_run[1], second_run[2], store_file)
+
+        genotyping_ids = ['C-AAA-L002-d_DUPLEX', 'C-AAA-L002-d_SIMPLEX', 'C-BBB-L001-d_DUPLEX', 'C-AAA-L001-d_STANDARD']
+        bams = [os.path.join(tmp_dir, i + '.bam') for i in genotyping_ids]
+        for bam in bams:
+            with open(bam, 'w') as f:
+                f.write('x' * 1000)
+
+        plan, site_mafs = plan_genotyping(traceback_maf, second_run[0], genotyping_ids, bams)
+        assert len(traceback_maf) == 2
+        assert plan['Genotyping_ID'].tolist() == genotyping_ids
+        assert plan['MRN'].tolist() == ['C-AAA', 'C-AAA', 'C-BBB', 'C-AAA']
+        assert plan['Sites'].tolist() == [1, 1, 0, 1]
+        assert plan['Estimated_Cost'].tolist() == [1e-06, 1e-06, 0.0, 1e-06]
+        assert site_mafs['C-AAA-L001-d_STANDARD_traceback_sites.maf']['Tumor_Sample_Barcode'].tolist() == ['C-AAA-L002-d']
+        assert site_mafs['C-BBB-L001-d_DUPLEX_traceback_sites.maf'].empty
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
@@ -1,11 +1,33 @@
 #!/usr/bin/env python
 
 import os
+import re
 import sys
 import argparse
 import pandas as pd
 
-from python_tools.util import extract_sample_id_from_bam_path
+from python_tools.util import extract_sample_id_from_bam_path, vcf_to_maf_coords
+from cwl_tools.traceback.traceback_store import open_store, query_mutations
+
+
+# Columns that identify a genotyping site in a traceback inputs maf
+SITE_COLUMNS = [
+    "Chromosome",
+    "Start_Position",
+    "End_Position",
+    "Reference_Allele",
+    "Tumor_Seq_Allele2",
+]
+
+# One row per genotyping bam, with the site maf it is genotyped at
+GENOTYPING_PLAN_COLUMNS = [
+    "Genotyping_ID",
+    "MRN",
+    "Site_File",
+    "Sites",
+    "BAM_Size_GB",
+    "Estimated_Cost",
+]
 
 
 def make_traceback_map(genotyping_bams, title_file, traceback_bam_inputs):
@@ -73,66 +95,72 @@ def make_traceback_map(genotyping_bams, title_file, traceback_bam_inputs):
     return traceback_map
 
 
-def group_mutations_maf(title_file, TI_mutations, exonic_filtered, silent_filtered):
+def genotyping_sites(traceback_maf):
     """
-    Main function that groups all mutations from the current project and 
-    from applicable prior projects and returns a uniformly formatted
-    maf file which can be used as a input file for genotyping
+    Unique sites of a traceback inputs maf. gbcms genotypes every row of its
+    input maf in every bam, so a site shared by several samples or runs only
+    needs to be listed once.
     """
+    return traceback_maf.drop_duplicates(subset=SITE_COLUMNS)
 
-    def _vcf_to_maf_coord(Start, Ref, Alt):
-        """
-        transform ref,alt,pos to maf format following vcf2maf rules
-        """
-        maf_start, maf_ref, maf_alt = int(Start), Ref, Alt
-        ref_length, alt_length = len(Ref), len(Alt)
-        while all([maf_ref, maf_alt, maf_ref[0] == maf_alt[0], maf_ref != maf_alt]):
-            maf_ref = maf_ref[1:] or "-"
-            maf_alt = maf_alt[1:] or "-"
-            ref_length -= 1
-            alt_length -= 1
-            maf_start += 1
-
-        # Handle SNPs, DNPs, TNPs, or anything larger (ONP)
-        if ref_length == alt_length:
-            return (
-                str(maf_start),
-                str(maf_start + alt_length - 1),
-                maf_ref,
-                maf_alt,
-                _variant_type(maf_ref, maf_alt),
-            )
-        # Handle complex and non-complex deletions
-        elif ref_length > alt_length:
-            return (
-                str(maf_start),
-                str(maf_start + ref_length - 1),
-                maf_ref,
-                maf_alt,
-                "DEL",
-            )
-        # Handle complex and non-complex insertions
-        else:
-            maf_stop = (
-                str(maf_start + ref_length - 1) if maf_ref != "-" else str(maf_start)
-            )
-            maf_start = str(maf_start - 1) if maf_ref == "-" else str(maf_start)
-            return (maf_start, maf_stop, maf_ref, maf_alt, "INS")
 
-    def _variant_type(Ref, Alt):
-        """
-        get variant type based on maf formatted ref and alt 
-        """
-        if len(Ref) > len(Alt):
-            return "DEL"
-        elif len(Ref) < len(Alt):
-            return "INS"
-        else:
-            snv_types = {1: "SNP", 2: "DNP", 3: "TNP"}
-            if len(Ref) > 3:
-                return "ONP"
-            else:
-                return snv_types[len(Ref)]
+def plan_genotyping(traceback_maf, title_file, genotyping_ids, genotyping_bams):
+    """
+    Site maf of each genotyping bam. traceback_integrate only keeps the genotypes
+    of a sample at the mutations of its own patient, so each bam is only genotyped
+    at the unique sites of its patient, shared by its STANDARD, SIMPLEX and DUPLEX
+    bams. Bams of samples without a known patient get no sites.
+
+    The estimated cost of a bam is its number of sites times its size in GB, as the
+    gbcms run time grows with both.
+
+    :param traceback_maf: traceback inputs maf DataFrame
+    :param title_file: title file of the current project
+    :param genotyping_ids: sample ids suffixed with their bam type, as passed to gbcms
+    :param genotyping_bams: bam paths, in the order of genotyping_ids
+    :return: plan DataFrame with the columns of GENOTYPING_PLAN_COLUMNS, and a dict
+        of the site maf DataFrame of each Site_File
+    """
+    title_file_df = pd.read_csv(title_file, sep="\t", header="infer", dtype=str)
+    # samples of the current project, then those of earlier runs
+    sample_patients = dict(
+        zip(traceback_maf["Tumor_Sample_Barcode"], traceback_maf["MRN"])
+    )
+    sample_patients.update(zip(title_file_df["Sample"], title_file_df["Patient_ID"]))
+
+    patient_sites = {
+        mrn: genotyping_sites(sites)
+        for mrn, sites in traceback_maf.groupby("MRN", sort=False)
+    }
+    no_sites = traceback_maf.iloc[:0]
+
+    plan = []
+    site_mafs = {}
+    for genotyping_id, bam in zip(genotyping_ids, genotyping_bams):
+        sample = re.sub("_(STANDARD|SIMPLEX|DUPLEX)$", "", genotyping_id)
+        mrn = sample_patients.get(sample)
+        site_file = "{}_traceback_sites.maf".format(genotyping_id)
+        site_mafs[site_file] = patient_sites.get(mrn, no_sites)
+        bam_size = os.path.getsize(bam) / 1e9
+        n_sites = len(site_mafs[site_file])
+        plan.append(
+            [genotyping_id, mrn, site_file, n_sites, bam_size, n_sites * bam_size]
+        )
+    return pd.DataFrame(plan, columns=GENOTYPING_PLAN_COLUMNS), site_mafs
+
+
+def group_mutations_maf(
+    title_file, TI_mutations, exonic_filtered, silent_filtered, traceback_store=None
+):
+    """
+    Main function that groups all mutations from the current project and 
+    from applicable prior projects and returns a uniformly formatted
+    maf file which can be used as a input file for genotyping.
+
+    If a traceback store is given, the prior mutations of the current patients
+    are queried from it. The grouped mutations are only recorded in it by
+    traceback_integrate, once they have been genotyped.
+    """
 
     def _TI_mutations_to_maf(TI_mutations):
         """
@@ -149,14 +177,9 @@ def group_mutations_maf(title_file, TI_mutations, exonic_filtered, silent_filter
                 "Tumor_Seq_Allele2",
                 "Variant_Type",
             ]
-        ] = pd.DataFrame(
-            TI_df.apply(
-                lambda x: _vcf_to_maf_coord(
-                    x["Start_Pos"], x["Ref_Allele"], x["Alt_Allele"]
-                ),
-                axis=1,
-            ).values.tolist()
-        )
+        ] = vcf_to_maf_coords(
+            TI_df["Start_Pos"], TI_df["Ref_Allele"], TI_df["Alt_Allele"]
+        ).values
         TI_df["Tumor_Seq_Allele1"] = TI_df["Reference_Allele"]
         TI_df["T_AltCount"] = (
             TI_df["T_Count"].apply(int) - TI_df["T_RefCount"].apply(int)
@@ -247,11 +270,9 @@ def group_mutations_maf(title_file, TI_mutations, exonic_filtered, silent_filter
             "Tumor_Seq_Allele2",
             "Variant_Type",
         ]
-    ] = pd.DataFrame(
-        concat_df.apply(
-            lambda x: _vcf_to_maf_coord(x["Start"], x["Ref"], x["Alt"]), axis=1
-        ).values.tolist()
-    )
+    ] = vcf_to_maf_coords(
+        concat_df["Start"], concat_df["Ref"], concat_df["Alt"]
+    ).values
 
     concat_df["Tumor_Seq_Allele1"] = concat_df["Reference_Allele"]
 
@@ -317,10 +338,23 @@ def group_mutations_maf(title_file, TI_mutations, exonic_filtered, silent_filter
         concat_df = pd.concat(
             [concat_df, _TI_mutations_to_maf(TI_mutations)], sort=False
         )
+    # add mutations of the current patients from the store, keeping the
+    #  current records of samples and runs that are already in this run
+    if traceback_store:
+        conn = open_store(traceback_store)
+        try:
+            prior_df = query_mutations(conn, title_file_df["Patient_ID"].dropna())
+        finally:
+            conn.close()
+        prior_df = prior_df[
+            ~prior_df["Tumor_Sample_Barcode"].isin(concat_df["Tumor_Sample_Barcode"])
+            & ~prior_df["Run"].isin(title_file_df["Pool"])
+        ]
+        concat_df = pd.concat([concat_df, prior_df], sort=False)
     concat_df.to_csv(
         "traceback_inputs.maf", header=True, index=None, sep="\t", mode="w"
     )
-    return
+    return concat_df
 
 
 def main():
@@ -364,19 +398,46 @@ def main():
         required=True,
         help="Path to silent filtered mutations file",
     )
-
+    parser.add_argument(
+        "-ts",
+        "--traceback_store",
+        action="store",
+        dest="traceback_store",
+        required=False,
+        help="SQLite store of prior traceback mutations, created if it does not exist",
+    )
+    parser.add_argument(
+        "-gi",
+        "--genotyping_ids",
+        action="store",
+        dest="genotyping_ids",
+        nargs="+",
+        required=True,
+        help="Sample ids of the genotyping bams, suffixed with their bam type",
+    )
+    parser.add_argument(
+        "-gb",
+        "--genotyping_bams",
+        action="store",
+        dest="genotyping_bams",
+        nargs="+",
+        required=True,
+        help="Genotyping bams, in the order of their ids",
+    )
     args = parser.parse_args()
-    group_mutations_maf(
-        args.title_file, args.ti_mutations, args.exonic_filtered, args.silent_filtered
+    traceback_maf = group_mutations_maf(
+        args.title_file,
+        args.ti_mutations,
+        args.exonic_filtered,
+        args.silent_filtered,
+        args.traceback_store,
+    )
+    plan, site_mafs = plan_genotyping(
+        traceback_maf, args.title_file, args.genotyping_ids, args.genotyping_bams
     )
-    # TODO:
-    # make a traceback map so that duplex and simplex bam mutations can be supported.
-    #  currently, only standard/IMPACT bam mutations are supported.
-    # make_traceback_map(
-    #    args.tumor_duplex_bams + args.tumor_simplex_bams,
-    #    args.title_file,
-    #    traceback_bam_inputs,
-    # )
+    for site_file, sites in site_mafs.items():
+        sites.to_csv(site_file, header=True, index=None, sep="\t", mode="w")
+    plan.to_csv("traceback_plan.txt", header=True, index=None, sep="\t", mode="w")
 
 
 if __name__ == "__main__":
@@ -7,12 +7,67 @@ import argparse
 import pandas as pd
 import numpy as np
 
+from python_tools.maf_reader import read_maf
+from cwl_tools.traceback.traceback_store import (
+    MUTATION_COLUMNS,
+    open_store,
+    add_mutations,
+    query_mutations,
+)
+
+# Only the columns used to merge and report genotypes are read from the
+#  traceback input and genotyped (gbcms output) mafs.
+TRACEBACK_INPUT_COLUMNS = [
+    "Hugo_Symbol",
+    "Chromosome",
+    "Start_Position",
+    "End_Position",
+    "Reference_Allele",
+    "Tumor_Seq_Allele2",
+    "Tumor_Sample_Barcode",
+    "VCF_POS",
+    "VCF_REF",
+    "VCF_ALT",
+    "Run",
+    "MRN",
+    "Accession",
+]
+TRACEBACK_OUT_COLUMNS = [
+    "Hugo_Symbol",
+    "Chromosome",
+    "Start_Position",
+    "End_Position",
+    "Reference_Allele",
+    "Tumor_Seq_Allele1",
+    "Tumor_Sample_Barcode",
+    "t_total_count_fragment",
+    "t_ref_count_fragment",
+    "t_alt_count_fragment",
+]
+
+
+# Identifier columns that are not declared in MAF_DTYPES but must stay strings
+TRACEBACK_STR_COLUMNS = ["VCF_POS", "VCF_REF", "VCF_ALT", "Run", "MRN", "Accession"]
+
+# Columns that identify a genotype of a sample in the final traceback
+GENOTYPE_KEY = ["Sample", "Chr", "Pos", "Ref", "Alt"]
+
 
 def integrate_genotypes(args):
-    tbi_maf = pd.read_csv(
-        args.traceback_inputs_maf, sep="\t", header="infer", dtype=str
+    tbi_maf = read_maf(
+        args.traceback_inputs_maf,
+        usecols=TRACEBACK_INPUT_COLUMNS,
+        dtype=dict.fromkeys(TRACEBACK_STR_COLUMNS, str),
+        header="infer",
+    )
+    # gbcms is run per bam, bams without sites give empty mafs
+    tbo_mafs = [
+        read_maf(f, usecols=TRACEBACK_OUT_COLUMNS, header="infer")
+        for f in args.traceback_out_maf
+    ]
+    tbo_maf = pd.concat(
+        [m for m in tbo_mafs if not m.empty] or tbo_mafs, ignore_index=True
     )
-    tbo_maf = pd.read_csv(args.traceback_out_maf, header="infer", sep="\t", dtype=str)
     title_file_df = pd.read_csv(args.title_file, sep="\t", header="infer", dtype=str)
 
     # df of sample identifiers for samples in current project
@@ -102,10 +157,9 @@ def integrate_genotypes(args):
         ]
     ].drop_duplicates()
 
-    tbf["t_vaf_fragment"] = tbf["t_alt_count_fragment"].apply(float) / (
-        tbf["t_alt_count_fragment"].apply(float)
-        + tbf["t_ref_count_fragment"].apply(float)
-    )
+    tbf["t_vaf_fragment"] = tbf["t_alt_count_fragment"] / (
+        tbf["t_alt_count_fragment"] + tbf["t_ref_count_fragment"]
+    ).astype(float)
 
     # remove genotyped variants that do not match positions
     # TODO: why is this happening? GBCM?
@@ -152,25 +206,8 @@ def integrate_genotypes(args):
         },
     )
 
-    # set depth and vaf to int and float types
-    tbf[["DP", "RD", "AD"]] = tbf[["DP", "RD", "AD"]].apply(lambda x: x.astype(int))
-    tbf["VF"] = tbf["VF"].apply(float)
-
-    # Merge and remove bam types from sample id
-    tbf_simplex = tbf[tbf["Sample"].str.contains("SIMPLEX")].reset_index(drop=True)
-    tbf_duplex = tbf[tbf["Sample"].str.contains("DUPLEX")].reset_index(drop=True)
-    tbf_standard = tbf[tbf["Sample"].str.contains("STANDARD")]
-
-    # get simplex-duplex metrics from simplex and duplex
-    for metric in ["DP", "RD", "AD"]:
-        tbf_duplex[metric] = tbf_duplex[metric] + tbf_simplex[metric]
-    tbf_duplex["VF"] = tbf_duplex["AD"].apply(float) / (
-        tbf_duplex["AD"].apply(float) + tbf_duplex["RD"].apply(float)
-    )
-    tbf_duplex["VF"].replace([np.inf, np.nan, -np.inf], 0.0, inplace=True)
-
     # combined standard bam and simplex-duplex metrics for final traceback
-    tbf = pd.concat([tbf_standard, tbf_duplex], ignore_index=True)
+    tbf = merge_simplex_duplex(tbf)
 
     # label exonic and silent mutations as "Genotyped" if present in
     #  tbf and passes threshold.
@@ -211,6 +248,147 @@ def integrate_genotypes(args):
         mode="a",
     )
 
+    # record the mutations for later runs, only once the traceback has been written
+    if args.traceback_store:
+        record_traceback(
+            args.traceback_store,
+            args.traceback_inputs_maf,
+            zip(title_file_df["Patient_ID"], title_file_df["Pool"]),
+        )
+
+
+def record_traceback(traceback_store, traceback_inputs_maf, patient_runs):
+    """
+    Record the genotyped mutations in the traceback store.
+    Mutations of the current runs replace all their earlier records, including
+    those of patients that have no mutations left. Mutations
+    of other runs (e.g. from tumor informed mutations) are only added for the
+    patients and runs that are not in the store yet, so the history that was
+    queried from the store is left as it is.
+
+    :param traceback_store: str path to the SQLite store
+    :param traceback_inputs_maf: traceback inputs maf that was genotyped
+    :param patient_runs: (MRN, Run) pairs of the samples of the current runs
+    """
+    patient_runs = set(patient_runs)
+    mutations = read_maf(
+        traceback_inputs_maf, usecols=MUTATION_COLUMNS, dtype=str, header="infer"
+    )
+    conn = open_store(traceback_store)
+    try:
+        stored = query_mutations(conn, mutations["MRN"].dropna())
+        stored_runs = set(zip(stored["MRN"], stored["Run"]))
+        is_stored = np.array(
+            [run in stored_runs for run in zip(mutations["MRN"], mutations["Run"])],
+            dtype=bool,
+        )
+        is_current = mutations["Run"].isin([run for _, run in patient_runs]).values
+        add_mutations(conn, mutations[is_current | ~is_stored], patient_runs)
+    finally:
+        conn.close()
+
+
+def merge_simplex_duplex(tbf):
+    """
+    Add the metrics of each SIMPLEX genotype to the DUPLEX genotype of the same
+    sample and variant, giving the simplex-duplex metrics. SIMPLEX genotypes
+    are dropped, and DUPLEX genotypes without a SIMPLEX one keep their own metrics.
+
+    :param tbf: traceback DataFrame, with Sample, Chr, Pos, Ref, Alt, DP, RD, AD and VF
+    :return: traceback DataFrame of the STANDARD genotypes followed by the
+        simplex-duplex genotypes
+    """
+    tbf_simplex = tbf[tbf["Sample"].str.contains("SIMPLEX")]
+    tbf_duplex = tbf[tbf["Sample"].str.contains("DUPLEX")]
+    tbf_standard = tbf[tbf["Sample"].str.contains("STANDARD")]
+
+    # get simplex-duplex metrics from simplex and duplex of the same sample and variant
+    simplex_metrics = (
+        tbf_simplex[GENOTYPE_KEY + ["DP", "RD", "AD"]]
+        .assign(
+            Sample=tbf_simplex["Sample"].replace(
+                to_replace="_SIMPLEX$", value="_DUPLEX", regex=True
+            )
+        )
+        .drop_duplicates(subset=GENOTYPE_KEY)
+    )
+    tbf_duplex = pd.merge(
+        tbf_duplex,
+        simplex_metrics,
+        how="left",
+        on=GENOTYPE_KEY,
+        suffixes=("", "_simplex"),
+    )
+    for metric in ["DP", "RD", "AD"]:
+        simplex_metric = tbf_duplex.pop(metric + "_simplex").fillna(0)
+        tbf_duplex[metric] += simplex_metric.astype(tbf_duplex[metric].dtype)
+    tbf_duplex["VF"] = (
+        tbf_duplex["AD"] / (tbf_duplex["AD"] + tbf_duplex["RD"]).astype(float)
+    ).replace([np.inf, np.nan, -np.inf], 0.0)
+
+    return pd.concat([tbf_standard, tbf_duplex], ignore_index=True)
+
+
+def genotyped_in_patient(variants, tbf, sample_metadata, control_samples=[]):
+    """
+    Flag the variants that are present in any other sample of the same patient in the traceback.
+    A traceback genotype counts if it is from an IMPACT or ACCESS STANDARD bam at VF >= 0.02,
+    or from an ACCESS SIMPLEX-DUPLEX bam at VF >= 0.001.
+
+    :param variants: DataFrame of filtered/dropped variants, with Sample, Start, Ref and Alt
+    :param tbf: traceback DataFrame, with MRN, Sample, Pos, Ref, Alt and VF
+    :param sample_metadata: DataFrame of sample identifiers, with Sample and MRN
+    :param control_samples: samples that are not tagged
+    :return: boolean numpy array aligned with variants
+    """
+    # index of the traceback genotypes that pass the VF threshold of their bam type,
+    #  keyed by patient and variant
+    is_duplex = tbf["Sample"].str.contains("DUPLEX").values
+    vf = tbf["VF"].apply(float).values
+    tb_genotyped = tbf[(is_duplex & (vf >= 0.001)) | (~is_duplex & (vf >= 0.02))]
+    tb_genotyped = pd.DataFrame(
+        {
+            "Pos": tb_genotyped["Pos"].apply(int).values,
+            "Ref": tb_genotyped["Ref"].values,
+            "Alt": tb_genotyped["Alt"].values,
+            "MRN": tb_genotyped["MRN"].values,
+            "Traceback_Sample": tb_genotyped["Sample"]
+            .replace(to_replace="_STANDARD$|_SIMPLEX$|_DUPLEX$", value="", regex=True)
+            .values,
+        }
+    ).drop_duplicates()
+
+    # Get patient id from title file
+    patient_ids = sample_metadata.drop_duplicates("Sample", keep="last").set_index(
+        "Sample"
+    )["MRN"]
+    candidates = variants[~variants["Sample"].isin(control_samples)]
+    candidates = pd.DataFrame(
+        {
+            "variant": np.arange(len(variants))[
+                ~variants["Sample"].isin(control_samples).values
+            ],
+            "Pos": candidates["Start"].apply(int).values,
+            "Ref": candidates["Ref"].values,
+            "Alt": candidates["Alt"].values,
+            "Sample": candidates["Sample"].values,
+            "MRN": candidates["Sample"].map(patient_ids).values,
+        }
+    )
+    missing_samples = candidates["Sample"][candidates["MRN"].isnull()].unique()
+    if len(missing_samples):
+        raise Exception(
+            "No patient id found for samples: {}".format(",".join(missing_samples))
+        )
+
+    # match traceback genotypes of the same patient and variant, excluding
+    #  those of the current sample.
+    matches = pd.merge(candidates, tb_genotyped, on=["Pos", "Ref", "Alt", "MRN"])
+    matches = matches[matches["Sample"] != matches["Traceback_Sample"]]
+    is_genotyped = np.zeros(len(variants), dtype=bool)
+    is_genotyped[matches["variant"].values] = True
+    return is_genotyped
+
 
 def intersect_variants(filtered, dropped, tbf, sample_metadata, control_samples=[]):
     """
@@ -230,42 +408,14 @@ def intersect_variants(filtered, dropped, tbf, sample_metadata, control_samples=
         [filtered, dropped],
     )
 
-    # write new filtered and dropped files
-    for i, var in enumerate(variants.itertuples()):
-        Sample = var.Sample
-        if Sample in control_samples:
-            continue
-        # Get patient id from title file
-        Patient_ID = (
-            sample_metadata[sample_metadata["Sample"] == Sample]["MRN"].tolist().pop()
-        )
-        # select mutatons from traceback file that matches coordiante of the current variant
-        #  and belongs to any sample from this patient excluding the current one.
-        select = tbf[
-            (tbf["Ref"].values == var.Ref)
-            & (tbf["Alt"].values == var.Alt)
-            & (tbf["Pos"].apply(int).values == int(var.Start))
-            & (tbf["Sample"].str.contains(Patient_ID))
-            & ~(tbf["Sample"].str.contains(Sample + "_"))
-        ]
-        # if the variant is present in any prior IMAPCT sample at VF >= 0.02
-        #  or prior ACCESS SIMPLEX-DUPLEX at VF >= 0.001, tag it as genotyped.
-        if (
-            select[
-                ~(select["Sample"].str.contains("DUPLEX"))
-                & (select["VF"].apply(float).values >= 0.02)
-            ].shape[0]
-            > 0
-            or select[
-                (select["Sample"].str.contains("DUPLEX"))
-                & (select["VF"].apply(float).values >= 0.001)
-            ].shape[0]
-            > 0
-        ):
-            mut_class = ",".join([variants["Mutation_Class"][i], "Genotyped"])
-            variants.at[i, "Mutation_Class"] = (
-                mut_class[1:] if mut_class.startswith(",") else mut_class
-            )
+    # tag variants that were genotyped in other samples of the same patient
+    is_genotyped = genotyped_in_patient(variants, tbf, sample_metadata, control_samples)
+    variants.loc[is_genotyped, "Mutation_Class"] = [
+        mut_class[1:] if mut_class.startswith(",") else mut_class
+        for mut_class in (
+            variants.loc[is_genotyped, "Mutation_Class"] + ",Genotyped"
+        ).tolist()
+    ]
     variants[~(variants["Mutation_Class"] == "")].to_csv(
         filtered_target, header=True, index=None, sep="\t", mode="w"
     )
@@ -362,8 +512,9 @@ def main():
         "--traceback_out_maf",
         action="store",
         dest="traceback_out_maf",
+        nargs="+",
         required=True,
-        help="Path to genotyped traceback output maf file",
+        help="Paths to the genotyped traceback output maf files",
     )
     parser.add_argument(
         "-o",
@@ -374,6 +525,14 @@ def main():
         default=os.getcwd(),
         help="Output directory",
     )
+    parser.add_argument(
+        "-ts",
+        "--traceback_store",
+        action="store",
+        dest="traceback_store",
+        required=False,
+        help="SQLite store to record the traceback mutations in",
+    )
     args = parser.parse_args()
     integrate_genotypes(args)
 
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Local SQLite store of the traceback patient history.
+
+Every traceback run records the mutations it genotyped (in traceback_inputs.maf
+format) in the store once its genotypes are integrated,
+so later runs only need to query the prior mutations of their own patients
+instead of shipping the whole history as flat files.
+"""
+import sqlite3
+
+import pandas as pd
+
+
+# Mutations are stored with the columns of traceback_inputs.maf
+MUTATION_COLUMNS = [
+    "Hugo_Symbol",
+    "Chromosome",
+    "Start_Position",
+    "End_Position",
+    "Reference_Allele",
+    "Tumor_Seq_Allele1",
+    "Tumor_Seq_Allele2",
+    "Tumor_Sample_Barcode",
+    "Matched_Norm_Sample_Barcode",
+    "t_ref_count",
+    "t_alt_count",
+    "n_ref_count",
+    "n_alt_count",
+    "Variant_Classification",
+    "VCF_POS",
+    "VCF_REF",
+    "VCF_ALT",
+    "Run",
+    "MRN",
+    "Accession",
+]
+MUTATION_KEY = [
+    "MRN",
+    "Tumor_Sample_Barcode",
+    "Run",
+    "Chromosome",
+    "Start_Position",
+    "Reference_Allele",
+    "Tumor_Seq_Allele2",
+]
+
+# Stay below the default limit of host parameters in a single SQLite statement
+MAX_QUERY_PARAMETERS = 900
+
+
+def _quote(column):
+    return '"{}"'.format(column)
+
+
+def open_store(store_file):
+    """
+    Open the traceback store, creating its tables and indexes if needed
+
+    :param store_file: str path to the SQLite database
+    :return: sqlite3.Connection
+    """
+    conn = sqlite3.connect(store_file)
+    definitions = [
+        "{} TEXT NOT NULL DEFAULT ''".format(_quote(c))
+        if c in MUTATION_KEY
+        else "{} TEXT".format(_quote(c))
+        for c in MUTATION_COLUMNS
+    ]
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS mutations ({}, PRIMARY KEY ({}))".format(
+            ", ".join(definitions), ", ".join(map(_quote, MUTATION_KEY))
+        )
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS mutations_mrn ON mutations (MRN)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS mutations_variant ON mutations "
+        "(Chromosome, Start_Position, Reference_Allele, Tumor_Seq_Allele2)"
+    )
+    conn.commit()
+    return conn
+
+
+def _insert(conn, table, columns, key, df, replace_runs=()):
+    """
+    Insert or replace the rows of df, missing key values are stored as empty strings.
+    All earlier rows of the (MRN, Run) pairs of replace_runs are deleted first,
+    in the same transaction.
+    """
+    df = df[columns].copy()
+    df[key] = df[key].fillna("")
+    # plain python values, with NULL for missing ones
+    rows = zip(
+        *[[None if pd.isnull(v) else v for v in df[c].tolist()] for c in columns]
+    )
+    with conn:
+        conn.executemany(
+            "DELETE FROM {} WHERE MRN = ? AND Run = ?".format(table),
+            sorted(set(replace_runs)),
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+                table, ", ".join(map(_quote, columns)), ", ".join(["?"] * len(columns))
+            ),
+            rows,
+        )
+
+
+def _select_patients(conn, table, columns, patient_ids):
+    """
+    Select the rows of the given patients, in batches of MRNs
+    """
+    patient_ids = sorted(set(patient_ids))
+    batches = [
+        pd.read_sql_query(
+            "SELECT {} FROM {} WHERE MRN IN ({})".format(
+                ", ".join(map(_quote, columns)), table, ", ".join(["?"] * len(batch))
+            ),
+            conn,
+            params=batch,
+        )
+        for batch in [
+            patient_ids[i : i + MAX_QUERY_PARAMETERS]
+            for i in range(0, len(patient_ids), MAX_QUERY_PARAMETERS)
+        ]
+    ]
+    if not batches:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(batches, ignore_index=True)
+
+
+def add_mutations(conn, mutations, replace_runs=None):
+    """
+    Record traceback input mutations, replacing all earlier records of the same
+    patient and run, so that mutations dropped by a re-run are not kept
+
+    :param conn: sqlite3.Connection from open_store
+    :param mutations: pd.DataFrame in traceback_inputs.maf format
+    :param replace_runs: iterable of the (MRN, Run) pairs to replace, defaults
+        to those of the mutations
+    """
+    if replace_runs is None:
+        replace_runs = zip(mutations["MRN"], mutations["Run"])
+    _insert(
+        conn,
+        "mutations",
+        MUTATION_COLUMNS,
+        MUTATION_KEY,
+        mutations,
+        replace_runs=replace_runs,
+    )
+
+
+def query_mutations(conn, patient_ids):
+    """
+    Get the recorded mutations of the given patients
+
+    :param conn: sqlite3.Connection from open_store
+    :param patient_ids: iterable of MRNs
+    :return: pd.DataFrame in traceback_inputs.maf format
+    """
+    return _select_patients(conn, "mutations", MUTATION_COLUMNS, patient_ids)
+
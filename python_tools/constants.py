@@ -1,5 +1,6 @@
 import os
 import re
+import numpy as np
 from collections import OrderedDict
 
 # Repository main directory
@@ -464,6 +465,26 @@ SAMPLE_TYPE_PLASMA = "Plasma"
 SAMPLE_TYPE_NORMAL_NONPLASMA = "Buffycoat"
 TITLE_FILE_TO_PAIRED_FILE = "Title_file_to_paired.csv"
 
+# Typed MAF reading #
+# Declared dtypes for MAF columns that are always filled in, all other columns are inferred
+# (a column that can be empty, such as the fragment counts of a MAF that was not genotyped, must stay inferred,
+# so that it is still read as float NaN)
+MAF_DTYPES = {
+    "Hugo_Symbol": str,
+    "Chromosome": str,
+    "Start_Position": np.int64,
+    "End_Position": np.int64,
+    "Variant_Classification": str,
+    "Variant_Type": str,
+    "Reference_Allele": str,
+    "Tumor_Seq_Allele1": str,
+    "Tumor_Seq_Allele2": str,
+    "Tumor_Sample_Barcode": str,
+}
+
+# Low-cardinality MAF columns that can be read as pandas categoricals
+MAF_CATEGORICAL_COLUMNS = ["Chromosome", "Variant_Classification", "Hugo_Symbol"]
+
 # Final maf to text #
 MAF_COLUMNS_SELECT = [
     "Hugo_Symbol",
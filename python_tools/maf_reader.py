@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from python_tools.constants import MAF_DTYPES, MAF_CATEGORICAL_COLUMNS
+
+
+def read_maf(maf_file, usecols=None, dtype=None, categorical=False, memory_map=False, **kwargs):
+    """
+    Read a tab-separated MAF using the declared MAF_DTYPES schema
+
+    :param maf_file: path to the MAF
+    :param usecols: optional collection of the column names to read, or a callable that is passed each column name.
+        Requested columns that are not in the MAF are skipped, so callers should check for the columns they require.
+    :param dtype: dtype for every column (e.g. str), or a dict of per-column dtypes that override MAF_DTYPES
+    :param categorical: read MAF_CATEGORICAL_COLUMNS as pandas categoricals
+    :param memory_map: map the MAF into memory instead of reading it through a buffer
+    :param **kwargs: keyword args to be passed to pd.read_csv() (e.g. header=1 for MAFs with a version line)
+    :return: pandas.DataFrame
+    """
+    if dtype is None or isinstance(dtype, dict):
+        dtypes = dict(MAF_DTYPES)
+        dtypes.update(dtype or {})
+        if categorical:
+            dtypes.update({c: "category" for c in MAF_CATEGORICAL_COLUMNS})
+    else:
+        dtypes = dtype
+
+    if usecols is not None and not callable(usecols):
+        usecols = frozenset(usecols).__contains__
+
+    return pd.read_csv(
+        maf_file, sep="\t", usecols=usecols, dtype=dtypes, memory_map=memory_map, **kwargs
+    )
+
+
+def read_maf_chunks(maf_file, chunksize, usecols=None, dtype=None, **kwargs):
+    """
+    Read a MAF in chunks of `chunksize` variants, with each column read as the same dtype in every chunk
+
+    read_csv() infers the dtype of undeclared columns chunk by chunk, so that e.g. a column that is empty
+    in one chunk would be float there and object elsewhere. The MAF is first read once to find the dtype
+    of each column over the whole file: float if the chunks are of different numeric dtypes, else object.
+
+    :param maf_file: path to the MAF
+    :param chunksize: number of variants per chunk
+    :param usecols, dtype, **kwargs: as for read_maf()
+    :return: iterator of pandas.DataFrame
+    """
+    if dtype is not None and not isinstance(dtype, dict):
+        return read_maf(maf_file, usecols=usecols, dtype=dtype, chunksize=chunksize, **kwargs)
+
+    dtypes = {}
+    for chunk in read_maf(maf_file, usecols=usecols, dtype=dtype, chunksize=chunksize, **kwargs):
+        for column, column_dtype in zip(chunk.columns, chunk.dtypes):
+            if column not in dtypes or dtypes[column] == column_dtype:
+                dtypes[column] = column_dtype
+            elif all(isinstance(t, np.dtype) and t.kind in "iuf" for t in [dtypes[column], column_dtype]):
+                dtypes[column] = np.dtype(np.float64)
+            else:
+                dtypes[column] = np.dtype(object)
+
+    dtypes.update(dtype or {})
+    return read_maf(maf_file, usecols=usecols, dtype=dtypes, chunksize=chunksize, **kwargs)
+
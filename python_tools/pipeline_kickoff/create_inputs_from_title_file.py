@@ -10,7 +10,7 @@ from python_tools.constants import *
 from python_tools.util import (
     DELIMITER,
     INPUTS_FILE_DELIMITER,
-    get_pos,
+    get_positions,
     reverse_complement,
     all_strings_are_substrings,
     include_yaml_resources,
@@ -102,9 +102,14 @@ def sort_fastqs(fastq1, fastq2, sample_sheet, title_file):
     Lists of inputs in our yaml file need to be ordered the same order as each other.
     An alternate method might involve using Record types as a cleaner solution.
     """
-    fastq1 = sorted(fastq1, key=lambda f: get_pos(title_file, f, use_investigator_sample_id=True))
-    fastq2 = sorted(fastq2, key=lambda f: get_pos(title_file, f, use_investigator_sample_id=True))
-    sample_sheet = sorted(sample_sheet, key=lambda s: get_pos(title_file, s, use_investigator_sample_id=True))
+    def sort_by_title_file_position(sample_objects):
+        sample_objects = list(sample_objects)
+        positions = get_positions(title_file, sample_objects, use_investigator_sample_id=True)
+        return [sample_objects[i] for i in sorted(range(len(sample_objects)), key=positions.__getitem__)]
+
+    fastq1 = sort_by_title_file_position(fastq1)
+    fastq2 = sort_by_title_file_position(fastq2)
+    sample_sheet = sort_by_title_file_position(sample_sheet)
     return fastq1, fastq2, sample_sheet
 
 
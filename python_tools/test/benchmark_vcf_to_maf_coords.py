@@ -0,0 +1,63 @@
+"""
+Benchmark of the column-wise vcf_to_maf_coords against the per-variant vcf_to_maf_coord
+
+Usage (from this directory):
+
+    python benchmark_vcf_to_maf_coords.py [n_variants]
+
+`n_variants` (default 10^6) random variants, 15% of them indels sharing an anchor base,
+are converted once with the row-wise DataFrame.apply that traceback_inputs used to run
+and once with vcf_to_maf_coords. Both results are checked to be identical.
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from python_tools.util import vcf_to_maf_coord, vcf_to_maf_coords
+
+
+def make_synthetic_variants(n_variants, seed=0):
+    """
+    :return: DataFrame with string Start, Ref and Alt columns
+    """
+    rng = np.random.RandomState(seed)
+    bases = np.array(list('ACGT'), dtype=object)
+    ref = bases[rng.randint(0, 4, n_variants)]
+    alt = bases[rng.randint(0, 4, n_variants)]
+    indels = np.flatnonzero(rng.rand(n_variants) < 0.15)
+    inserted = bases[rng.randint(0, 4, len(indels))] + bases[rng.randint(0, 4, len(indels))]
+    is_ins = rng.rand(len(indels)) < 0.5
+    alt[indels] = np.where(is_ins, ref[indels] + inserted, ref[indels])
+    ref[indels] = np.where(is_ins, ref[indels], ref[indels] + inserted)
+    return pd.DataFrame({
+        'Start': rng.randint(2, 10 ** 8, n_variants).astype(str),
+        'Ref': ref,
+        'Alt': alt,
+    })
+
+
+def main():
+    n_variants = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6
+    df = make_synthetic_variants(n_variants)
+
+    start = time.time()
+    expected = pd.DataFrame(
+        df.apply(lambda x: vcf_to_maf_coord(x['Start'], x['Ref'], x['Alt']), axis=1).values.tolist()
+    )
+    rowwise_time = time.time() - start
+
+    start = time.time()
+    actual = vcf_to_maf_coords(df['Start'], df['Ref'], df['Alt'])
+    columnwise_time = time.time() - start
+
+    assert (expected.values == actual.values).all()
+    print('{} variants'.format(n_variants))
+    print('row-wise apply:       {:.2f}s'.format(rowwise_time))
+    print('vcf_to_maf_coords:    {:.2f}s'.format(columnwise_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark of the column-wise apply_filter_maf against the original per-row loop
+
+Usage (from this directory):
+
+    python benchmark_apply_filter_maf.py [n_rows]
+
+The original iterrows() implementation is timed from `filter_reference.apply_filter_maf_rowwise`,
+and the vectorized Status column is checked to be identical.
+"""
+
+import sys
+import time
+
+from python_tools.util import ArgparseMock
+from python_tools.workflow_tools.ACCESS_filters import (
+    make_pre_filtered_maf,
+    apply_filter_maf
+)
+from python_tools.test.test__ACCESS_Filters.filter_reference import (
+    apply_filter_maf_rowwise,
+    make_synthetic_pre_filter
+)
+
+
+TESTING_PARAMETERS = {
+    'tumor_samplename':                         't_sample',
+    'normal_samplename':                        'n_sample',
+    'anno_maf':                                 './test_data/test.maf',
+    'fillout_maf':                              './test_data/test_fillout.maf',
+    'blacklist_file':                           './test_data/blacklist.txt',
+    'tumor_detect_alt_thres':                   2,
+    'curated_detect_alt_thres':                 2,
+    'DS_tumor_detect_alt_thres':                2,
+    'DS_curated_detect_alt_thres':              2,
+
+    'normal_TD_min':                            20,
+    'normal_vaf_germline_thres':                0.4,
+    'tumor_TD_min':                             20,
+    'tumor_vaf_germline_thres':                 0.4,
+    'tier_one_alt_min':                         3,
+    'tier_two_alt_min':                         5,
+    'min_n_curated_samples_alt_detected':       2,
+    'tn_ratio_thres':                           5,
+}
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    args = ArgparseMock(TESTING_PARAMETERS)
+    df_template = make_pre_filtered_maf(args)
+    df_pre_filter, blacklist = make_synthetic_pre_filter(df_template, n_rows)
+
+    start = time.time()
+    expected = apply_filter_maf_rowwise(df_pre_filter, blacklist, args)
+    rowwise_time = time.time() - start
+
+    start = time.time()
+    actual = apply_filter_maf(df_pre_filter, blacklist, args)['Status']
+    vectorized_time = time.time() - start
+
+    assert expected.tolist() == actual.tolist()
+    print('rows:        {}'.format(n_rows))
+    print('row loop:    {:.3f}s'.format(rowwise_time))
+    print('vectorized:  {:.3f}s'.format(vectorized_time))
+    print('speedup:     {:.1f}x'.format(rowwise_time / vectorized_time))
+
+
+if __name__ == '__main__':
+    main()
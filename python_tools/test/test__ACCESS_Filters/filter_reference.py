@@ -0,0 +1,102 @@
+"""
+Reference implementation of the ACCESS filters, used by the tests and the benchmark of apply_filter_maf
+
+The original iterrows() implementation is kept here as `apply_filter_maf_rowwise`,
+to check that the vectorized Status column is identical.
+"""
+
+import numpy as np
+import pandas as pd
+
+from python_tools.workflow_tools.ACCESS_filters import mutation_key
+
+
+def apply_filter_maf_rowwise(df_pre_filter, blacklist, args):
+    """
+    Status column as computed by the original row-by-row implementation,
+    which took the blacklist as a list of chr_start_end_ref_alt strings
+    """
+    blacklist = ['_'.join(key) for key in blacklist]
+
+    def tag_germline(mut, status, args):
+        if 'n_vaf_fragment' in mut.index.tolist() and mut['n_ref_count_fragment'] + mut['n_alt_count_fragment'] > args.normal_TD_min:
+            if mut['n_vaf_fragment'] > args.normal_vaf_germline_thres:
+                status = status + 'Germline;'
+        elif 'common_variant' in mut['FILTER'] and mut['t_ref_count_fragment'] + mut['t_alt_count_fragment'] > args.tumor_TD_min and mut['t_vaf_fragment'] > args.tumor_vaf_germline_thres:
+            status = status + 'LikelyGermline;'
+        return status
+
+    def tag_below_alt_threshold(mut, status, args):
+        if mut['t_alt_count_fragment'] < args.tier_one_alt_min or (mut['hotspot_whitelist'] == False and mut['t_alt_count_fragment'] < args.tier_two_alt_min):
+            if mut['caller_t_alt_count'] >= args.tier_two_alt_min or (mut['hotspot_whitelist'] == True and mut['caller_t_alt_count'] >= args.tier_one_alt_min):
+                status = status + 'BelowAltThreshold;LostbyGenotyper;'
+            else:
+                status = status + 'BelowAltThreshold;'
+        return status
+
+    def occurrence_in_curated(mut, status, args):
+        if mut['CURATED-DUPLEX_n_fillout_sample_alt_detect'] >= args.min_n_curated_samples_alt_detected:
+            status = status + 'InCurated;'
+        return status
+
+    def occurrence_in_normal(mut, status, args):
+        if mut['t_ref_count_fragment'] + mut['t_alt_count_fragment'] > args.tumor_TD_min:
+            if mut['CURATED-DUPLEX_median_VAF'] != 0:
+                if mut['t_vaf_fragment'] / mut['CURATED-DUPLEX_median_VAF'] < args.tn_ratio_thres:
+                    status = status + 'TNRatio-curatedmedian;'
+
+            if 'n_vaf_fragment' in mut.index.tolist():
+                if mut['n_ref_count_fragment'] + mut['n_alt_count_fragment'] > args.normal_TD_min and mut['n_vaf_fragment'] != 0:
+                    if mut['t_vaf_fragment'] / mut['n_vaf_fragment'] < args.tn_ratio_thres:
+                        status = status + 'TNRatio-matchnorm;'
+        return status
+
+    def in_blacklist(mut, status, blacklist):
+        if str(mut['Chromosome'])+"_"+str(mut['Start_Position'])+"_"+str(mut['End_Position'])+"_"+str(mut['Reference_Allele'])+"_"+str(mut['Tumor_Seq_Allele2']) in blacklist:
+            status = status + 'InBlacklist;'
+        return status
+
+    df_post_filter = df_pre_filter.copy()
+    df_post_filter['Status'] = ''
+    for i, mut in df_post_filter.iterrows():
+        status = ''
+        status = tag_germline(mut, status, args)
+        status = tag_below_alt_threshold(mut, status, args)
+        status = occurrence_in_curated(mut, status, args)
+        status = occurrence_in_normal(mut, status, args)
+        status = in_blacklist(mut, status, blacklist)
+        df_post_filter.loc[i, 'Status'] = status
+    return df_post_filter['Status']
+
+
+def make_synthetic_pre_filter(df_template, n_rows, seed=0):
+    """
+    Tile a single-mutation pre-filter frame into `n_rows` distinct mutations,
+    randomizing the columns that the filters look at.
+
+    :return: (pre-filter DataFrame, blacklist MultiIndex as returned by extract_blacklist)
+    """
+    rng = np.random.RandomState(seed)
+    df = pd.concat([df_template.iloc[[0]]] * n_rows, ignore_index=True)
+
+    df['Start_Position'] = np.arange(n_rows) + 1000
+    df['End_Position'] = df['Start_Position']
+    df['hotspot_whitelist'] = rng.rand(n_rows) < 0.3
+    df['FILTER'] = np.where(rng.rand(n_rows) < 0.3, 'PASS;common_variant', 'PASS')
+    df['caller_t_alt_count'] = rng.randint(0, 10, n_rows)
+    df['CURATED-DUPLEX_n_fillout_sample_alt_detect'] = rng.randint(0, 4, n_rows)
+    df['CURATED-DUPLEX_median_VAF'] = np.where(rng.rand(n_rows) < 0.3, 0, rng.rand(n_rows) / 10)
+
+    for prefix in ['t', 'n']:
+        alt = rng.randint(0, 50, n_rows)
+        ref = rng.randint(0, 80, n_rows)
+        df[prefix + '_alt_count_fragment'] = alt
+        df[prefix + '_ref_count_fragment'] = ref
+        df[prefix + '_vaf_fragment'] = (alt / (alt + ref).astype(float)).round(4)
+
+    df.set_index(mutation_key, drop=False, inplace=True)
+
+    blacklist_rows = df.sample(frac=0.1, random_state=seed)
+    blacklist = pd.MultiIndex.from_arrays(
+        [blacklist_rows[k].astype(str).values for k in mutation_key], names=mutation_key)
+    return df, blacklist
@@ -1,13 +1,29 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+import pandas as pd
+
 from python_tools.workflow_tools.ACCESS_filters import (
+    convert_fillout_to_df,
+    create_fillout_summaries,
+    create_fillout_summary,
+    extract_blacklist,
+    extract_fillout_type,
     make_pre_filtered_maf,
     apply_filter_maf,
-    make_condensed_post_filter
+    make_condensed_post_filter,
+    run_batch
 )
 
 from python_tools.util import ArgparseMock
 
+from python_tools.test.test__ACCESS_Filters.filter_reference import (
+    apply_filter_maf_rowwise,
+    make_synthetic_pre_filter
+)
+
 
 class ACCESSFiltersTestCase(unittest.TestCase):
 
@@ -26,7 +42,7 @@ class ACCESSFiltersTestCase(unittest.TestCase):
             'normal_samplename':                        'n_sample',
             'anno_maf':                                 './test_data/test.maf',
             'fillout_maf':                              './test_data/test_fillout.maf',
-            'blacklist':                                './test_data/blacklist.txt',
+            'blacklist_file':                           './test_data/blacklist.txt',
             'tumor_detect_alt_thres':                   2,
             'curated_detect_alt_thres':                 2,
             'DS_tumor_detect_alt_thres':                2,
@@ -51,7 +67,7 @@ class ACCESSFiltersTestCase(unittest.TestCase):
             'normal_samplename':                        'F22',
             'anno_maf':                                 './test_data/SeraCare_0-5/SeraCare_0-5.F22.combined-variants.vep_keptrmv_taggedHotspots.maf',
             'fillout_maf':                              './test_data/SeraCare_0-5/SeraCare_0-5.F22.combined-variants.vep_keptrmv_taggedHotspots_fillout.maf',
-            'blacklist':                                './test_data/blacklist.txt',
+            'blacklist_file':                           './test_data/blacklist.txt',
             'tumor_detect_alt_thres':                   2,
             'curated_detect_alt_thres':                 2,
             'DS_tumor_detect_alt_thres':                2,
@@ -97,7 +113,7 @@ class ACCESSFiltersTestCase(unittest.TestCase):
         mock_args = ArgparseMock(self.testing_parameters)
 
         df_pre_filter = make_pre_filtered_maf(mock_args)
-        df_post_filter = apply_filter_maf(df_pre_filter, mock_args.blacklist, mock_args)
+        df_post_filter = apply_filter_maf(df_pre_filter, extract_blacklist(mock_args), mock_args)
 
         # Todo: Validate and use this test data
         # assert df_post_filter.loc[('1', 8080157, 8080157, 'T', 'A',)]['Status'] == 'TNRatio-curatedmedian;TNRatio-matchnorm;NonExonic;'
@@ -118,10 +134,129 @@ class ACCESSFiltersTestCase(unittest.TestCase):
         mock_args = ArgparseMock(self.testing_parameters_seracare)
 
         df_pre_filter = make_pre_filtered_maf(mock_args)
-        df_post_filter = apply_filter_maf(df_pre_filter, mock_args.blacklist, mock_args)
+        df_post_filter = apply_filter_maf(df_pre_filter, extract_blacklist(mock_args), mock_args)
         condensed = make_condensed_post_filter(df_post_filter)
 
 
+    def test_status_matches_row_loop(self):
+        """
+        Vectorized filters should tag every mutation exactly as the original per-row loop did
+
+        :return:
+        """
+        mock_args = ArgparseMock(self.testing_parameters)
+
+        df_template = make_pre_filtered_maf(mock_args)
+        df_pre_filter, blacklist = make_synthetic_pre_filter(df_template, 2000)
+
+        expected = apply_filter_maf_rowwise(df_pre_filter, blacklist, mock_args)
+        actual = apply_filter_maf(df_pre_filter, blacklist, mock_args)['Status']
+        assert expected.tolist() == actual.tolist()
+
+        # Unmatched mode, no normal columns
+        df_unmatched = df_pre_filter.drop(['n_alt_count_fragment', 'n_ref_count_fragment', 'n_vaf_fragment'], axis=1)
+        expected = apply_filter_maf_rowwise(df_unmatched, blacklist, mock_args)
+        actual = apply_filter_maf(df_unmatched, blacklist, mock_args)['Status']
+        assert expected.tolist() == actual.tolist()
+
+
+    def test_fillout_summaries_single_pass(self):
+        """
+        Summarizing all fillout types together should match summarizing each one separately
+
+        :return:
+        """
+        mock_args = ArgparseMock(self.testing_parameters)
+        fillouts = extract_fillout_type(convert_fillout_to_df(mock_args))
+        thresholds = [2, 3, 1, 2, 4]
+
+        summaries = create_fillout_summaries(list(zip(fillouts, thresholds)))
+        for df_fillout, alt_thres, summary in zip(fillouts, thresholds, summaries):
+            expected = create_fillout_summary(df_fillout, alt_thres)
+            assert set(summary.columns[:-3]) == set(df_fillout['Tumor_Sample_Barcode'])
+            pd.testing.assert_frame_equal(expected, summary)
+
+
+    def test_blacklist_cache(self):
+        """
+        Parsed blacklist should only be cached at --blacklist_cache, and the cache refreshed when the blacklist changes
+
+        :return:
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            blacklist_file = os.path.join(tmp_dir, 'blacklist.txt')
+            cache_file = os.path.join(tmp_dir, 'cache', 'blacklist.pkl')
+            os.mkdir(os.path.dirname(cache_file))
+            shutil.copy('./test_data/blacklist.txt', blacklist_file)
+
+            blacklist = extract_blacklist(ArgparseMock({'blacklist_file': blacklist_file, 'blacklist_cache': ''}))
+            assert ('9', '21974792', '21974792', 'G', 'A') in blacklist
+            assert sorted(os.listdir(tmp_dir)) == ['blacklist.txt', 'cache']
+            assert os.listdir(os.path.dirname(cache_file)) == []
+
+            mock_args = ArgparseMock({'blacklist_file': blacklist_file, 'blacklist_cache': cache_file})
+            assert extract_blacklist(mock_args).equals(blacklist)
+            assert os.path.isfile(cache_file)
+            assert extract_blacklist(mock_args).equals(blacklist)
+
+            with open(blacklist_file, 'a') as f:
+                f.write('\nX\t100\t100\tC\tT\tNEW_SITE\n')
+            os.utime(blacklist_file, (0, 0))
+            assert ('X', '100', '100', 'C', 'T') in extract_blacklist(mock_args)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+    def test_batch_matches_single_pair(self):
+        """
+        Batch mode should write the same filtered MAFs as running each pair on its own
+
+        :return:
+        """
+        tmp_dir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            anno_mafs = [os.path.join(tmp_dir, 'matched.maf'), os.path.join(tmp_dir, 'unmatched.maf')]
+            for anno_maf in anno_mafs:
+                shutil.copy('./test_data/test.maf', anno_maf)
+            pairs = pd.DataFrame({
+                'tumor_id': ['t_sample', 't_sample'],
+                'normal_id': ['n_sample', ''],
+                'anno_maf': anno_mafs
+            })
+            pairing_file = os.path.join(tmp_dir, 'pairing.tsv')
+            pairs.to_csv(pairing_file, sep='\t', index=False)
+
+            batch_parameters = dict(self.testing_parameters)
+            batch_parameters['fillout_maf'] = os.path.abspath(batch_parameters['fillout_maf'])
+            batch_parameters['blacklist_file'] = ''
+            batch_parameters['pairing_file'] = pairing_file
+            batch_parameters['threads'] = 2
+
+            os.chdir(tmp_dir)
+            outfiles = run_batch(ArgparseMock(batch_parameters))
+            # The fillouts of several pairs over the same bams are combined
+            assert run_batch(ArgparseMock(dict(batch_parameters, fillout_maf=[batch_parameters['fillout_maf']] * 2))) == outfiles
+            assert outfiles == [
+                ('matched_fillout_filtered.maf', 'matched_fillout_filtered_condensed.maf'),
+                ('unmatched_fillout_filtered.maf', 'unmatched_fillout_filtered_condensed.maf')
+            ]
+
+            for anno_maf, normal_id, (filtered, condensed) in zip(anno_mafs, ['n_sample', ''], outfiles):
+                single_parameters = dict(batch_parameters, anno_maf=anno_maf, normal_samplename=normal_id)
+                mock_args = ArgparseMock(single_parameters)
+                df_post_filter = apply_filter_maf(make_pre_filtered_maf(mock_args), extract_blacklist(mock_args), mock_args)
+                df_post_filter.to_csv('expected_filtered.maf', header=True, index=None, sep='\t')
+                make_condensed_post_filter(df_post_filter).to_csv('expected_condensed.maf', header=True, index=None, sep='\t')
+
+                assert open(filtered).read() == open('expected_filtered.maf').read()
+                assert open(condensed).read() == open('expected_condensed.maf').read()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmp_dir)
+
+
     def test_mismatching_tumor_sample_id(self):
         """
         End to end inputs creation script test
@@ -132,4 +267,4 @@ class ACCESSFiltersTestCase(unittest.TestCase):
 
         with self.assertRaises(Exception):
             df_pre_filter = make_pre_filtered_maf(mock_args)
-            df_post_filter = apply_filter_maf(df_pre_filter, mock_args.blacklist, mock_args)
+            df_post_filter = apply_filter_maf(df_pre_filter, extract_blacklist(mock_args), mock_args)
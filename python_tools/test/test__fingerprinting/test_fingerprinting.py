@@ -1,12 +1,25 @@
+from __future__ import division
 import os
 import shutil
 import unittest
+import numpy as np
 import pandas as pd
 
 from python_tools.workflow_tools.qc.fingerprinting import (
     read_csv,
+    write_csv,
+    extract_raw_fp,
+    extract_all_raw_fp,
+    pair_a_and_b_pileups,
+    fp_count_matrix,
+    contamination_rates,
+    fp_genotype_codes,
+    find_sex_from_interval,
+    compare_genotype,
     plot_genotyping_matrix
 )
+from python_tools.workflow_tools.qc import fingerprint_store
+from python_tools.workflow_tools.qc.genotype_matrix import HET, GenotypeMatrix, SampleRecord
 
 
 class FingerprintingTestCase(unittest.TestCase):
@@ -40,5 +53,193 @@ class FingerprintingTestCase(unittest.TestCase):
         title_file = pd.read_csv('./test_data/title_file.txt')
         plot_genotyping_matrix(geno_compare, './test_output/', title_file)
 
+    def test_extract_raw_fp(self):
+        # Should keep the first pileup line of each fingerprint position, in pileup order
+        fp_indices = {'1:100': [4, 5, '1:100'], '2:200': [6, 7, 'rs2']}
+        pileup = [
+            ['1', '50', 'A', '10', '10', '0', '0', '0', '0'],
+            ['2', '200', 'G', '10', '0', '0', '8', '2', '0'],
+            ['2', '200', 'G', '10', '0', '0', '1', '1', '0'],
+            ['1', '100', 'A', '10', '5', '5', '0', '0', '0'],
+            ['1', '100', 'A', '10', '9', '1', '0', '0', '0'],
+        ]
+        pileupfile = './test_output/sample-pileup.txt'
+        write_csv(pileupfile, pileup)
+        assert extract_raw_fp(pileupfile, fp_indices) == [
+            ['sample-pileup.txt'],
+            ['2', '200', 'G', '10', '0', '0', '8', '2'],
+            ['1', '100', 'A', '10', '5', '5', '0', '0'],
+        ]
+
+    def test_extract_raw_fp_from_a_and_b_pileups(self):
+        # Should read the pool A then the pool B pileup of each sample, without merged copies
+        fp_indices = {'1:100': [4, 5, '1:100'], '2:200': [6, 7, 'rs2']}
+        os.mkdir('./test_output/A')
+        os.mkdir('./test_output/B')
+        write_csv('./test_output/A/sample-pileup.txt', [['1', '100', 'A', '10', '5', '5', '0', '0', '0']])
+        write_csv('./test_output/B/sample-pileup.txt', [
+            ['1', '100', 'A', '10', '9', '1', '0', '0', '0'],
+            ['2', '200', 'G', '10', '0', '0', '8', '2', '0'],
+        ])
+        paired_pileups = pair_a_and_b_pileups('./test_output/A', './test_output/B')
+        assert paired_pileups == [('./test_output/A/sample-pileup.txt', './test_output/B/sample-pileup.txt')]
+        assert extract_raw_fp(paired_pileups[0], fp_indices) == [
+            ['sample-pileup.txt'],
+            ['1', '100', 'A', '10', '5', '5', '0', '0'],
+            ['2', '200', 'G', '10', '0', '0', '8', '2'],
+        ]
+
+        write_csv('./test_output/A/other-pileup.txt', [['1', '100', 'A', '10', '5', '5', '0', '0', '0']])
+        with self.assertRaises(IOError):
+            pair_a_and_b_pileups('./test_output/A', './test_output/B')
+
+    def test_extract_all_raw_fp(self):
+        # Should give the same records, in the same order, with a pool of processes
+        fp_indices = {'1:100': [4, 5, '1:100'], '2:200': [6, 7, 'rs2']}
+        listofpileups = []
+        for i in range(4):
+            pileupfile = './test_output/sample{}-pileup.txt'.format(i)
+            write_csv(pileupfile, [
+                ['1', '100', 'A', '10', str(i), '5', '0', '0', '0'],
+                ['2', '200', 'G', '10', '0', '0', '8', str(i), '0'],
+            ])
+            listofpileups.append(pileupfile)
+        all_fp_raw = extract_all_raw_fp(listofpileups, fp_indices)
+        assert [r[0] for r in all_fp_raw] == [['sample{}-pileup.txt'.format(i)] for i in range(4)]
+        assert extract_all_raw_fp(listofpileups, fp_indices, threads=2) == all_fp_raw
+
+    def test_contamination_rates(self):
+        # Should compute major and minor contamination from the allele counts of each sample
+        fp_indices = {'1:100': [4, 5, '1:100'], '1:20': [6, 7, 'rs2'], '2:5': [4, 7, 'rs3']}
+        all_fp_raw = [
+            [['normal-pileup.txt'], ['1', '100', 'A', '0', '99', '1', '0', '0'], ['1', '20', 'G', '0', '0', '0', '50', '50'],
+             ['2', '5', 'A', '0', '100', '0', '0', '0']],
+            [['tumor-pileup.txt'], ['2', '5', 'A', '0', '97', '0', '0', '3'], ['1', '100', 'A', '0', '80', '20', '0', '0']],
+        ]
+        loci, alleles, counts, present = fp_count_matrix(all_fp_raw, fp_indices)
+        assert loci == ['1:20', '1:100', '2:5']
+        assert alleles.tolist() == [[2, 3], [0, 1], [0, 3]]
+        assert counts[1].tolist() == [[0, 0, 0, 0], [80, 20, 0, 0], [97, 0, 0, 3]]
+        assert present.tolist() == [[True, True, True], [False, True, True]]
+
+        major, minor, maf = contamination_rates(counts, alleles, present)
+        assert major.tolist() == [1 / 3, 1 / 2]
+        assert minor.tolist() == [(0.01 + 0) / 2, 0.03]
+        # Measured at the homozygous sites of the normal
+        major, minor, maf = contamination_rates(counts, alleles, present, reference=np.array([0, 0]))
+        assert minor.tolist() == [(0.01 + 0) / 2, (0.2 + 0.03) / 2]
+        # Sites below the coverage threshold have no minor allele fraction
+        major, minor, maf = contamination_rates(counts, alleles, present, coverage_thres=101)
+        assert np.isnan(maf).all()
+        assert np.isnan(minor).all()
+
+    def test_genotype_matrix(self):
+        # Should count the sites where each pair of samples agrees or disagrees, among the sites genotyped in both
+        rng = np.random.RandomState(0)
+        codes = rng.randint(-1, 5, size=(7, 70))
+        genotypes = GenotypeMatrix.from_codes(['s%d' % i for i in range(7)], codes)
+        assert genotypes.codes().tolist() == codes.tolist()
+        assert genotypes.samples[3].name == 's3'
+
+        comparison = genotypes.compare(GenotypeMatrix.from_codes(['r'] * 3, codes[:3]), batch_size=2)
+        for q in range(7):
+            for r in range(3):
+                query, reference = codes[q], codes[r]
+                both = (query >= 0) & (reference >= 0)
+                hom = both & (query < HET) & (reference < HET)
+                expected = {
+                    'hom_match': (hom & (query == reference)).sum(),
+                    'hom_mismatch': (hom & (query != reference)).sum(),
+                    'het_match': (both & (query == HET) & (reference == HET)).sum(),
+                    'het_mismatch': (both & ((query == HET) != (reference == HET))).sum(),
+                    'hom_in_ref': (both & (reference < HET)).sum(),
+                }
+                assert {count: comparison[count][q, r] for count in expected} == expected
+
+        genotypes = GenotypeMatrix.from_genotypes(['s1', 's2'], [['A', 'Het', ''], ['A', 'C', 'T']])
+        assert genotypes.codes().tolist() == [[0, HET, -1], [0, 1, 3]]
+
+    def test_fingerprint_store(self):
+        # Should genotype the fingerprint sites with the rule of find_fp_maf
+        counts = np.array([[[99, 1, 0, 0], [50, 0, 50, 0], [0, 0, 0, 0]]])
+        alleles = np.array([[0, 1], [0, 2], [0, 1]])
+        codes = fp_genotype_codes(counts, alleles, np.array([[True, True, True]]))
+        assert codes.tolist() == [[0, HET, -1]]
+
+        # Should compare new samples against the stored ones at their shared sites, also when the loci
+        # are in another order or new loci are added
+        rng = np.random.RandomState(0)
+        loci = ['1:%d' % i for i in range(40)]
+        stored = rng.randint(-1, 5, size=(6, 40))
+        conn = fingerprint_store.open_store('./test_output/fp_store.sqlite')
+        fingerprint_store.add_fingerprints(conn, [SampleRecord('s%d' % i, 'run1', 'p%d' % i) for i in range(6)], loci,
+                                           stored)
+
+        order = rng.permutation(40)
+        new_loci = [loci[i] for i in order] + ['2:1']
+        new = np.hstack([rng.randint(-1, 5, size=(3, 40)), np.zeros((3, 1), dtype=int)])
+        new[0, :40] = stored[2, order]
+        new[1, :40] = np.where(np.arange(40) < 2, 4 - np.maximum(stored[4, order], 0), stored[4, order])
+        samples = [SampleRecord('n0', 'run2', 'p2'), SampleRecord('n1', 'run2', 'p9'), SampleRecord('n2', 'run2', 'p5')]
+        history = fingerprint_store.compare_to_store(conn, samples, new_loci, new)
+
+        reported = {}
+        for q in range(3):
+            for r in range(6):
+                query, reference = new[q, np.argsort(order)], stored[r]
+                hom_in_ref = ((query >= 0) & (reference >= 0) & (reference < 4)).sum()
+                mismatch = ((query >= 0) & (query < 4) & (reference >= 0) & (reference < 4) & (query != reference)).sum()
+                if (hom_in_ref >= 10 and mismatch / hom_in_ref < .05) or ['p2', 'p9', 'p5'][q] == 'p%d' % r:
+                    reported[('n%d' % q, 's%d' % r)] = [mismatch, hom_in_ref]
+        assert {(h[0], h[1]): [h[3], h[4]] for h in history.values.tolist()} == reported
+        statuses = history.set_index(['Sample', 'HistoricalSample'])['Status']
+        assert statuses[('n0', 's2')] == 'Expected Match'
+        assert statuses[('n2', 's5')] == 'Unexpected Mismatch'
+        assert (history['HistoricalRun'] == 'run1').all()
+
+        # Should leave out the excluded runs
+        assert fingerprint_store.compare_to_store(conn, samples[:1], new_loci, new[:1], {'run1'}).empty
+
+        # Samples without a patient should only be reported where they match
+        fingerprint_store.add_fingerprints(conn, [SampleRecord('s6', 'run3', None)], loci, stored[5:])
+        missing = fingerprint_store.compare_to_store(conn, [SampleRecord('n3', 'run2', float('nan'))], loci, stored[5:])
+        assert missing[['HistoricalSample', 'Status']].values.tolist() == [['s5', 'Unexpected Match'],
+                                                                           ['s6', 'Unexpected Match']]
+        conn.close()
+
+    def test_find_sex_from_interval(self):
+        # Should sum the coverage of the SRY and USP9Y intervals of each sample, with or without a pool of processes,
+        # whether the chromosome is named Y or chrY
+        for sample, coverage, chromosome in [('male', 30, 'Y'), ('female', 20, 'Y'), ('male_chr', 30, 'chrY')]:
+            write_csv('./test_output/{}-intervals.txt'.format(sample), [
+                ['1', '100', '220', 'Tiling_TP53_17:7577001', '121', '999', '0', '0'],
+                [chromosome, '2655301', '2655421', 'Tiling_SRY_Y:2655301', '121', str(coverage), '0', '0'],
+                [chromosome, '14891501', '14891621', 'Tiling_USP9Y_Y:14891501', '121', str(coverage), '0', '0'],
+            ])
+        sex = sorted(find_sex_from_interval('./test_output'))
+        assert sex == [['female-intervals.txt', 'Female'], ['male-intervals.txt', 'Male'],
+                       ['male_chr-intervals.txt', 'Male']]
+        assert sorted(find_sex_from_interval('./test_output', threads=2)) == sex
+
+    def test_compare_genotype(self):
+        # Should count matching and mismatching sites of each pair of samples
+        title_file = './test_output/title_file.txt'
+        with open(title_file, 'w') as f:
+            f.write('Pool\tBarcode\tSample\tCollab_ID\tPatient_ID\tClass\n')
+            f.write('P1\tbc1\tsampleA\tcA\tpatient1\tTumor\n')
+            f.write('P1\tbc2\tsampleB\tcB\tpatient2\tTumor\n')
+        all_geno = [
+            ['Sample'] + ['locus{}'.format(i) for i in range(12)],
+            ['sampleA_cl_aln-pileup.txt'] + ['A'] * 10 + ['Het'] * 2,
+            ['sampleB_cl_aln-pileup.txt'] + ['A'] * 8 + ['C', 'Het', 'Het', 'G'],
+        ]
+        geno_compare = compare_genotype(all_geno, 12, './test_output/', title_file)
+        rows = {(g[0], g[1]): g[2:] for g in geno_compare[1:]}
+
+        assert rows[('sampleA', 'sampleB')] == [9, 8, 1, 1, 2, 11, 1 / (11 + 1e-9), 'Expected Mismatch']
+        assert rows[('sampleB', 'sampleA')][:6] == [9, 8, 1, 1, 2, 11]
+        assert rows[('sampleA', 'sampleA')] == [13, 11, 0, 2, 0, 11, 0.0, 'Expected Match']
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from python_tools.maf_reader import read_maf, read_maf_chunks
+
+
+MAF = (
+    '#version 2.4\n'
+    'Hugo_Symbol\tChromosome\tStart_Position\tVariant_Classification\tt_alt_count_fragment\tHGVSp_Short\n'
+    'MET\t7\t116411990\tIntron\t3\t\n'
+    'TERT\t5\t1295228\t5\'Flank\t0\t\n'
+)
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.maf_file = os.path.join(self.tmp_dir, 'test.maf')
+        with open(self.maf_file, 'w') as f:
+            f.write(MAF)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_declared_dtypes(self):
+        df = read_maf(self.maf_file, header=1)
+        # Chromosome is read as a string even though every value looks numeric
+        assert df['Chromosome'].tolist() == ['7', '5']
+        assert df['Start_Position'].dtype == np.int64
+        assert df['t_alt_count_fragment'].dtype == np.int64
+        # Undeclared, all-empty columns are still inferred
+        assert df['HGVSp_Short'].isnull().all()
+
+    def test_empty_counts(self):
+        # Fragment counts that are blank for some variants are read as float NaN, as before
+        maf_file = os.path.join(self.tmp_dir, 'empty_counts.maf')
+        with open(maf_file, 'w') as f:
+            f.write('Chromosome\tStart_Position\tt_ref_count_fragment\tt_alt_count_fragment\tt_total_count_fragment\n')
+            f.write('1\t100\t10\t2\t12\n')
+            f.write('1\t200\t\t\t\n')
+        df = read_maf(maf_file, header=0)
+        assert df['t_alt_count_fragment'].dtype == np.float64
+        assert df['t_alt_count_fragment'].tolist()[0] == 2
+        assert df[['t_ref_count_fragment', 't_alt_count_fragment', 't_total_count_fragment']].iloc[1].isnull().all()
+
+    def test_usecols_skips_missing_columns(self):
+        df = read_maf(self.maf_file, usecols=['Chromosome', 'Start_Position', 'Not_A_Column'], header=1)
+        assert df.columns.tolist() == ['Chromosome', 'Start_Position']
+
+    def test_categorical_and_str(self):
+        df = read_maf(self.maf_file, categorical=True, header=1)
+        assert df['Variant_Classification'].dtype.name == 'category'
+        assert (df['Hugo_Symbol'] == 'MET').tolist() == [True, False]
+
+        df = read_maf(self.maf_file, dtype=str, header=1)
+        assert df['Start_Position'].tolist() == ['116411990', '1295228']
+
+    def test_chunks_have_the_dtypes_of_the_whole_maf(self):
+        maf_file = os.path.join(self.tmp_dir, 'chunks.maf')
+        with open(maf_file, 'w') as f:
+            f.write('Chromosome\tStart_Position\tStatus\tn_vaf_fragment\n')
+            f.write('1\t100\t\t1\n')
+            f.write('1\t200\t\t\n')
+            f.write('2\t300\tInCurated;\t0.5\n')
+        whole = read_maf(maf_file, header=0)
+        chunks = list(read_maf_chunks(maf_file, 1, header=0))
+        assert len(chunks) == 3
+        for chunk in chunks:
+            pd.testing.assert_series_equal(chunk.dtypes, whole.dtypes)
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), whole)
+
+
+if __name__ == '__main__':
+    unittest.main()
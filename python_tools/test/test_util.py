@@ -1,5 +1,12 @@
+import os
+import re
+import random
+import shutil
+import tempfile
 import unittest
 
+import pandas as pd
+
 from python_tools import util
 
 
@@ -17,6 +24,60 @@ class Tests(unittest.TestCase):
         sample = util.extract_sample_name('I_am_a_sample_name', ['I_am_a', 'I_am_a_sample'])
         assert sample == 'I_am_a_sample'
 
+    def test_sample_name_resolver(self):
+        # Should match the same sample names as the regex substitution, from lists of
+        # sample names that are substrings of each other
+        rng = random.Random(0)
+        for _ in range(200):
+            sample_names = ['S' + ''.join(rng.choice('ab1-') for _ in range(rng.randint(0, 4))) for _ in range(5)]
+            strings = [
+                ''.join(rng.choice(['_', 'x', 'S', 'a', 'b', '1', '-'] + sample_names) for _ in range(rng.randint(0, 6)))
+                for _ in range(20)
+            ]
+            pattern = r'.*(' + r'|'.join(sorted(sample_names, key=len, reverse=True)) + r').*'
+            resolver = util.SampleNameResolver(sample_names, cache_size=5)
+            for string in strings + strings:
+                assert resolver(string) == re.sub(pattern, r'\1', string)
+
+        resolver = util.SampleNameResolver(['M-1234', 'M-5585'])
+        resolved = resolver.resolve(pd.Series(['M-1234_IGO', 'M-5585_IGO', 'M-1234_IGO', 'other'], index=[3, 2, 1, 0]))
+        assert resolved.tolist() == ['M-1234', 'M-5585', 'M-1234', 'other']
+        assert resolved.index.tolist() == [3, 2, 1, 0]
+
+    def test_get_positions(self):
+        # Should find the title file position of each fastq and sample sheet, choosing the longest
+        # sample ID when several are substrings of each other
+        title_file = pd.DataFrame({
+            util.TITLE_FILE__COLLAB_ID_COLUMN: ['sample_1', 'sample_2', 'sample_1a'],
+            util.TITLE_FILE__SAMPLE_ID_COLUMN: ['s1', 's2', 's1a'],
+        })
+        sample_objects = [
+            {'class': 'File', 'path': '/data/sample_1a/sample_1a_R1_001.fastq.gz'},
+            {'class': 'File', 'path': '/data/sample_2/sample_2_R1_001.fastq.gz'},
+            {'class': 'File', 'path': '/data/sample_1/SampleSheet.csv'},
+        ]
+        positions = util.get_positions(title_file, sample_objects, use_investigator_sample_id=True)
+        assert positions == [2, 1, 0]
+        assert [util.get_pos(title_file, s, use_investigator_sample_id=True) for s in sample_objects] == positions
+
+        with self.assertRaises(Exception):
+            util.get_positions(title_file, [{'class': 'File', 'path': '/data/sample_1_sample_2_R1_001.fastq.gz'}], True)
+
+    def test_read_chromosome_rows(self):
+        # Should read the rows of one chromosome, also when they are not consecutive, without writing next to the file
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            waltz_file = os.path.join(tmp_dir, 'sample-pileup.txt')
+            with open(waltz_file, 'w') as f:
+                f.write('1\t10\tA\nY\t20\tC\nY\t30\tG\nX\t40\tT\nYY\t45\tT\nY\t50\tA\n')
+
+            expected = [['Y', '20', 'C'], ['Y', '30', 'G'], ['Y', '50', 'A']]
+            assert util.read_chromosome_rows(waltz_file, 'Y') == expected
+            assert util.read_chromosome_rows(waltz_file, 'MT') == []
+            assert os.listdir(tmp_dir) == ['sample-pileup.txt']
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_all_strings_are_substrings(self):
         sample_1 = 'SampleABC'
         sample_2 = 'SampleABCD'
@@ -34,5 +95,26 @@ class Tests(unittest.TestCase):
         are_substrings = util.all_strings_are_substrings([sample_1, sample_2, sample_3])
         assert are_substrings == False
 
+    def test_vcf_to_maf_coords(self):
+        # Column-wise conversion should match the per-variant conversion on random alleles,
+        # including shared prefixes and alleles that already contain "-"
+        rng = random.Random(0)
+
+        def allele():
+            bases = 'ACGT-' if rng.random() < 0.05 else 'ACGT'
+            return ''.join(rng.choice(bases) for _ in range(rng.choice([1, 1, 1, 2, 3, 4, 7])))
+
+        variants = []
+        for _ in range(20000):
+            ref = allele()
+            alt = ref[:rng.randint(0, len(ref))] + allele() if rng.random() < 0.5 else allele()
+            variants.append((str(rng.randint(2, 10 ** 8)), ref, alt))
+        variants.extend([('100', 'A', 'A'), ('100', 'AC', 'AC'), ('100', 'ACGT', 'A'), ('100', 'A', 'ACGT')])
+
+        starts, refs, alts = zip(*variants)
+        coords = util.vcf_to_maf_coords(starts, refs, alts)
+        assert coords.columns.tolist() == util.VCF_TO_MAF_COLUMNS
+        assert list(coords.itertuples(index=False, name=None)) == [util.vcf_to_maf_coord(*v) for v in variants]
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,10 @@
+import os
 import re
 import sys
 import logging
+import tempfile
 import subprocess
+from collections import OrderedDict
 import ruamel.yaml
 import numpy as np
 import pandas as pd
@@ -39,6 +42,58 @@ def to_csv(df, filename):
     df.to_csv(filename, sep="\t", index=False)
 
 
+def read_parsed_cache(cache_file, source_file):
+    """
+    Return the object cached for source_file, or None if the cache is missing or older than the source
+
+    :param cache_file: path to the cache written by write_parsed_cache()
+    :param source_file: path to the file that was parsed
+    """
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        cache = pd.read_pickle(cache_file)
+        source = os.stat(source_file)
+        if cache["source_mtime"] == source.st_mtime and cache["source_size"] == source.st_size:
+            return cache["parsed"]
+    except Exception as e:
+        logging.warning("Ignoring unreadable cache {}: {}".format(cache_file, e))
+    return None
+
+
+def write_parsed_cache(cache_file, source_file, parsed):
+    """
+    Atomically write the parsed form of source_file, the cache is skipped if the location is not writable
+
+    :param cache_file: path of the cache
+    :param source_file: path to the file that was parsed
+    :param parsed: picklable object
+    """
+    source = os.stat(source_file)
+    cache = {"source_mtime": source.st_mtime, "source_size": source.st_size, "parsed": parsed}
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)))
+        os.close(fd)
+        pd.to_pickle(cache, tmp_file)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError) as e:
+        logging.warning("Could not write cache {}: {}".format(cache_file, e))
+
+
+def read_chromosome_rows(waltz_file, chromosome):
+    """
+    Read the rows of one chromosome of a Waltz pileup or intervals file, where the chromosome is the first column.
+    Rows are matched as bytes, so that only the rows of the chromosome are decoded and split.
+
+    :param waltz_file: path to the tab-delimited file
+    :param chromosome: str e.g. "Y"
+    :return: list of rows, as lists of str
+    """
+    prefix = (chromosome + "\t").encode()
+    with open(waltz_file, "rb") as f:
+        return [line.decode().rstrip("\r\n").split("\t") for line in f if line.startswith(prefix)]
+
+
 def extract_sample_name(has_a_sample, sample_names):
     """
     Useful for matching sample names in larger strings such as fastq file names.
@@ -46,14 +101,63 @@ def extract_sample_name(has_a_sample, sample_names):
     Note that we must sort the samples names by length in order to return the longest match:
     e.g. sample_abc123-IGO-XXX, [sample_abc123, sample_abc12] --> sample_abc123
 
+    When matching many strings against the same sample names, use a SampleNameResolver instead.
+
     :param: has_a_sample String that has a Sample ID inside (usually a file path)
     :param: sample_names String[] that contains all possible sample IDs to be found in `has_a_sample`
             Note that if the target sample ID is not in this list, the wrong sample ID may be returned.
     """
-    sample_names = sorted(sample_names, key=len, reverse=True)
-    sample_name_search = r"|".join(sample_names)
-    sample_name_search = r".*(" + sample_name_search + ").*"
-    return re.sub(sample_name_search, r"\1", has_a_sample)
+    return SampleNameResolver(sample_names, cache_size=0)(has_a_sample)
+
+
+class SampleNameResolver(object):
+    """
+    Match sample names in larger strings with the same rules as `extract_sample_name`,
+    but with the search pattern built once for a list of sample names, and a bounded cache
+    of the most recent lookups.
+
+    e.g. resolver = SampleNameResolver(title_file[SAMPLE_ID_COLUMN])
+         resolver('sample_abc123-IGO-XXX_cl_aln-pileup.txt') --> sample_abc123
+    """
+
+    def __init__(self, sample_names, cache_size=4096):
+        """
+        :param sample_names: String[] that contains all possible sample IDs
+        :param cache_size: int maximum number of memoized lookups
+        """
+        # Longest names first, so that the longest match is returned
+        sample_names = sorted(sample_names, key=len, reverse=True)
+        # The greedy prefix makes the last sample name found in the string win
+        self._search = re.compile(r".*(" + r"|".join(sample_names) + r")")
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def __call__(self, has_a_sample):
+        """
+        :param has_a_sample: String that has a Sample ID inside (usually a file path)
+        :return: the Sample ID, or `has_a_sample` unchanged if no sample name is found in it
+        """
+        try:
+            # Popped and reinserted to mark it as the most recent lookup
+            sample_name = self._cache.pop(has_a_sample)
+        except KeyError:
+            match = self._search.match(has_a_sample)
+            sample_name = match.group(1) if match else has_a_sample
+        if self._cache_size:
+            if len(self._cache) >= self._cache_size:
+                self._cache.popitem(last=False)
+            self._cache[has_a_sample] = sample_name
+        return sample_name
+
+    def resolve(self, series):
+        """
+        Match each distinct value of a pd.Series once
+
+        :param series: pd.Series of strings that have a Sample ID inside
+        :return: pd.Series of Sample IDs, with the same index
+        """
+        sample_names = {s: self(s) for s in series.unique()}
+        return series.map(sample_names)
 
 
 def two_strings_are_substrings(string1, string2):
@@ -91,6 +195,8 @@ def merge_files_across_samples(files, cols, sample_ids=None, **kwargs):
     Helper to merge sample files and add in sample name as a new column
     """
     all_dataframes = []
+    if sample_ids is not None:
+        resolve_sample_name = SampleNameResolver(sample_ids)
     for f in files:
         new = read_df(f, **kwargs)
         logging.info(new.head())
@@ -100,7 +206,7 @@ def merge_files_across_samples(files, cols, sample_ids=None, **kwargs):
 
         # Attempt to extract sample ID if list of ids provided
         if sample_ids is not None:
-            sample_id = extract_sample_name(f, sample_ids)
+            sample_id = resolve_sample_name(f)
         else:
             sample_id = extract_sample_id_from_bam_path(f)
         new.insert(0, SAMPLE_ID_COLUMN, sample_id)
@@ -177,6 +283,166 @@ def reverse_complement(sequence):
     return "".join(complement.get(base) for base in reversed(sequence))
 
 
+def variant_type(Ref, Alt):
+    """
+    get variant type based on maf formatted ref and alt
+    """
+    if len(Ref) > len(Alt):
+        return "DEL"
+    elif len(Ref) < len(Alt):
+        return "INS"
+    else:
+        snv_types = {1: "SNP", 2: "DNP", 3: "TNP"}
+        if len(Ref) > 3:
+            return "ONP"
+        else:
+            return snv_types[len(Ref)]
+
+
+def vcf_to_maf_coord(Start, Ref, Alt):
+    """
+    transform ref,alt,pos to maf format following vcf2maf rules
+
+    :return: (Start_Position, End_Position, Reference_Allele, Tumor_Seq_Allele2, Variant_Type)
+    """
+    maf_start, maf_ref, maf_alt = int(Start), Ref, Alt
+    ref_length, alt_length = len(Ref), len(Alt)
+    while all([maf_ref, maf_alt, maf_ref[0] == maf_alt[0], maf_ref != maf_alt]):
+        maf_ref = maf_ref[1:] or "-"
+        maf_alt = maf_alt[1:] or "-"
+        ref_length -= 1
+        alt_length -= 1
+        maf_start += 1
+
+    # Handle SNPs, DNPs, TNPs, or anything larger (ONP)
+    if ref_length == alt_length:
+        return (
+            str(maf_start),
+            str(maf_start + alt_length - 1),
+            maf_ref,
+            maf_alt,
+            variant_type(maf_ref, maf_alt),
+        )
+    # Handle complex and non-complex deletions
+    elif ref_length > alt_length:
+        return (
+            str(maf_start),
+            str(maf_start + ref_length - 1),
+            maf_ref,
+            maf_alt,
+            "DEL",
+        )
+    # Handle complex and non-complex insertions
+    else:
+        maf_stop = str(maf_start + ref_length - 1) if maf_ref != "-" else str(maf_start)
+        maf_start = str(maf_start - 1) if maf_ref == "-" else str(maf_start)
+        return (maf_start, maf_stop, maf_ref, maf_alt, "INS")
+
+
+VCF_TO_MAF_COLUMNS = [
+    "Start_Position",
+    "End_Position",
+    "Reference_Allele",
+    "Tumor_Seq_Allele2",
+    "Variant_Type",
+]
+
+
+def vcf_to_maf_coords(Start, Ref, Alt):
+    """
+    Column-wise vcf_to_maf_coord.
+
+    The shared prefix of each ref and alt pair is found one base position at a
+    time over the pairs that still match, so SNVs drop out after the first
+    comparison. Alleles that are empty or already contain "-" are converted
+    with vcf_to_maf_coord.
+
+    :param Start: iterable of vcf positions
+    :param Ref: iterable of vcf reference alleles
+    :param Alt: iterable of vcf alternate alleles
+    :return: pd.DataFrame with string columns Start_Position, End_Position,
+        Reference_Allele, Tumor_Seq_Allele2 and Variant_Type, in input order
+    """
+    start = np.array(list(Start)).astype(np.int64)
+    ref = pd.Series(list(Ref), dtype=object)
+    alt = pd.Series(list(Alt), dtype=object)
+    ref_length = np.fromiter(map(len, ref.values), dtype=np.int64, count=len(ref))
+    alt_length = np.fromiter(map(len, alt.values), dtype=np.int64, count=len(alt))
+    rowwise = (
+        (ref_length == 0)
+        | (alt_length == 0)
+        | np.fromiter(
+            ("-" in r or "-" in a for r, a in zip(ref.values, alt.values)),
+            dtype=bool,
+            count=len(ref),
+        )
+    )
+
+    # length of the shared prefix, left at 0 when ref and alt are identical.
+    #  Two different single bases share no prefix, so only longer alleles are compared.
+    prefix_length = np.zeros(len(ref), dtype=np.int64)
+    matching = np.flatnonzero(
+        ~rowwise
+        & ((ref_length > 1) | (alt_length > 1))
+        & (ref.values != alt.values)
+    )
+    position = 0
+    while matching.size:
+        matching = matching[
+            ref.iloc[matching].str[position].values
+            == alt.iloc[matching].str[position].values
+        ]
+        prefix_length[matching] += 1
+        position += 1
+
+    trimmed = np.flatnonzero(prefix_length)
+    maf_ref = ref.values.copy()
+    maf_alt = alt.values.copy()
+    maf_ref[trimmed] = [
+        r[i:] or "-" for r, i in zip(maf_ref[trimmed], prefix_length[trimmed])
+    ]
+    maf_alt[trimmed] = [
+        a[i:] or "-" for a, i in zip(maf_alt[trimmed], prefix_length[trimmed])
+    ]
+    maf_start = start + prefix_length
+    ref_length = ref_length - prefix_length
+    alt_length = alt_length - prefix_length
+
+    is_ins = ref_length < alt_length
+    is_del = ref_length > alt_length
+    ref_deleted = maf_ref == "-"
+    maf_stop = np.where(
+        is_del,
+        maf_start + ref_length - 1,
+        np.where(
+            is_ins & ref_deleted, maf_start, maf_start + np.maximum(ref_length, 1) - 1
+        ),
+    )
+    maf_stop = np.where(is_ins | is_del, maf_stop, maf_start + alt_length - 1)
+    maf_start = np.where(is_ins & ref_deleted, maf_start - 1, maf_start)
+    # snv types by length, anything larger is an ONP
+    snv_type = np.array(["", "SNP", "DNP", "TNP", "ONP"], dtype=object)[
+        np.clip(alt_length, 0, 4)
+    ]
+    maf_type = np.where(is_del, "DEL", np.where(is_ins, "INS", snv_type))
+
+    coords = [
+        np.array(list(map(str, maf_start.tolist())), dtype=object),
+        np.array(list(map(str, maf_stop.tolist())), dtype=object),
+        maf_ref,
+        maf_alt,
+        maf_type.astype(object),
+    ]
+    for i in np.flatnonzero(rowwise):
+        for column, value in zip(
+            coords, vcf_to_maf_coord(start[i], ref.iloc[i], alt.iloc[i])
+        ):
+            column[i] = value
+    return pd.DataFrame(
+        dict(zip(VCF_TO_MAF_COLUMNS, coords)), columns=VCF_TO_MAF_COLUMNS
+    )
+
+
 def autolabel(bars, plt, text_format="%.5f"):
     """
     Attach a text label above each bar displaying its height
@@ -374,16 +640,32 @@ def get_pos(title_file, sample_object, use_investigator_sample_id=False):
     :raise Exception: if more than one sample ID in the `title_file` matches this fastq file, or if no sample ID's
             in the `title_file` match this fastq file
     """
+    return get_positions(title_file, [sample_object], use_investigator_sample_id)[0]
 
-    def contained_in(sample_id, file_path):
-        """
-        Helper method to sort list of fastqs.
-        Returns 1 if `sample_id` contained in `fastq`'s path, 0 otherwise
-        """
+
+def get_positions(title_file, sample_objects, use_investigator_sample_id=False):
+    """
+    Return the position of each of `sample_objects` in `title_file`, as `get_pos` does,
+    with the sample IDs of the title file extracted once for all of the paths
+
+    :param: title_file pandas.DataFrame with all required title_file columns (see constants.py)
+    :param: sample_objects list of dicts with `class`: `File` and `path`: string
+    :param use_investigator_sample_id: Whether to use the investigator_sample_id column instead of the sample_id column
+    :return: list of positions, in the order of `sample_objects`
+    """
+    if use_investigator_sample_id:
+        sample_ids = title_file[TITLE_FILE__COLLAB_ID_COLUMN].tolist()
+    else:
+        sample_ids = title_file[TITLE_FILE__SAMPLE_ID_COLUMN].tolist()
+    fastq_sample_ids = [sample_id + SAMPLE_SEP_FASTQ_DELIMETER for sample_id in sample_ids]
+
+    positions = []
+    for sample_object in sample_objects:
+        file_path = sample_object["path"]
         if file_path.endswith(".fastq.gz"):
-            found = sample_id + SAMPLE_SEP_FASTQ_DELIMETER in file_path
+            searched_ids = fastq_sample_ids
         elif file_path.endswith("SampleSheet.csv"):
-            found = sample_id in file_path
+            searched_ids = sample_ids
         else:
             raise Exception(
                 "Unrecognized file type {}. File type should be either fastq.qz or SampleSheet.csv.".format(
@@ -391,30 +673,26 @@ def get_pos(title_file, sample_object, use_investigator_sample_id=False):
                 )
             )
 
-        if found:
-            return 1
-        else:
-            return 0
+        # Single pass over the title file sample IDs for this path
+        matches = [i for i, sample_id in enumerate(searched_ids) if sample_id in file_path]
 
-    if use_investigator_sample_id:
-        boolv = title_file[TITLE_FILE__COLLAB_ID_COLUMN].apply(
-            contained_in, file_path=sample_object["path"]
-        )
-    else:
-        boolv = title_file[TITLE_FILE__SAMPLE_ID_COLUMN].apply(
-            contained_in, file_path=sample_object["path"]
-        )
-
-    if np.sum(boolv) > 1:
-        return check_multiple_sample_id_matches(title_file, boolv, sample_object)
+        if len(matches) > 1:
+            boolv = np.zeros(len(sample_ids), dtype=bool)
+            boolv[matches] = True
+            positions.append(
+                check_multiple_sample_id_matches(title_file, boolv, sample_object)
+            )
+            continue
 
-    # If there are no matches, issue a warning
-    if np.sum(boolv) < 1:
-        err_string = (
-            DELIMITER + "WARNING, matching sample ID for file {} not found in title file"
-        )
-        print(err_string.format(sample_object))
-        print("Please double check the order of the fastqs in the final inputs.yaml file")
+        # If there are no matches, issue a warning
+        if len(matches) < 1:
+            err_string = (
+                DELIMITER + "WARNING, matching sample ID for file {} not found in title file"
+            )
+            print(err_string.format(sample_object))
+            print("Please double check the order of the fastqs in the final inputs.yaml file")
+            positions.append(0)
+            continue
 
-    pos = np.argmax(boolv)
-    return pos
+        positions.append(matches[0])
+    return positions
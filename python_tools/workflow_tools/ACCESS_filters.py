@@ -6,29 +6,55 @@ Created on Tue Dec  4 18:10:40 2018
 """
 
 import argparse
+import copy
+import multiprocessing
 import os.path
 import pandas as pd
 import numpy as np
 import re
 
+from python_tools.constants import TUMOR_ID, NORMAL_ID
+from python_tools.maf_reader import read_maf
+from python_tools.util import read_parsed_cache, write_parsed_cache
+
 np.seterr(divide='ignore', invalid='ignore')
 
 mutation_key = ['Chromosome', 'Start_Position','End_Position','Reference_Allele','Tumor_Seq_Allele2']
 
+# Only these columns of the fillout are used, the genotyped allele is in Tumor_Seq_Allele1
+fillout_columns = ['Chromosome', 'Start_Position', 'End_Position', 'Reference_Allele', 'Tumor_Seq_Allele1', 'Tumor_Sample_Barcode', 't_ref_count_fragment', 't_alt_count_fragment']
+
+
+def empty_blacklist():
+    return pd.MultiIndex.from_arrays([[]] * len(mutation_key), names=mutation_key)
+
+
 def extract_blacklist(args):
+    """
+    Parse the blacklist into a MultiIndex on mutation_key, with every level stored as a string
+
+    If --blacklist_cache is given, the parsed index is cached there so that
+    repeated invocations across a scatter do not re-parse the TSV.
+    """
     header=['Chromosome','Start_Position','End_Position','Reference_Allele','Tumor_Seq_Allele','Annotation']
     if os.path.isfile(args.blacklist_file):
-        df_blacklist = pd.read_csv(args.blacklist_file,sep='\t', header=0)        
+        cache_file = getattr(args, 'blacklist_cache', '')
+        blacklist = read_parsed_cache(cache_file, args.blacklist_file) if cache_file else None
+        if blacklist is not None:
+            return blacklist
+
+        df_blacklist = pd.read_csv(args.blacklist_file,sep='\t', header=0, dtype=str, keep_default_na=False)
         if list(df_blacklist.columns.values)!=header:
             raise Exception('Blacklist provided is in the wrong formal, file should have the following in the header (in order):'+', '.join(header))
         else:
             df_blacklist.drop(['Annotation'], axis=1, inplace=True)
             df_blacklist.drop_duplicates(inplace=True)
-            blacklist=[str(b[0])+"_"+str(b[1])+"_"+str(b[2])+"_"+str(b[3])+"_"+str(b[4]) for b in df_blacklist.values.tolist()]
+            blacklist = pd.MultiIndex.from_arrays([df_blacklist[c].values for c in df_blacklist.columns], names=mutation_key)
+            if cache_file:
+                write_parsed_cache(cache_file, args.blacklist_file, blacklist)
             return blacklist
     elif args.blacklist_file=='':
-        blacklist =[]
-        return blacklist
+        return empty_blacklist()
     else:
         raise IOError('Blacklist file provided does not exist')
         
@@ -39,7 +65,7 @@ def convert_annomaf_to_df(args):
     
     if os.path.isfile(args.anno_maf):
         annotation_file = args.anno_maf
-        df_annotation = pd.read_csv(annotation_file,sep='\t', header=0)
+        df_annotation = read_maf(annotation_file, header=0)
         df_annotation['Chromosome'] = df_annotation['Chromosome'].astype(str)
         df_annotation.set_index(mutation_key, drop=False, inplace=True)
         #TODO: It is recommended to sort multi-Index using "df_annotation.sortlevel(inplace=True)" for performance but not sure of downsteams errors.. need to test
@@ -53,9 +79,11 @@ def convert_fillout_to_df(args):
     '''extract and stanardize a fillout file'''
     if os.path.isfile(args.fillout_maf):
         fillout_file = args.fillout_maf
-        df_full_fillout = pd.read_csv(fillout_file, sep='\t', header=0)
+        df_full_fillout = read_maf(fillout_file, usecols=fillout_columns, memory_map=True, header=0)
+        missing_columns = set(fillout_columns) - set(df_full_fillout.columns)
+        if missing_columns:
+            raise Exception('Fillout is missing the following columns: {}'.format(', '.join(missing_columns)))
         df_full_fillout['Chromosome'] = df_full_fillout['Chromosome'].astype(str)
-        df_full_fillout.drop('Tumor_Seq_Allele2', axis=1, inplace=True)
         df_full_fillout.rename(columns = {'Tumor_Seq_Allele1':'Tumor_Seq_Allele2'}, inplace=True)
         df_full_fillout.set_index(mutation_key, drop=False, inplace=True)
         return df_full_fillout
@@ -63,6 +91,16 @@ def convert_fillout_to_df(args):
         raise Exception('The path to the annotation MAF file does not exist')
 
 
+def combine_fillouts(df_fillouts):
+    '''
+    Combine the fillouts of several pairs, that genotyped the same bams, into one fillout of all their mutations
+
+    Mutations shared by several pairs are kept once per sample.
+    '''
+    df_full_fillout = pd.concat(df_fillouts)
+    return df_full_fillout[~df_full_fillout.duplicated(subset=mutation_key + ['Tumor_Sample_Barcode'])]
+
+
 def extract_fillout_type(df_full_fillout):
     def find_VAFandsummary(df_fillout): 
         df_fillout = df_fillout.copy()
@@ -124,32 +162,62 @@ def extract_fillout_type(df_full_fillout):
     return df_tumor, df_normal, df_ds_tumor, df_curated, df_ds_curated
   
    
-def create_fillout_summary(df_fillout, alt_thres):
-    try:
-        fillout_type = df_fillout['Fillout_Type'].iloc[0]
-        if fillout_type != '':
-            fillout_type = fillout_type+'_'
-    except:
-        print("The fillout provided to summarize was not run through extract_fillout_type")
-        fillout_type = ''
-        raise
-    
-    #Drop columns that are in the index to eliminate error
-    df_fillout.drop(mutation_key, inplace=True, axis=1)
-    # Make the dataframe with the fragment count summary of all the samples per mutation
-    summary_table = df_fillout.pivot_table(index=mutation_key, columns='Tumor_Sample_Barcode', values='summary_fragment', aggfunc=lambda x: ' '.join(x))
-
-    # Find the median VAF for the set
+def create_fillout_summaries(fillouts):
+    """
+    Summarize several fillouts with a single grouped aggregation
+
+    :param fillouts: list of (df_fillout, alt_thres) tuples, each fillout run through extract_fillout_type
+    :return: list of summary tables, one per fillout, with one column of fragment count summaries per
+        sample followed by the <Fillout_Type>_median_VAF, _n_fillout_sample_alt_detect and _n_fillout_sample columns
+    """
+    fillout_types = []
+    frames = []
+    for i, (df_fillout, alt_thres) in enumerate(fillouts):
+        try:
+            fillout_type = df_fillout['Fillout_Type'].iloc[0]
+            if fillout_type != '':
+                fillout_type = fillout_type+'_'
+        except:
+            print("The fillout provided to summarize was not run through extract_fillout_type")
+            fillout_type = ''
+            raise
+        fillout_types.append(fillout_type)
+
+        df = df_fillout[['Tumor_Sample_Barcode', 'summary_fragment', 't_vaf_fragment']].copy()
+        df['alt_detect'] = df_fillout['t_alt_count_fragment'] >= alt_thres
+        df['fillout'] = i
+        frames.append(df)
+
+    # Stack all fillouts, keyed on (mutation_key, fillout) so that each fillout is its own group
+    df_all = pd.concat(frames)
+    df_all.index = df_all.index.set_names(mutation_key)
+    df_all.set_index('fillout', append=True, inplace=True)
+    group_levels = mutation_key + ['fillout']
+
+    # Median VAF, number of samples with alt count above the threshold, and number of samples with coverage
+    # 't_vaf_fragment' column is NA for samples where mutation had no coverage, so count() will exclude it
     # Todo: handle case where t_vaf_fragment contains numpy.nan
-    summary_table[fillout_type + 'median_VAF'] = df_fillout.groupby(mutation_key)['t_vaf_fragment'].median()
+    stats = df_all.groupby(level=group_levels).agg({'t_vaf_fragment': ['median', 'count'], 'alt_detect': 'sum'})
 
-    # Find the number of samples with alt count above the threshold (alt_thres)
-    summary_table[fillout_type + 'n_fillout_sample_alt_detect'] = df_fillout.groupby(mutation_key)['t_alt_count_fragment'].aggregate(lambda x :(x>=alt_thres).sum())
+    # Make the dataframe with the fragment count summary of all the samples per mutation
+    summary_strings = df_all.set_index('Tumor_Sample_Barcode', append=True)['summary_fragment']
+    if not summary_strings.index.is_unique:
+        summary_strings = summary_strings.groupby(level=summary_strings.index.names).agg(' '.join)
+    summary_strings = summary_strings.unstack('Tumor_Sample_Barcode')
+
+    summary_tables = []
+    for i, fillout_type in enumerate(fillout_types):
+        summary_table = summary_strings.xs(i, level='fillout').dropna(axis=1, how='all')
+        fillout_stats = stats.xs(i, level='fillout')
+        summary_table[fillout_type + 'median_VAF'] = fillout_stats[('t_vaf_fragment', 'median')]
+        summary_table[fillout_type + 'n_fillout_sample_alt_detect'] = fillout_stats[('alt_detect', 'sum')].astype(int)
+        summary_table[fillout_type + 'n_fillout_sample'] = fillout_stats[('t_vaf_fragment', 'count')]
+        summary_tables.append(summary_table)
+    return summary_tables
 
-    # Find the number of sample with the Total Depth is >0
-    # 't_vaf_fragment' column is NA for samples where mutation had no coverage, so count() will exclude it
-    summary_table[fillout_type + 'n_fillout_sample'] = df_fillout.groupby(mutation_key)['t_vaf_fragment'].count()
-    return summary_table
+
+def create_fillout_summary(df_fillout, alt_thres):
+    return create_fillout_summaries([(df_fillout, alt_thres)])[0]
  
 
 def extract_tn_genotypes(df_tumor, df_normal, df_ds_tumor, t_samplename, n_samplename):
@@ -169,13 +237,23 @@ def extract_tn_genotypes(df_tumor, df_normal, df_ds_tumor, t_samplename, n_sampl
     return df_tn_genotype
 
 
-def make_pre_filtered_maf(args):
-    
-    df_annotation = convert_annomaf_to_df(args)
-    df_full_fillout = convert_fillout_to_df(args)
+def summarize_fillout(df_full_fillout, args):
+    """
+    Build the fillout genotypes and summaries, which are shared by every tumor/normal pair genotyped in the fillout
+
+    :return: (df_tumor, df_normal, df_ds_tumor, list of summary tables in the order they are merged into the MAF)
+    """
     df_tumor, df_normal, df_ds_tumor, df_curated, df_ds_curated=extract_fillout_type(df_full_fillout)
     
-    df_tumor_summary = create_fillout_summary (df_tumor, args.tumor_detect_alt_thres)
+    fillouts = [(df_tumor, args.tumor_detect_alt_thres),
+                (df_curated, args.curated_detect_alt_thres),
+                (df_ds_tumor, args.DS_tumor_detect_alt_thres),
+                (df_ds_curated, args.DS_curated_detect_alt_thres)]
+    if not df_normal.empty:
+        fillouts.append((df_normal, args.tumor_detect_alt_thres))
+    summaries = create_fillout_summaries(fillouts)
+    df_tumor_summary, df_curated_summary, df_ds_tumor_summary, df_ds_curated_summary = summaries[:4]
+
     #tag tumor sample names with Duplex    
     for f in list(df_tumor_summary):
         if f not in ['POOL_median_VAF','POOL_n_fillout_sample_alt_detect',  'POOL_n_fillout_sample']:
@@ -187,18 +265,36 @@ def make_pre_filtered_maf(args):
         df_normal_summary['NORMAL_n_fillout_sample_alt_detect']="no_normals_in_pool"
         df_normal_summary['NORMAL_n_fillout_sample']="no_normals_in_pool"
     else:
-        df_normal_summary = create_fillout_summary (df_normal, args.tumor_detect_alt_thres)
+        df_normal_summary = summaries[4]
         #tag normal as NORMAL        
         for f in list(df_normal_summary):
             if f not in ['NORMAL_median_VAF','NORMAL_n_fillout_sample_alt_detect',  'NORMAL_n_fillout_sample']:
                 df_normal_summary.rename(columns={f:f+'-NORMAL'}, inplace=True)
 
-    df_curated_summary = create_fillout_summary (df_curated, args.curated_detect_alt_thres)
-    df_ds_tumor_summary = create_fillout_summary (df_ds_tumor, args.DS_tumor_detect_alt_thres)
-    df_ds_curated_summary = create_fillout_summary (df_ds_curated, args.DS_curated_detect_alt_thres)
+    summary_tables = [df_tumor_summary, df_ds_tumor_summary, df_normal_summary, df_curated_summary, df_ds_curated_summary]
+    return df_tumor, df_normal, df_ds_tumor, summary_tables
+
+
+def merge_pre_filtered_maf(df_annotation, fillout_summary, tumor_samplename, normal_samplename):
+    """
+    Merge the annotated MAF of one tumor/normal pair with its genotypes and the fillout summaries
+
+    :param fillout_summary: result of summarize_fillout()
+    """
+    df_tumor, df_normal, df_ds_tumor, summary_tables = fillout_summary
+    df_tn_geno = extract_tn_genotypes(df_tumor, df_normal, df_ds_tumor, tumor_samplename, normal_samplename)
+    df_pre_filter = df_annotation.merge(df_tn_geno, left_index=True, right_index=True)
+    for summary_table in summary_tables:
+        df_pre_filter = df_pre_filter.merge(summary_table, left_index=True, right_index=True)
+    return df_pre_filter
+
+
+def make_pre_filtered_maf(args):
     
-    df_tn_geno = extract_tn_genotypes(df_tumor, df_normal, df_ds_tumor, args.tumor_samplename, args.normal_samplename)
-    df_pre_filter = df_annotation.merge(df_tn_geno, left_index=True, right_index=True).merge(df_tumor_summary, left_index=True, right_index=True).merge(df_ds_tumor_summary, left_index=True, right_index=True).merge(df_normal_summary, left_index=True, right_index=True).merge(df_curated_summary, left_index=True, right_index=True).merge(df_ds_curated_summary, left_index=True, right_index=True)
+    df_annotation = convert_annomaf_to_df(args)
+    df_full_fillout = convert_fillout_to_df(args)
+    fillout_summary = summarize_fillout(df_full_fillout, args)
+    df_pre_filter = merge_pre_filtered_maf(df_annotation, fillout_summary, args.tumor_samplename, args.normal_samplename)
  
     return df_pre_filter
 
@@ -209,7 +305,13 @@ def parse_arguments():
     parser.add_argument("--fillout_maf", help="Fillout File", required=True)
     parser.add_argument("--tumor_samplename", help="Tumor Samplename, must be the same as in the Fillout", required=True)
     parser.add_argument("--normal_samplename", help="Normal Samplename, must be the same as in the Fillout", required=True)
-    
+    add_filter_arguments(parser)
+
+    args = parser.parse_args()
+    return args
+
+
+def add_filter_arguments(parser):
     #Detected thresholds
     parser.add_argument("--tumor_detect_alt_thres", default=2, type=int, help="The Minimum Alt depth required to be considered detected in fillout")
     parser.add_argument("--curated_detect_alt_thres", default=2, type=int, help="The Minimum Alt depth required to be considered detected in fillout")
@@ -234,53 +336,63 @@ def parse_arguments():
     
     #Optional Blacklist
     parser.add_argument("--blacklist_file", default='', type=str, help="Filepath for Blacklist text file")
-
-    args = parser.parse_args()
-    return args
+    parser.add_argument("--blacklist_cache", default='', type=str, help="Filepath for a cache of the parsed Blacklist, not cached if not given")
 
 
 def apply_filter_maf (df_pre_filter, blacklist, args):
 ###=======FILTERS=======###
-    def tag_germline(mut, status, args):
+    # Each filter is evaluated column-wise over the whole frame and returns a list of
+    # (tag, boolean mask) pairs, in the order the tags should appear in the Status column
+    def tag_germline(df, args):
         #if there is a matched normal and it has sufficient coverage
-        if 'n_vaf_fragment' in mut.index.tolist() and mut['n_ref_count_fragment'] + mut['n_alt_count_fragment'] > args.normal_TD_min:
-            if mut['n_vaf_fragment'] > args.normal_vaf_germline_thres:
-                status = status + 'Germline;'
-        elif 'common_variant' in mut['FILTER'] and mut['t_ref_count_fragment'] + mut['t_alt_count_fragment'] > args.tumor_TD_min and mut['t_vaf_fragment'] > args.tumor_vaf_germline_thres:
-            status = status + 'LikelyGermline;'
-        return status
-       
-    def tag_below_alt_threshold(mut, status, args):
-        if mut['t_alt_count_fragment'] < args.tier_one_alt_min or (mut['hotspot_whitelist'] == False and mut['t_alt_count_fragment'] < args.tier_two_alt_min):
-            if mut['caller_t_alt_count']>= args.tier_two_alt_min or (mut['hotspot_whitelist'] == True and mut['caller_t_alt_count'] >= args.tier_one_alt_min):
-                status = status+'BelowAltThreshold;LostbyGenotyper;'
-            else:
-                status = status+'BelowAltThreshold;'
-        return status
+        if 'n_vaf_fragment' in df.columns:
+            normal_covered = (df['n_ref_count_fragment'] + df['n_alt_count_fragment']) > args.normal_TD_min
+            germline = normal_covered & (df['n_vaf_fragment'] > args.normal_vaf_germline_thres)
+        else:
+            normal_covered = pd.Series(False, index=df.index)
+            germline = normal_covered
+        likely_germline = ~normal_covered & \
+            df['FILTER'].astype(str).str.contains('common_variant', regex=False) & \
+            ((df['t_ref_count_fragment'] + df['t_alt_count_fragment']) > args.tumor_TD_min) & \
+            (df['t_vaf_fragment'] > args.tumor_vaf_germline_thres)
+        return [('Germline;', germline), ('LikelyGermline;', likely_germline)]
+
+    def tag_below_alt_threshold(df, args):
+        below = (df['t_alt_count_fragment'] < args.tier_one_alt_min) | \
+            ((df['hotspot_whitelist'] == False) & (df['t_alt_count_fragment'] < args.tier_two_alt_min))
+        lost = (df['caller_t_alt_count'] >= args.tier_two_alt_min) | \
+            ((df['hotspot_whitelist'] == True) & (df['caller_t_alt_count'] >= args.tier_one_alt_min))
+        return [('BelowAltThreshold;LostbyGenotyper;', below & lost), ('BelowAltThreshold;', below & ~lost)]
         # TODO: ASK MIKE: add truncated mutations to below threshold 'Nonsense_Mutation', 'Splice_Site', 'Frame_Shift_Ins', 'Frame_Shift_Del'
-        
-    def occurrence_in_curated (mut, status, args):
-        if mut['CURATED-DUPLEX_n_fillout_sample_alt_detect'] >= args.min_n_curated_samples_alt_detected:
-            status = status + 'InCurated;'
-        return status
-    
-    def occurrence_in_normal (mut, status, args):
+
+    def occurrence_in_curated (df, args):
+        return [('InCurated;', df['CURATED-DUPLEX_n_fillout_sample_alt_detect'] >= args.min_n_curated_samples_alt_detected)]
+
+    def occurrence_in_normal (df, args):
         #if normal and tumor coverage is greater than the minimal
-        if mut['t_ref_count_fragment'] + mut['t_alt_count_fragment'] > args.tumor_TD_min:
-            if mut['CURATED-DUPLEX_median_VAF'] != 0:
-                if mut['t_vaf_fragment'] / mut['CURATED-DUPLEX_median_VAF'] < args.tn_ratio_thres:
-                    status = status + 'TNRatio-curatedmedian;'
-            
-            if 'n_vaf_fragment' in mut.index.tolist():
-                if mut['n_ref_count_fragment'] + mut['n_alt_count_fragment'] > args.normal_TD_min and mut['n_vaf_fragment'] != 0:
-                    if mut['t_vaf_fragment'] / mut['n_vaf_fragment'] < args.tn_ratio_thres:
-                        status = status + 'TNRatio-matchnorm;'
-        return status
-    
-    def in_blacklist (mut, status, blacklist):
-        #if mutation is listed in blacklist
-        if str(mut['Chromosome'])+"_"+ str(mut['Start_Position'])+"_"+str(mut['End_Position'])+"_"+str(mut['Reference_Allele'])+"_"+str(mut['Tumor_Seq_Allele2']) in blacklist:
-            status = status + 'InBlacklist;'
+        tumor_covered = (df['t_ref_count_fragment'] + df['t_alt_count_fragment']) > args.tumor_TD_min
+        curated_median = df['CURATED-DUPLEX_median_VAF']
+        curated_ratio = tumor_covered & (curated_median != 0) & \
+            ((df['t_vaf_fragment'] / curated_median) < args.tn_ratio_thres)
+        tags = [('TNRatio-curatedmedian;', curated_ratio)]
+
+        if 'n_vaf_fragment' in df.columns:
+            normal_ratio = tumor_covered & \
+                ((df['n_ref_count_fragment'] + df['n_alt_count_fragment']) > args.normal_TD_min) & \
+                (df['n_vaf_fragment'] != 0) & \
+                ((df['t_vaf_fragment'] / df['n_vaf_fragment']) < args.tn_ratio_thres)
+            tags.append(('TNRatio-matchnorm;', normal_ratio))
+        return tags
+
+    def in_blacklist (df, blacklist):
+        #if mutation is listed in blacklist, joined on the string form of mutation_key
+        keys = pd.MultiIndex.from_arrays([df[k].astype(str).values for k in mutation_key], names=mutation_key)
+        return [('InBlacklist;', pd.Series(keys.isin(blacklist), index=df.index))]
+
+    def build_status(df, tags):
+        status = pd.Series('', index=df.index, dtype=object)
+        for tag, mask in tags:
+            status = status + np.where(mask.values, tag, '')
         return status
 
 ###=======Cleanup=======###
@@ -306,15 +418,12 @@ def apply_filter_maf (df_pre_filter, blacklist, args):
 ###=======RUN=======###
     df_post_filter = df_pre_filter.copy()
 
-    df_post_filter['Status'] = ''
-    for i, mut in df_post_filter.iterrows():
-        status = ''
-        status = tag_germline(mut, status, args)
-        status = tag_below_alt_threshold(mut, status, args)
-        status = occurrence_in_curated(mut, status, args)
-        status = occurrence_in_normal(mut, status, args)
-        status = in_blacklist (mut, status, blacklist)
-        df_post_filter.loc[i, 'Status'] = status
+    tags = tag_germline(df_post_filter, args) + \
+        tag_below_alt_threshold(df_post_filter, args) + \
+        occurrence_in_curated(df_post_filter, args) + \
+        occurrence_in_normal(df_post_filter, args) + \
+        in_blacklist(df_post_filter, blacklist)
+    df_post_filter['Status'] = build_status(df_post_filter, tags)
     
     df_post_filter=cleanup_post_filter(df_post_filter)
 
@@ -356,17 +465,116 @@ def make_condensed_post_filter (df_post_filter):
     return df_condensed
     
 
+def write_filtered_mafs(df_post_filter, df_condensed, maf_name):
+    full_outfile_name = os.path.basename(maf_name).replace('.maf', '_filtered.maf')
+    condensed_outfile_name = os.path.basename(maf_name).replace('.maf', '_filtered_condensed.maf')
+    df_post_filter.to_csv(full_outfile_name, header=True, index=None, sep='\t')
+    df_condensed.to_csv(condensed_outfile_name, header=True, index=None, sep='\t')
+    return full_outfile_name, condensed_outfile_name
+
+
 def main():
     args = parse_arguments()
     blacklist=extract_blacklist(args)
     df_pre_filter = make_pre_filtered_maf(args)
     df_post_filter = apply_filter_maf(df_pre_filter, blacklist, args)
     df_condensed = make_condensed_post_filter (df_post_filter)
+    write_filtered_mafs(df_post_filter, df_condensed, args.fillout_maf)
 
-    full_outfile_name = os.path.basename(args.fillout_maf).replace('.maf', '_filtered.maf')
-    condensed_outfile_name = os.path.basename(args.fillout_maf).replace('.maf', '_filtered_condensed.maf')
-    df_post_filter.to_csv(full_outfile_name, header=True, index=None, sep='\t')
-    df_condensed.to_csv(condensed_outfile_name, header=True, index=None, sep='\t')
+
+###=======BATCH MODE=======###
+# Blacklist and fillout summaries shared by every pair, set once in each worker process
+_batch_state = {}
+
+
+def init_batch_worker(args, blacklist, fillout_summary):
+    _batch_state['args'] = args
+    _batch_state['blacklist'] = blacklist
+    _batch_state['fillout_summary'] = fillout_summary
+
+
+def filter_pair(pair):
+    """
+    Filter the annotated MAF of one tumor/normal pair against the shared fillout summaries
+
+    :param pair: (tumor_samplename, normal_samplename, anno_maf)
+    :return: names of the _filtered.maf and _filtered_condensed.maf written for this pair
+    """
+    tumor_samplename, normal_samplename, anno_maf = pair
+    args = copy.copy(_batch_state['args'])
+    args.anno_maf = anno_maf
+    args.tumor_samplename = tumor_samplename
+    args.normal_samplename = normal_samplename
+
+    df_annotation = convert_annomaf_to_df(args)
+    df_pre_filter = merge_pre_filtered_maf(df_annotation, _batch_state['fillout_summary'], tumor_samplename, normal_samplename)
+    df_post_filter = apply_filter_maf(df_pre_filter, _batch_state['blacklist'], args)
+    df_condensed = make_condensed_post_filter(df_post_filter)
+    return write_filtered_mafs(df_post_filter, df_condensed, os.path.basename(anno_maf).replace('.maf', '_fillout.maf'))
+
+
+def read_pairing_file(pairing_file):
+    """
+    Read the tumor_id, normal_id and anno_maf columns of a tab-separated pairing file
+
+    A blank normal_id runs that tumor in unmatched mode.
+    """
+    df_pairing = pd.read_csv(pairing_file, sep='\t', comment='#', header=0, dtype=object)
+    columns = [TUMOR_ID, NORMAL_ID, 'anno_maf']
+    missing = [c for c in columns if c not in df_pairing.columns]
+    if missing:
+        raise Exception('Pairing file {} is missing the following columns: {}'.format(pairing_file, ', '.join(missing)))
+    df_pairing[NORMAL_ID] = df_pairing[NORMAL_ID].fillna('')
+    return [tuple(pair) for pair in df_pairing[columns].values.tolist()]
+
+
+def run_batch(args):
+    """
+    Filter every tumor/normal pair of the pairing file against one project-wide fillout
+
+    The fillout is parsed and summarized once; pairs are then filtered in a pool of args.threads processes.
+    Several fillouts of the same bams (e.g. one per pair) are combined into one.
+
+    :return: list of (_filtered.maf, _filtered_condensed.maf) names, in pairing file order
+    """
+    pairs = read_pairing_file(args.pairing_file)
+    blacklist = extract_blacklist(args)
+    fillout_mafs = args.fillout_maf if isinstance(args.fillout_maf, list) else [args.fillout_maf]
+    if len(fillout_mafs) > 1:
+        df_full_fillout = combine_fillouts([
+            convert_fillout_to_df(argparse.Namespace(fillout_maf=fillout_maf)) for fillout_maf in fillout_mafs
+        ])
+    else:
+        df_full_fillout = convert_fillout_to_df(argparse.Namespace(fillout_maf=fillout_mafs[0]))
+    fillout_summary = summarize_fillout(df_full_fillout, args)
+
+    if args.threads > 1:
+        pool = multiprocessing.Pool(args.threads, initializer=init_batch_worker, initargs=(args, blacklist, fillout_summary))
+        try:
+            outfiles = pool.map(filter_pair, pairs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        init_batch_worker(args, blacklist, fillout_summary)
+        outfiles = [filter_pair(pair) for pair in pairs]
+    return outfiles
+
+
+def parse_batch_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairing_file", help="Tab-separated file with tumor_id, normal_id and anno_maf columns, one row per tumor/normal pair. Outputs are named after each anno_maf", required=True)
+    parser.add_argument("--fillout_maf", nargs='+', help="Fillout File(s) with all samples of the pairing file, fillouts of the same bams are combined", required=True)
+    parser.add_argument("--threads", default=1, type=int, help="Number of pairs to filter in parallel")
+    add_filter_arguments(parser)
+
+    args = parser.parse_args()
+    return args
+
+
+def main_batch():
+    args = parse_batch_arguments()
+    run_batch(args)
 
 if __name__ == '__main__':
     main()
@@ -25,6 +25,12 @@ from python_tools.constants import (
     MAF_DUMMY_COLUMNS2,
     GNOMAD_COLUMNS,
 )
+from python_tools.maf_reader import read_maf, read_maf_chunks
+
+# Columns read from the MAF, named as they are after replacing "-" in CURATED- and NORMAL- headers
+MAF_COLUMNS_READ = frozenset(
+    MAF_COLUMNS_SELECT + MAF_DUMMY_COLUMNS2 + ["cosmic_ID", "cosmic_OCCURENCE", "Status"]
+)
 
 
 def add_dummy_columns(maf, columns):
@@ -38,10 +44,13 @@ def add_dummy_columns(maf, columns):
     return maf
 
 
-def maf2tsv(maf_file):
+def maf2tsv(maf_file, chunksize=None):
     """
     Select the most useful columns and map
     the columns to a different naming confirmation.
+
+    If chunksize is given, the MAF is read in chunks of that many variants
+    and an iterator over the formatted chunks is returned.
     """
 
     def get_exon(maf_exon, maf_intron):
@@ -80,141 +89,137 @@ def maf2tsv(maf_file):
         else:
             return ""
 
-    # Read in the mutation maf
-    try:
-        maf = pd.read_csv(maf_file, sep="\t", header=0)
-    except IOError:
-        raise
+    def is_column_read(column):
+        """
+        helper function to select only the MAF columns that are used
+        """
+        if column.startswith("CURATED-") or column.startswith("NORMAL-"):
+            column = column.replace("-", "_")
+        return column in MAF_COLUMNS_READ
 
-    # Replace "-" in column headers to "_" so that they can be
-    #  used as attributes to a variant object
-    incompatible_required_column_headers = filter(
-        lambda x: "-" in x and any([x.startswith("CURATED-"), x.startswith("NORMAL-")]),
-        maf.columns,
-    )
-    maf = maf.rename(
-        columns=dict(
-            zip(
-                incompatible_required_column_headers,
-                map(
-                    lambda x: x.replace("-", "_"), incompatible_required_column_headers
-                ),
+    def format_maf(maf):
+        """
+        helper function to select and compute the reported columns of a MAF dataframe
+        """
+        # Replace "-" in column headers to "_" so that they can be
+        #  used as attributes to a variant object
+        incompatible_required_column_headers = filter(
+            lambda x: "-" in x and any([x.startswith("CURATED-"), x.startswith("NORMAL-")]),
+            maf.columns,
+        )
+        maf = maf.rename(
+            columns=dict(
+                zip(
+                    incompatible_required_column_headers,
+                    map(
+                        lambda x: x.replace("-", "_"), incompatible_required_column_headers
+                    ),
+                )
             )
         )
-    )
-
-    # assign potential missing expected columns in MAF
-    # TODO: this can be removed once vep output is fixed
-    #  with gnomad output
-    maf = add_dummy_columns(maf, MAF_DUMMY_COLUMNS2)
 
-    # if a mutation does not have a flag for "Mutation_Status", classify it as Novel
-    maf["Mutation_Class"] = np.vectorize(lambda x: "Novel" if x is np.nan else "")(
-        maf["Status"]
-    )
-
-    # add modified cosmic column
-    maf["Cosmic_ID"] = np.vectorize(customize_cosmic, otypes=[str])(
-        maf["cosmic_ID"], maf["cosmic_OCCURENCE"]
-    )
+        # assign potential missing expected columns in MAF
+        # TODO: this can be removed once vep output is fixed
+        #  with gnomad output
+        maf = add_dummy_columns(maf, MAF_DUMMY_COLUMNS2)
 
-    #
-    try:
-        maf = maf[MAF_COLUMNS_SELECT]
-    except KeyError:
-        missing_columns = set(MAF_COLUMNS_SELECT) - set(maf.columns.values.tolist())
-        raise Exception(
-            "Following required columns are missing in the {}: {}".format(
-                maf_file, ",".join(missing_columns)
-            )
+        # if a mutation does not have a flag for "Mutation_Status", classify it as Novel
+        maf["Mutation_Class"] = np.vectorize(lambda x: "Novel" if x is np.nan else "")(
+            maf["Status"]
         )
 
-    # compute columns
-    maf["EXON"] = np.vectorize(get_exon, otypes=[str])(maf["EXON"], maf["INTRON"])
-    maf = maf.drop(["INTRON"], axis=1)
+        # add modified cosmic column
+        maf["Cosmic_ID"] = np.vectorize(customize_cosmic, otypes=[str])(
+            maf["cosmic_ID"], maf["cosmic_OCCURENCE"]
+        )
 
-    # Compute columns
-    # get max of gnomad
-    maf["gnomAD_Max_AF"] = np.nanmax(maf[GNOMAD_COLUMNS].values, axis=1)
+        #
+        try:
+            maf = maf[MAF_COLUMNS_SELECT]
+        except KeyError:
+            missing_columns = set(MAF_COLUMNS_SELECT) - set(maf.columns.values.tolist())
+            raise Exception(
+                "Following required columns are missing in the {}: {}".format(
+                    maf_file, ",".join(missing_columns)
+                )
+            )
 
-    # compute various mutation depth and vaf metrics
-    maf["D_t_count_fragment"] = (
-        maf["D_t_ref_count_fragment"] + maf["D_t_alt_count_fragment"]
-    )
-    maf["SD_t_count_fragment"] = (
-        maf["SD_t_ref_count_fragment"] + maf["SD_t_alt_count_fragment"]
-    )
-    maf["S_t_ref_count_fragment"] = (
-        maf["SD_t_ref_count_fragment"] - maf["D_t_ref_count_fragment"]
-    )
-    maf["S_t_alt_count_fragment"] = (
-        maf["SD_t_alt_count_fragment"] - maf["D_t_alt_count_fragment"]
-    )
-    maf["S_t_count_fragment"] = (
-        maf["S_t_ref_count_fragment"] + maf["S_t_alt_count_fragment"]
-    )
-    maf["n_count_fragment"] = maf["n_ref_count_fragment"] + maf["n_alt_count_fragment"]
-    maf["S_t_vaf_fragment"] = (
-        maf["S_t_alt_count_fragment"] / maf["S_t_count_fragment"]
-    ).fillna(0)
-    maf["SD_t_vaf_fragment_over_n_vaf_fragment"] = (
-        maf["SD_t_vaf_fragment"] / maf["n_vaf_fragment"]
-    ).fillna(0)
-
-    # convert NaN and inf computed values to 0
-    maf = maf.replace([np.inf, np.nan], 0)
-
-    # format SNP column
-    maf["dbSNP_RS"] = maf["dbSNP_RS"].apply(
-        lambda x: x if isinstance(x, str) and x.startswith("rs") else ""
-    )
+        # compute columns
+        maf["EXON"] = np.vectorize(get_exon, otypes=[str])(maf["EXON"], maf["INTRON"])
+        maf = maf.drop(["INTRON"], axis=1)
 
-    # generate occurrence stats columns
-    maf["CURATED_DUPLEX_n_fillout_sample"] = (
-        maf["CURATED_DUPLEX_n_fillout_sample_alt_detect"].map(str)
-        + ";"
-        + maf["CURATED_DUPLEX_median_VAF"].map(str)
-    )
-    maf["CURATED_SIMPLEX_DUPLEX_n_fillout_sample"] = (
-        maf["CURATED_SIMPLEX_DUPLEX_n_fillout_sample_alt_detect"].map(str)
-        + ";"
-        + maf["CURATED_SIMPLEX_DUPLEX_median_VAF"].map(str)
-    )
-    maf["NORMAL_n_fillout_sample"] = (
-        maf["NORMAL_n_fillout_sample_alt_detect"].map(str)
-        + ";"
-        + maf["NORMAL_median_VAF"].map(str)
-    )
-    return maf
+        # Compute columns
+        # get max of gnomad
+        maf["gnomAD_Max_AF"] = np.nanmax(maf[GNOMAD_COLUMNS].values, axis=1)
 
+        # compute various mutation depth and vaf metrics
+        maf["D_t_count_fragment"] = (
+            maf["D_t_ref_count_fragment"] + maf["D_t_alt_count_fragment"]
+        )
+        maf["SD_t_count_fragment"] = (
+            maf["SD_t_ref_count_fragment"] + maf["SD_t_alt_count_fragment"]
+        )
+        maf["S_t_ref_count_fragment"] = (
+            maf["SD_t_ref_count_fragment"] - maf["D_t_ref_count_fragment"]
+        )
+        maf["S_t_alt_count_fragment"] = (
+            maf["SD_t_alt_count_fragment"] - maf["D_t_alt_count_fragment"]
+        )
+        maf["S_t_count_fragment"] = (
+            maf["S_t_ref_count_fragment"] + maf["S_t_alt_count_fragment"]
+        )
+        maf["n_count_fragment"] = maf["n_ref_count_fragment"] + maf["n_alt_count_fragment"]
+        maf["S_t_vaf_fragment"] = (
+            maf["S_t_alt_count_fragment"] / maf["S_t_count_fragment"]
+        ).fillna(0)
+        maf["SD_t_vaf_fragment_over_n_vaf_fragment"] = (
+            maf["SD_t_vaf_fragment"] / maf["n_vaf_fragment"]
+        ).fillna(0)
+
+        # convert NaN and inf computed values to 0
+        maf = maf.replace([np.inf, np.nan], 0)
+
+        # format SNP column
+        maf["dbSNP_RS"] = maf["dbSNP_RS"].apply(
+            lambda x: x if isinstance(x, str) and x.startswith("rs") else ""
+        )
 
-def filter_maf(maf, ref_tx_file, project_name, outdir):
-    """
-    Parse a dataframe of annotated variants, add any required columns and 
-    classify them into exonic, silent, or nonpanel
-    """
+        # generate occurrence stats columns
+        maf["CURATED_DUPLEX_n_fillout_sample"] = (
+            maf["CURATED_DUPLEX_n_fillout_sample_alt_detect"].map(str)
+            + ";"
+            + maf["CURATED_DUPLEX_median_VAF"].map(str)
+        )
+        maf["CURATED_SIMPLEX_DUPLEX_n_fillout_sample"] = (
+            maf["CURATED_SIMPLEX_DUPLEX_n_fillout_sample_alt_detect"].map(str)
+            + ";"
+            + maf["CURATED_SIMPLEX_DUPLEX_median_VAF"].map(str)
+        )
+        maf["NORMAL_n_fillout_sample"] = (
+            maf["NORMAL_n_fillout_sample_alt_detect"].map(str)
+            + ";"
+            + maf["NORMAL_median_VAF"].map(str)
+        )
+        return maf
 
-    def format_var(variant):
-        """
-        Helper function to convert named tuple dervied from pandas df into tsv
-        """
-        try:
-            columns = map(lambda x: getattr(variant, x), MAF_TSV_COL_MAP.keys())
-            return "\t".join(map(str, columns)) + "\n"
-        except AttributeError:
-            missing_columns = set(MAF_TSV_COL_MAP.keys()) - set(
-                filter(lambda x: not x.startswith("_"), dir(variant))
-            )
-            raise Exception(
-                "Missing required columns: {}".format(",".join(missing_columns))
+    # Read in the mutation maf, in chunks of `chunksize` variants if it is given
+    try:
+        if chunksize:
+            return (
+                format_maf(chunk)
+                for chunk in read_maf_chunks(
+                    maf_file, chunksize, usecols=is_column_read, header=0
+                )
             )
+        return format_maf(read_maf(maf_file, usecols=is_column_read, header=0))
+    except IOError:
+        raise
 
-    def reformat_tx(txID, tx_df):
-        """
-        helper function to get reportable txID
-        """
-        return tx_df[tx_df.isoform == txID].refseq_id.values.tolist().pop()
 
+def read_transcripts(ref_tx_file):
+    """
+    Map each canonical isoform of the transcript file to its reportable refseq_id
+    """
     # Get transcript list from the user provided file
     try:
         tx = pd.read_csv(
@@ -231,70 +236,114 @@ def filter_maf(maf, ref_tx_file, project_name, outdir):
                 ",".join(["isoform", "gene_name", "refseq_id"])
             )
         )
-    tx_list = tx.isoform.values.tolist()
+    return dict(zip(tx.isoform.values.tolist(), tx.refseq_id.values.tolist()))
 
-    # TODO: This dummy columns block is to be removed at some point
-    maf = add_dummy_columns(maf, MAF_DUMMY_COLUMNS)
 
-    # Create exonic, silent, and nonpanel files.
-    with open(outdir + "/" + project_name + EXONIC_FILTERED, "w") as ef, open(
-        outdir + "/" + project_name + EXONIC_DROPPED, "w"
-    ) as ed, open(outdir + "/" + project_name + SILENT_FILTERED, "w") as sf, open(
-        outdir + "/" + project_name + SILENT_DROPPED, "w"
-    ) as sd, open(
-        outdir + "/" + project_name + NONPANEL_EXONIC_FILTERED, "w"
-    ) as nef, open(
-        outdir + "/" + project_name + NONPANEL_EXONIC_DROPPED, "w"
-    ) as ned, open(
-        outdir + "/" + project_name + NONPANEL_SILENT_FILTERED, "w"
-    ) as nsf, open(
-        outdir + "/" + project_name + NONPANEL_SILENT_DROPPED, "w"
-    ) as nsd:
+def classify_variants(maf, tx_map):
+    """
+    Split a dataframe of formatted variants into the exonic, silent and nonpanel outputs
 
-        # Print headers
-        map(
-            lambda f: f.write("\t".join(MAF_TSV_COL_MAP.values()) + "\n"),
-            [ef, ed, sf, sd, nsf, nsd, nef, ned],
+    :param maf: DataFrame returned by maf2tsv()
+    :param tx_map: dict returned by read_transcripts()
+    :return: dict of output file suffix to the DataFrame of variants to write to it
+    """
+    # flag exonic variants, along with the reported gene, variant class and position
+    exonic_class = [
+        IS_EXONIC_CLASS(gene, variant_class, position)
+        for gene, variant_class, position in zip(
+            maf["Hugo_Symbol"].tolist(),
+            maf["Variant_Classification"].tolist(),
+            maf["VCF_POS"].tolist(),
         )
+    ]
+    is_exonic = np.array([bool(c) for c in exonic_class], dtype=bool)
+    is_dropped = maf["Status"].values.astype(bool)
+    in_panel = maf["Transcript_ID"].isin(tx_map.keys()).values
+
+    # classify non-panel and non-canonical variants to filtered and dropped files
+    outputs = {
+        NONPANEL_EXONIC_DROPPED: maf[~in_panel & is_dropped & is_exonic],
+        NONPANEL_SILENT_DROPPED: maf[~in_panel & is_dropped & ~is_exonic],
+        NONPANEL_EXONIC_FILTERED: maf[~in_panel & ~is_dropped & is_exonic],
+        NONPANEL_SILENT_FILTERED: maf[~in_panel & ~is_dropped & ~is_exonic],
+    }
+
+    # panel variants are reported with the refseq id of their transcript
+    panel = maf[in_panel].copy()
+    panel["Transcript_ID"] = [tx_map[t] for t in panel["Transcript_ID"].tolist()]
+    panel_exonic = is_exonic[in_panel]
+    panel_dropped = is_dropped[in_panel]
+
+    # exonic variants
+    exonic = panel[panel_exonic].copy()
+    exonic_class = [c for c, panel_variant in zip(exonic_class, in_panel) if panel_variant and c]
+    for i, column in enumerate(["Hugo_Symbol", "Variant_Classification", "VCF_POS"]):
+        exonic[column] = [c[i] for c in exonic_class]
+    exonic_dropped = panel_dropped[panel_exonic]
+    outputs[EXONIC_DROPPED] = exonic[exonic_dropped]
+    outputs[EXONIC_FILTERED] = exonic[~exonic_dropped]
+
+    # silent variants
+    silent_dropped = panel_dropped[~panel_exonic]
+    outputs[SILENT_DROPPED] = panel[~panel_exonic][silent_dropped]
+    outputs[SILENT_FILTERED] = panel[~panel_exonic][~silent_dropped]
+    return outputs
+
+
+def format_variants(maf):
+    """
+    Convert the MAF_TSV_COL_MAP columns of a dataframe into tsv lines
+    """
+    missing_columns = set(MAF_TSV_COL_MAP.keys()) - set(maf.columns)
+    if missing_columns:
+        raise Exception(
+            "Missing required columns: {}".format(",".join(missing_columns))
+        )
+    columns = [
+        [str(value) for value in maf[column].tolist()]
+        for column in MAF_TSV_COL_MAP.keys()
+    ]
+    return ["\t".join(row) + "\n" for row in zip(*columns)]
 
-        # Iterate over the maf file and determine status of each variant
-        for variant in maf.itertuples():
-            # set flag to classify if a variant is exonic
-            is_exonic = IS_EXONIC_CLASS(
-                variant.Hugo_Symbol, variant.Variant_Classification, variant.VCF_POS
-            )
-            # classify non-panel and non-canonical variants to filtered and dropped files
-            if variant.Transcript_ID not in tx_list:
-                if variant.Status and is_exonic:
-                    ned.write(format_var(variant))
-                elif variant.Status:
-                    nsd.write(format_var(variant))
-                elif is_exonic:
-                    nef.write(format(variant))
-                else:
-                    nsf.write(format(variant))
-            # exonic variants
-            elif is_exonic:
-                variant_tuple = is_exonic
-                variant = variant._replace(
-                    Hugo_Symbol=variant_tuple[0],  # Gene
-                    Variant_Classification=variant_tuple[1],  # VariantClass
-                    VCF_POS=variant_tuple[2],  # Start coordinate
-                    Transcript_ID=reformat_tx(variant.Transcript_ID, tx),  # TranscriptID
-                )
-                if variant.Status:
-                    ed.write(format_var(variant))
-                else:
-                    ef.write(format_var(variant))
-            # silent variants
-            else:
-                variant = variant._replace(
-                    Transcript_ID=reformat_tx(variant.Transcript_ID, tx)
-                )
-                if variant.Status:
-                    sd.write(format_var(variant))
-                else:
-                    sf.write(format_var(variant))
+
+def filter_maf(maf, ref_tx_file, project_name, outdir):
+    """
+    Parse a dataframe of annotated variants, add any required columns and 
+    classify them into exonic, silent, or nonpanel
+
+    :param maf: DataFrame returned by maf2tsv(), or an iterator of such DataFrames
+        (maf2tsv() with a chunksize), in which case the variants are classified one chunk at a time
+    """
+    tx_map = read_transcripts(ref_tx_file)
+    if isinstance(maf, pd.DataFrame):
+        maf = [maf]
+
+    suffixes = [
+        EXONIC_FILTERED,
+        EXONIC_DROPPED,
+        SILENT_FILTERED,
+        SILENT_DROPPED,
+        NONPANEL_SILENT_FILTERED,
+        NONPANEL_SILENT_DROPPED,
+        NONPANEL_EXONIC_FILTERED,
+        NONPANEL_EXONIC_DROPPED,
+    ]
+
+    # Create exonic, silent, and nonpanel files.
+    files = dict((suffix, open(outdir + "/" + project_name + suffix, "w")) for suffix in suffixes)
+    try:
+        # Print headers
+        for suffix in suffixes:
+            files[suffix].write("\t".join(MAF_TSV_COL_MAP.values()) + "\n")
+
+        for chunk in maf:
+            # TODO: This dummy columns block is to be removed at some point
+            chunk = add_dummy_columns(chunk, MAF_DUMMY_COLUMNS)
+            for suffix, variants in classify_variants(chunk, tx_map).items():
+                files[suffix].writelines(format_variants(variants))
+    finally:
+        for f in files.values():
+            f.close()
 
 
 def get_project(titlefile):
@@ -339,6 +388,12 @@ def main():
         help="Directory for storing the final files; Default = pwd)",
         required=False,
     )
+    parser.add_argument(
+        "--chunksize",
+        help="Number of variants to read and classify at a time; Default = the whole MAF",
+        type=int,
+        required=False,
+    )
 
     args = parser.parse_args()
 
@@ -355,7 +410,7 @@ def main():
             raise
 
     # Filter and categorize variants
-    condensed_maf = maf2tsv(args.anno_maf)
+    condensed_maf = maf2tsv(args.anno_maf, args.chunksize)
     filter_maf(condensed_maf, args.canonical_tx_ref, args.project_name, args.outdir)
 
 
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Local SQLite store of the fingerprint genotypes of earlier runs.
+
+Every fingerprinting run adds the genotypes of its samples to the store, so that new samples can be compared
+against the whole historical cohort to catch sample swaps across runs.
+Genotypes are stored as the packed bitsets of genotype_matrix, against sites numbered in the order they are first
+recorded, so that fingerprints of runs with other sites can be compared.
+"""
+from __future__ import division
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from python_tools.workflow_tools.qc.genotype_matrix import GENOTYPE_PLANES, GenotypeMatrix, SampleRecord
+
+
+# Same thresholds as compare_genotype
+MIN_HOMOZYGOUS_SITES = 10
+DISCORDANCE_THRESHOLD = 0.05
+
+HISTORY_COLUMNS = ['Sample', 'HistoricalSample', 'HistoricalRun', 'HomozygousMismatch', 'HomozygousInRef',
+                   'DiscordanceRate', 'Status']
+
+
+def open_store(store_file):
+    """
+    Open the fingerprint store, creating its tables if needed
+
+    :param store_file: str path to the SQLite database
+    :return: sqlite3.Connection
+    """
+    conn = sqlite3.connect(store_file)
+    # Sites are numbered in the order they are first seen, so that earlier bitsets stay aligned
+    conn.execute('CREATE TABLE IF NOT EXISTS sites (Locus TEXT PRIMARY KEY, Site INTEGER NOT NULL UNIQUE)')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS fingerprints ('
+        'Sample TEXT NOT NULL, Run TEXT NOT NULL, Patient_ID TEXT, Sites INTEGER NOT NULL, Genotypes BLOB NOT NULL, '
+        'PRIMARY KEY (Sample, Run))'
+    )
+    conn.commit()
+    return conn
+
+
+def register_sites(conn, loci):
+    """
+    Number the new loci after the known ones
+
+    :param loci: list of str Chrom:Pos
+    :return: (int array with the site number of each locus, total number of sites)
+    """
+    known = dict(conn.execute('SELECT Locus, Site FROM sites').fetchall())
+    new_sites = [(locus, len(known) + i) for i, locus in enumerate(l for l in loci if l not in known)]
+    with conn:
+        conn.executemany('INSERT INTO sites (Locus, Site) VALUES (?, ?)', new_sites)
+    known.update(new_sites)
+    return np.array([known[locus] for locus in loci], dtype=np.int64), len(known)
+
+
+def add_fingerprints(conn, samples, loci, codes):
+    """
+    Record the genotypes of new samples, replacing earlier records of the same sample and run
+
+    :param samples: SampleRecord[] with the name, run and patient of each sample
+    :param loci: list of str Chrom:Pos
+    :param codes: int array of samples x loci genotype codes, -1 for no genotype
+    """
+    sites, n_sites = register_sites(conn, loci)
+    genotypes = GenotypeMatrix.from_codes(samples, codes, sites, n_sites)
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO fingerprints (Sample, Run, Patient_ID, Sites, Genotypes) VALUES (?, ?, ?, ?, ?)',
+            [(s.name, s.run, s.patient_id, n_sites, sqlite3.Binary(b.tobytes()))
+             for s, b in zip(genotypes.samples, genotypes.bits)]
+        )
+
+
+def load_fingerprints(conn, exclude_runs=()):
+    """
+    Get the recorded fingerprints, with their bitsets padded to the current number of sites
+
+    :param exclude_runs: runs that are left out
+    :return: GenotypeMatrix
+    """
+    n_sites = conn.execute('SELECT COUNT(*) FROM sites').fetchone()[0]
+    rows = [row for row in conn.execute('SELECT Sample, Run, Patient_ID, Genotypes FROM fingerprints')
+            if row[1] not in exclude_runs]
+    bits = np.zeros((len(rows), len(GENOTYPE_PLANES), (n_sites + 7) // 8), dtype=np.uint8)
+    for i, row in enumerate(rows):
+        stored = np.frombuffer(bytes(row[3]), dtype=np.uint8).reshape(len(GENOTYPE_PLANES), -1)
+        bits[i, :, :stored.shape[1]] = stored
+    return GenotypeMatrix([SampleRecord(*row[:3]) for row in rows], bits, n_sites)
+
+
+def compare_to_store(conn, samples, loci, codes, exclude_runs=()):
+    """
+    Compare new samples against every recorded fingerprint.
+    Pairs are reported if they match, or if they belong to the same patient.
+    Samples without a patient are only reported where they match.
+
+    :param samples: SampleRecord[] with the name and patient of each new sample, None for no patient
+    :param loci: list of str Chrom:Pos
+    :param codes: int array of samples x loci genotype codes, -1 for no genotype
+    :param exclude_runs: runs that are not compared against, e.g. the runs of the new samples
+    :return: pd.DataFrame with the columns of HISTORY_COLUMNS
+    """
+    sites, n_sites = register_sites(conn, loci)
+    query = GenotypeMatrix.from_codes(samples, codes, sites, n_sites)
+    history = load_fingerprints(conn, exclude_runs)
+    comparison = query.compare(history, counts=['hom_mismatch', 'hom_in_ref'])
+    mismatch, hom_in_ref = comparison['hom_mismatch'], comparison['hom_in_ref']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        discordance = np.where(hom_in_ref < MIN_HOMOZYGOUS_SITES, np.nan, mismatch / hom_in_ref)
+    matched = discordance < DISCORDANCE_THRESHOLD
+    # Patients are compared as integer codes, samples without a patient (code -1) are never expected to match
+    patients = pd.factorize(np.array([s.patient_id for s in query.samples + history.samples], dtype=object))[0]
+    expected = np.equal.outer(patients[:len(query)], patients[len(query):]) & (patients[:len(query)] >= 0)[:, None]
+
+    q, r = np.nonzero(matched | expected)
+    return pd.DataFrame({
+        'Sample': np.array([s.name for s in query.samples], dtype=object)[q],
+        'HistoricalSample': np.array([s.name for s in history.samples], dtype=object)[r],
+        'HistoricalRun': np.array([s.run for s in history.samples], dtype=object)[r],
+        'HomozygousMismatch': mismatch[q, r],
+        'HomozygousInRef': hom_in_ref[q, r],
+        'DiscordanceRate': discordance[q, r],
+        'Status': np.select([matched[q, r] & expected[q, r], matched[q, r]],
+                            ['Expected Match', 'Unexpected Match'], 'Unexpected Mismatch'),
+    }, columns=HISTORY_COLUMNS)
@@ -14,6 +14,8 @@ from __future__ import division
 import csv
 import logging
 import itertools
+import functools
+import multiprocessing
 import numpy as np
 import argparse
 import pandas as pd
@@ -21,7 +23,9 @@ from PyPDF2 import PdfFileMerger
 import os
 
 from python_tools.constants import *
-from python_tools.util import extract_sample_name, read_df, get_position_by_substring
+from python_tools.util import SampleNameResolver, read_df, get_position_by_substring, read_chromosome_rows
+from python_tools.workflow_tools.qc import fingerprint_store
+from python_tools.workflow_tools.qc.genotype_matrix import HET, GenotypeMatrix, SampleRecord
 
 import matplotlib
 
@@ -41,6 +45,11 @@ PDF_FILENAMES = [
 
 FINAL_PDF_FILENAME = 'FPFigures.pdf'
 
+# Seaborn font scale of the genotyping matrix and duplex contamination figures
+SEABORN_FONT_SCALE = .6
+
+FP_ALLELES = ['A', 'C', 'G', 'T']
+
 
 ###################
 # Helper Functions
@@ -77,10 +86,11 @@ def merge_pdf_in_folder(out_dir, filename):
 
     if len(pdfs) > 1:
         for pdf in pdfs:
-            merger.append(open(out_dir + pdf, 'rb'))
+            merger.append(out_dir + pdf)
 
         with open(out_dir + FINAL_PDF_FILENAME, 'wb') as fout:
             merger.write(fout)
+        merger.close()
     else:
         raise IOError('Error: ' + filename + ' not created, input folder does not have PDFs to merge')
 
@@ -100,17 +110,6 @@ def make_output_dir(output_dir, dir_name):
 ###################
 # Extract RawData Functions
 ###################
-def extract_pileup_files(input_dir):
-    listofpileups = []
-    if os.path.isdir(input_dir):
-        for pileupfile in os.listdir(input_dir):
-            if pileupfile.endswith("pileup.txt"):
-                listofpileups.append(input_dir + '/' + pileupfile)
-        return listofpileups
-    else:
-        raise IOError('Error: Input Directory with pileups does not exist')
-
-
 def create_fp_indices(config_file):
     # Import config file.
     try:
@@ -141,10 +140,15 @@ def extract_list_of_tumor_samples(titlefile):
     return listofsamples
 
 
-def concatenate_a_and_b_pileups(waltz_dir_a, waltz_dir_b, output_dir, dir_name, listofsamples=[]):
-    merged_dir = make_output_dir(output_dir, dir_name)
+def pair_a_and_b_pileups(waltz_dir_a, waltz_dir_b, listofsamples=[]):
+    """
+    Find the pool A and pool B pileups of each sample, listing each directory once.
+    A pair is read as the merged pileup of the sample by read_pileup, without writing a merged copy.
+
+    :param listofsamples: If you want to pair only some of the samples (i.e. Only Tumor Samples)
+    :return: list of (pool A pileup path, pool B pileup path)
+    """
     listofpileups = [p for p in os.listdir(waltz_dir_a) if p.endswith("-pileup.txt")]
-    # Added: If you want to concatenate only some of the samples (i.e. Only Tumor Samples)
     if listofsamples:
         newlistofpileups = []
         for s in listofsamples:
@@ -153,16 +157,27 @@ def concatenate_a_and_b_pileups(waltz_dir_a, waltz_dir_b, output_dir, dir_name,
                     newlistofpileups.append(p)
         listofpileups = newlistofpileups
 
+    pileups_b = set(os.listdir(waltz_dir_b))
+    paired_pileups = []
     for p in listofpileups:
-        if p in os.listdir(waltz_dir_b):
-            a = read_csv(waltz_dir_a + '/' + p)
-            b = read_csv(waltz_dir_b + '/' + p)
-            a.extend(b)
-            # this is not a uniq list. extractRawFP makes sure FP pileups are unique.
-            write_csv(merged_dir + '/' + p, a)
+        if p in pileups_b:
+            paired_pileups.append((waltz_dir_a + '/' + p, waltz_dir_b + '/' + p))
         else:
             raise IOError(p + " not in WaltzDirB so pileup not concatenated and sample not fingerprinted")
-    return merged_dir
+    return paired_pileups
+
+
+def read_pileup(pileupfile):
+    """
+    Stream the lines of a pileup file, or of a (pool A, pool B) pair of pileups one after the other
+
+    :param pileupfile: str path, or tuple of paths from pair_a_and_b_pileups
+    """
+    pileupfiles = pileupfile if isinstance(pileupfile, (tuple, list)) else [pileupfile]
+    for path in pileupfiles:
+        with open(path, 'r') as f:
+            for p in csv.reader(f, delimiter='\t'):
+                yield p
 
 
 ###################
@@ -170,26 +185,71 @@ def concatenate_a_and_b_pileups(waltz_dir_a, waltz_dir_b, output_dir, dir_name,
 ###################
 
 def extract_raw_fp(pileupfile, fp_indices):
-    pileup = read_csv(pileupfile)
+    """
+    Stream the pileup and keep the first line of each fingerprint position, in pileup order.
+    Reading stops as soon as every position of fp_indices has been found.
+
+    :param pileupfile: str path, or (pool A, pool B) pair of paths read as one merged pileup
+    :return: [[pileup file name], pileup lines of the fingerprint positions...]
+    """
     fpRaw = []
+    found = set()
+    pileup = read_pileup(pileupfile)
     for p in pileup:
-        if p[0] + ':' + p[1] in fp_indices.keys() and p[0] + ':' + p[1] not in [f[0] + ':' + f[1] for f in fpRaw]:
+        locus = p[0] + ':' + p[1]
+        if locus in fp_indices and locus not in found:
+            found.add(locus)
             fpRaw.append(p[0:8])
-    name = os.path.basename(pileupfile)
+            if len(found) == len(fp_indices):
+                break
+    # close the pileup if reading stopped early
+    pileup.close()
+    name = os.path.basename(pileupfile[0] if isinstance(pileupfile, (tuple, list)) else pileupfile)
     fpRaw.insert(0, [name])
     return fpRaw
 
 
-def find_fp_maf(listofpileups, fp_indices, fp_output_dir):
+def pool_map(function, items, threads=1):
+    """
+    Apply a module level function to each item, in a pool of `threads` processes when threads > 1
+
+    :return: list of results, in the order of items
+    """
+    if threads > 1 and len(items) > 1:
+        pool = multiprocessing.Pool(min(threads, len(items)))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
+    return [function(item) for item in items]
+
+
+def extract_all_raw_fp(listofpileups, fp_indices, threads=1):
+    """
+    Read each pileup once, in a pool of `threads` processes when threads > 1
+
+    :return: list of extract_raw_fp records, in the order of listofpileups
+    """
+    return pool_map(functools.partial(extract_raw_fp, fp_indices=fp_indices), listofpileups, threads)
+
+
+def find_fp_maf(listofpileups, fp_indices, fp_output_dir, all_fp_raw=None):
+    """
+    :param all_fp_raw: records from extract_all_raw_fp, the pileups are read if not given
+    """
     all_fp = []
     all_geno = []
     alleles = ['A', 'C', 'G', 'T']
     thres = 0.1
 
-    for pileupfile in listofpileups:
-        fp_raw = extract_raw_fp(pileupfile, fp_indices)
+    if all_fp_raw is None:
+        all_fp_raw = extract_all_raw_fp(listofpileups, fp_indices)
+
+    for fp_record in all_fp_raw:
         # writeCVS (fpOutputdir+'FP_counts.txt', fpRaw)
-        name = fp_raw.pop(0)
+        name = fp_record[0]
+        fp_raw = fp_record[1:]
 
         if all_fp == []:
             header = [fp_indices[eachfp[0] + ':' + eachfp[1]][2] for eachfp in fp_raw]
@@ -207,10 +267,7 @@ def find_fp_maf(listofpileups, fp_indices, fp_output_dir):
         all_fp.append(FPmAF)
         all_geno.append(FPGeno)
 
-        for p in fp_raw:
-            p.insert(0, name[0])
-
-        write_csv(fp_output_dir + 'FP_counts.txt', fp_raw)
+        write_csv(fp_output_dir + 'FP_counts.txt', [[name[0]] + p for p in fp_raw])
 
     write_csv(fp_output_dir + 'FP_mAF.txt', all_fp)
     write_csv(fp_output_dir + 'FP_Geno.txt', all_geno)
@@ -268,46 +325,44 @@ def compare_genotype(all_geno, n, fp_output_dir, titlefile):
         all_geno = all_geno[1::]
 
     all_geno = [a for a in all_geno if 'CELLFREEPOOLEDNORMAL' not in a[0]]
-    geno_compare = []
-    for i, Ref in enumerate(all_geno):
-        for Query in all_geno:
-            hm_Ref = 0
-            hm_match = 0
-            hm_mismatch = 0
-            ht_match = 0
-            ht_mismatch = 0
-            total_match = 0
-            for j, element in enumerate(Ref):
-                if element != 'Het':
-                    hm_Ref = hm_Ref + 1
-                if element == Query[j]:
-                    total_match = total_match + 1
-                    if element == 'Het':
-                        ht_match = ht_match + 1
-                    else:
-                        hm_match = hm_match + 1
-                elif element == 'Het' or Query[j] == 'Het':
-                    ht_mismatch = ht_mismatch + 1
-                elif j != 0:
-                    hm_mismatch = hm_mismatch + 1
-
-            sample_Ref = extract_sample_name(Ref[0], titlefile[TITLE_FILE__SAMPLE_ID_COLUMN])
-            sample_Query = extract_sample_name(Query[0], titlefile[TITLE_FILE__SAMPLE_ID_COLUMN])
-
-            ##To test
-            # sample_Ref = Ref[0].split("_IGO")[0]
-            # sample_Query = Query[0].split("_IGO")[0]
-
-            # Discordance rate between samples = Homozygous Mismatch/All Homozygous SNPs in Reference sample
-            # Check that there are more the 10 Homozygous sites, if not, there is probably a lack of coverage or a lot of contamination
-            if hm_Ref < 10:
-                discordance = np.nan
-            else:
-                discordance = hm_mismatch / (hm_Ref + EPSILON)
-
-            geno_compare.append(
-                [sample_Ref, sample_Query, total_match, hm_match, hm_mismatch, ht_match, ht_mismatch, hm_Ref,
-                 discordance])
+    sample_ids = [a[0] for a in all_geno]
+    resolver = SampleNameResolver(titlefile[TITLE_FILE__SAMPLE_ID_COLUMN])
+    sample_names = [resolver(a) for a in sample_ids]
+
+    # Pack the genotypes of each sample into bitsets, and count for every pair of samples
+    # the sites with the same and with different genotypes, with popcounts
+    genotypes = GenotypeMatrix.from_genotypes(sample_names, [a[1::] for a in all_geno])
+    comparison = genotypes.compare(genotypes)
+    ht_match = comparison['het_match']
+    ht_mismatch = comparison['het_mismatch']
+    hm_mismatch = comparison['hom_mismatch']
+    same = comparison['hom_match'] + ht_match
+    # The sample id column is compared as well: it matches for a sample against itself,
+    # and counts as a homozygous site of the reference sample
+    sample_ids = np.array(sample_ids, dtype=object)
+    same_id = np.equal.outer(sample_ids, sample_ids).astype(np.int64)
+    total_match = same + same_id
+    hm_match = comparison['hom_match'] + same_id
+    # Every site has a genotype, Het when it is not covered
+    hm_Ref = comparison['hom_in_ref'].T + 1
+
+    # Discordance rate between samples = Homozygous Mismatch/All Homozygous SNPs in Reference sample
+    # Check that there are more the 10 Homozygous sites, if not, there is probably a lack of coverage or a lot of contamination
+    discordance = np.where(hm_Ref < 10, np.nan, hm_mismatch / (hm_Ref + EPSILON))
+
+    geno_compare = [
+        list(row) for row in zip(
+            np.repeat(np.array(sample_names, dtype=object), len(all_geno)).tolist(),
+            sample_names * len(all_geno),
+            total_match.ravel().tolist(),
+            hm_match.ravel().tolist(),
+            hm_mismatch.ravel().tolist(),
+            ht_match.ravel().tolist(),
+            ht_mismatch.ravel().tolist(),
+            hm_Ref.ravel().tolist(),
+            discordance.ravel().tolist(),
+        )
+    ]
 
     sort_index = np.argsort([x[2] for x in geno_compare])
     geno_compare = [geno_compare[i] for i in sort_index]
@@ -353,20 +408,187 @@ def compare_genotype(all_geno, n, fp_output_dir, titlefile):
     return geno_compare
 
 
+def fp_count_matrix(all_fp_raw, fp_indices):
+    """
+    Stack the fingerprint records of all samples into arrays of allele counts
+
+    :param all_fp_raw: records from extract_all_raw_fp
+    :return: (fingerprint loci in natural order,
+              int array of sites x 2 with the index in A, C, G, T of the two alleles of each site,
+              int array of samples x sites x 4 with the counts of A, C, G, T,
+              bool array of samples x sites, False where a site is missing from a pileup)
+    """
+    loci = natural_sort(fp_indices.keys())
+    locus_index = {locus: i for i, locus in enumerate(loci)}
+    # fp_indices hold the column of each allele in the pileup, where A, C, G, T are columns 4 to 7
+    alleles = np.array([fp_indices[locus][0:2] for locus in loci], dtype=np.int64).reshape(-1, 2) - 4
+
+    counts = np.zeros((len(all_fp_raw), len(loci), 4), dtype=np.int64)
+    present = np.zeros((len(all_fp_raw), len(loci)), dtype=bool)
+    for i, fp_record in enumerate(all_fp_raw):
+        if len(fp_record) > 1:
+            sites = [locus_index[p[0] + ':' + p[1]] for p in fp_record[1:]]
+            counts[i, sites] = np.array([p[4:8] for p in fp_record[1:]]).astype(np.int64)
+            present[i, sites] = True
+    return loci, alleles, counts, present
+
+
+def fp_allele_counts(counts, alleles):
+    """
+    :return: int array of samples x sites x 2 with the counts of the two alleles of each site
+    """
+    return counts[:, np.arange(len(alleles))[:, None], alleles]
+
+
+def minor_allele_fractions(counts, alleles, coverage_thres=1):
+    """
+    :param counts, alleles: arrays from fp_count_matrix
+    :return: float array of samples x sites, NaN at sites with fewer than coverage_thres reads of the two alleles
+    """
+    allele_counts = fp_allele_counts(counts, alleles)
+    coverage = allele_counts.sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(coverage >= max(coverage_thres, 1), allele_counts.min(axis=2) / coverage, np.nan)
+
+
+def fp_genotype_codes(counts, alleles, present, homozygous_thres=0.1):
+    """
+    Genotypes of all samples with the rule of find_fp_maf, as codes in genotype_matrix.GENOTYPE_PLANES:
+    the most covered of A, C, G, T at homozygous sites, Het elsewhere, and -1 at sites without reads
+
+    :param counts, alleles, present: arrays from fp_count_matrix
+    :return: int array of samples x sites
+    """
+    maf = minor_allele_fractions(counts, alleles)
+    codes = np.where(maf <= homozygous_thres, np.argmax(counts, axis=2), HET)
+    return np.where(present & ~np.isnan(maf), codes, -1)
+
+
+def contamination_rates(counts, alleles, present, reference=None, homozygous_thres=0.1, coverage_thres=1):
+    """
+    Major and minor contamination rates of all samples from their fingerprint allele counts
+
+    A site is homozygous when its minor allele fraction is at or below homozygous_thres. Sites with fewer than
+    coverage_thres reads of the two alleles have no minor allele fraction, and are not homozygous.
+    The major contamination rate of a sample is its fraction of sites that are not homozygous, the minor contamination
+    rate is its mean minor allele fraction at the homozygous sites of its reference sample.
+
+    :param counts, alleles, present: arrays from fp_count_matrix
+    :param reference: int array with the index of the reference sample of each sample, defaults to the sample itself
+    :return: (major contamination rates, minor contamination rates, minor allele fractions of samples x sites)
+    """
+    if reference is None:
+        reference = np.arange(len(counts))
+    maf = minor_allele_fractions(counts, alleles, coverage_thres)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        homozygous = present & (maf <= homozygous_thres)
+
+        major = (present & ~homozygous).sum(axis=1) / present.sum(axis=1)
+
+        minor_sites = homozygous[reference] & present & ~np.isnan(maf)
+        minor = np.where(minor_sites, maf, 0).sum(axis=1) / minor_sites.sum(axis=1)
+    return major, minor, maf
+
+
+def find_contamination(all_fp_raw, fp_indices, df_titlefile):
+    """
+    Major and minor contamination rates of the samples of the run.
+    The minor contamination of a Tumor is measured at the homozygous sites of the Normal of its patient,
+    if the last title file entry of the patient is that Normal.
+
+    :param all_fp_raw: records from extract_all_raw_fp
+    :param df_titlefile: pd.DataFrame of the title file
+    :return: (major contamination of each pileup, minor contamination of each title file sample),
+             as lists of [sample name, rate]
+    """
+    loci, alleles, counts, present = fp_count_matrix(all_fp_raw, fp_indices)
+    pileup_names = [fp_record[0][0] for fp_record in all_fp_raw]
+    sample_index = {name.split('_cl')[0]: i for i, name in enumerate(pileup_names)}
+    samples = df_titlefile[TITLE_FILE__SAMPLE_ID_COLUMN]
+
+    last_entries = df_titlefile.drop_duplicates(TITLE_FILE__PATIENT_ID_COLUMN, keep='last')
+    patient_normals = last_entries.loc[last_entries[TITLE_FILE__SAMPLE_CLASS_COLUMN] == 'Normal'].set_index(
+        TITLE_FILE__PATIENT_ID_COLUMN)[TITLE_FILE__SAMPLE_ID_COLUMN]
+    normals = df_titlefile[TITLE_FILE__PATIENT_ID_COLUMN].map(patient_normals)
+    references = normals.where((df_titlefile[TITLE_FILE__SAMPLE_CLASS_COLUMN] == 'Tumor') & normals.notnull(), samples)
+
+    reference = np.arange(len(all_fp_raw))
+    reference[[sample_index[s] for s in samples]] = [sample_index[r] for r in references]
+    major, minor, _ = contamination_rates(counts, alleles, present, reference)
+
+    resolver = SampleNameResolver(samples)
+    major_contamination = [[resolver(name), rate] for name, rate in zip(pileup_names, major.tolist())]
+    minor_contamination = [[s, minor[sample_index[s]].item()] for s in samples]
+    return major_contamination, minor_contamination
+
+
+def compare_to_fingerprint_store(fp_store, all_fp_raw, fp_indices, df_titlefile, fp_output_dir):
+    """
+    Compare the samples of the run against the fingerprints of earlier runs in fp_store,
+    write the matching pairs and the mismatching pairs of the same patient to Geno_compare_history.txt,
+    then add the samples of the run to fp_store.
+    Samples are recorded under the Pool of the title file, and earlier records of the same Pool are not compared.
+
+    :param fp_store: str path to the SQLite fingerprint store, created if needed
+    :param all_fp_raw: records from extract_all_raw_fp
+    :param df_titlefile: pd.DataFrame of the title file
+    """
+    loci, alleles, counts, present = fp_count_matrix(all_fp_raw, fp_indices)
+    codes = fp_genotype_codes(counts, alleles, present)
+
+    resolver = SampleNameResolver(df_titlefile[TITLE_FILE__SAMPLE_ID_COLUMN])
+    titles = df_titlefile.drop_duplicates(TITLE_FILE__SAMPLE_ID_COLUMN).set_index(TITLE_FILE__SAMPLE_ID_COLUMN)
+    samples = [resolver(fp_record[0][0]) for fp_record in all_fp_raw]
+    keep = [i for i, s in enumerate(samples) if s in titles.index and 'CELLFREEPOOLEDNORMAL' not in s]
+    titles = titles.loc[[samples[i] for i in keep]]
+    # Missing patients are kept as None, so that they are not compared as a 'nan' patient
+    patient_ids = [None if pd.isnull(p) else str(p) for p in titles[TITLE_FILE__PATIENT_ID_COLUMN]]
+    samples = [SampleRecord(*row) for row in zip(titles.index, titles[TITLE_FILE__POOL_COLUMN].astype(str),
+                                                 patient_ids)]
+    runs = set(s.run for s in samples)
+
+    conn = fingerprint_store.open_store(fp_store)
+    try:
+        history = fingerprint_store.compare_to_store(conn, samples, loci, codes[keep], runs)
+        history.to_csv(fp_output_dir + 'Geno_compare_history.txt', sep='\t', index=False)
+        fingerprint_store.add_fingerprints(conn, samples, loci, codes[keep])
+    finally:
+        conn.close()
+    return history
+
+
 ###################
 ##Plot Functions
 ###################
 
-def plot_major_contamination(all_geno, fp_output_dir, titlefile):
-    plt.clf()
-    if all_geno[0][0] == TITLE_FILE__SAMPLE_ID_COLUMN:
-        all_geno = all_geno[1::]
-    titlefile = read_df(titlefile, header='infer')
-    samples = [extract_sample_name(g[0], titlefile[TITLE_FILE__SAMPLE_ID_COLUMN]) for g in all_geno]
-    x_pos = np.arange(len(all_geno))
-    p_het = [sum([1 for a in g if a == 'Het']) / (len(g) - 1) for g in all_geno]
+def render_figure(figure_job):
+    """
+    Run a plot function with its own copy of the matplotlib settings, in the seaborn
+    style of the figure if it has one, so that style changes of one figure do not leak into the next ones
+
+    :param figure_job: (plot function, args, seaborn font scale or None) tuple
+    """
+    plot_function, args, font_scale = figure_job
+    with matplotlib.rc_context():
+        if font_scale is not None:
+            sns.set(font_scale=font_scale)
+        plot_function(*args)
+    plt.close('all')
 
-    major_contamination = [[samples[i], p_het[i]] for i in range(0, len(samples))]
+
+def render_figures(figure_jobs, threads=1):
+    """
+    Render independent figures, in a pool of `threads` processes when threads > 1
+
+    :param figure_jobs: list of (plot function, args, seaborn font scale or None) tuples
+    """
+    pool_map(render_figure, figure_jobs, threads)
+
+
+def plot_major_contamination(major_contamination, fp_output_dir):
+    plt.figure(figsize=(10, 5))
+    x_pos = np.arange(len(major_contamination))
     major_contamination = sorted(major_contamination)
     write_csv(fp_output_dir + 'majorContamination.txt', major_contamination)
 
@@ -380,27 +602,7 @@ def plot_major_contamination(all_geno, fp_output_dir, titlefile):
     plt.savefig(fp_output_dir + 'MajorContaminationRate.pdf', bbox_inches='tight')
 
 
-# TO DO MAKE title file columns into CONSTANTS to be imported
-def find_and_plot_minorcontamination(df_summary, df_titlefile, output_dir, prefix=''):
-    patient_normals = {}
-    for i, s in df_titlefile.iterrows():
-        if s.Class == 'Normal':
-            patient_normals[s.Patient_ID] = s.Sample
-        else:
-            patient_normals[s.Patient_ID] = ''
-
-    minor_contamination = []
-    for i, s in df_titlefile.iterrows():
-        if s.Class == 'Tumor' and patient_normals[s.Patient_ID] != '':
-            minor_contamination.append([s.Sample, df_summary[s.Sample + '_MinorAlleleFreq'][
-                df_summary[patient_normals[s.Patient_ID] + '_Genotypes'].isin(['A', 'C', 'G', 'T'])].replace('-',
-                                                                                                                 np.nan).astype(
-                float).mean()])
-        else:
-            minor_contamination.append([s.Sample, df_summary[s.Sample + '_MinorAlleleFreq'][
-                df_summary[s.Sample + '_Genotypes'].isin(['A', 'C', 'G', 'T'])].replace('-', np.nan).astype(
-                float).mean()])
-
+def plot_minor_contamination(minor_contamination, output_dir, prefix=''):
     y_pos = np.arange(len(minor_contamination))
     minor_contamination = sorted(minor_contamination)
     write_csv(output_dir + prefix + 'minorContamination.txt', minor_contamination)
@@ -419,39 +621,25 @@ def find_and_plot_minorcontamination(df_summary, df_titlefile, output_dir, prefi
     plt.savefig(output_dir + '/Minor' + prefix + 'ContaminationRate.pdf', bbox_inches='tight')
 
 
-def plot_duplex_minor_contamination(waltz_dir_a_duplex, waltz_dir_b_duplex, titlefilepath, config_file, fp_output_dir):
+def find_duplex_minor_contamination(waltz_dir_a_duplex, waltz_dir_b_duplex, titlefilepath, config_file, fp_output_dir,
+                                    threads=1):
+    """
+    Write the duplex fingerprint summary and minor contamination of the Tumor samples
+
+    :return: sorted list of [sample name, duplex minor contamination rate], None if there are no Tumor samples
+    """
     coverage_thres = 200
     homozygous_thres = 0.05
 
-    # New fp_indices script using pandas
-    def create_fp_indices(config_file):
-        try:
-            config = pd.read_csv(config_file, header=0, sep='\t', dtype=str)
-        except FileNotFoundError:
-            raise FileNotFoundError('Error: Fingerprinting configure file does not exist')
-        # Check if there is a header and remove the header
-        if list(config.columns.values) != ['Chrom', 'Pos', 'Allele1', 'Allele2', 'Name'] and list(
-                config.columns.values) != ['Chrom', 'Pos', 'Allele1', 'Allele2']:
-            raise IOError('Error: Fingerprinting configure file has improper header')
-        # Check is there are sites in the file
-        if config.shape[0] == 0:
-            raise IOError('Error: Fingerprinting configure file is empty')
-            # Check is fingerprint has a name and if it doesn't make the name chrom:pos
-        if 'Name' not in list(config.columns.values):
-            config['Name'] = config['Chrom'] + ':' + config['Pos']
-        # Set Index to Chrom:Pos and remove duplicates
-        config.index = config['Chrom'] + ':' + config['Pos']
-        config.drop_duplicates(inplace=True)
-        return config
-
     # New Extract pileups paths script
     def extract_paired_list_of_pileups(waltz_dir_a_duplex, waltz_dir_b_duplex, listofsamples):
         pairedListOfPileups = []
+        resolver = SampleNameResolver(titlefile[SAMPLE_ID_COLUMN])
         for pileupfile in os.listdir(waltz_dir_a_duplex):
             # extract only pileups from Waltz folders
             if pileupfile.endswith("pileup.txt"):
                 # Check is file is in the list of Tumor Samples
-                samplename = extract_sample_name(pileupfile, titlefile[SAMPLE_ID_COLUMN])
+                samplename = resolver(pileupfile)
                 if samplename in listofsamples:
                     # Check if PoolB pileup exists
                     a_pileup_path = os.path.join(waltz_dir_a_duplex, pileupfile)
@@ -463,49 +651,10 @@ def plot_duplex_minor_contamination(waltz_dir_a_duplex, waltz_dir_b_duplex, titl
                             "Duplex Minor Contamination plot: " + pileupfile + " not found in Duplex Pool B directory provided, " + samplename + " excluded from duplex minor contamination")
         return pairedListOfPileups
 
-    # Make minor contamination rate and all_fp_summary
-    def FP_analysis(samplename, fileA, fileB, config):
-        a = pd.read_csv(fileA, header=None, sep='\t', dtype=str)
-        b = pd.read_csv(fileB, header=None, sep='\t', dtype=str)
-        # Merge A and B pileupes
-        ab = a.append(b, ignore_index=True)
-        ab.drop([8, 9, 10, 11, 12, 13], axis=1, inplace=True)
-        ab.columns = ['Chrom', 'Pos', 'Ref', 'Total_Depth', 'A', 'C', 'G', 'T']
-        ab.index = ab['Chrom'] + ':' + ab['Pos']
-        ab.drop_duplicates(inplace=True)
-        # need to check if there is an overlap in bed file and fp_config file
-        fp = config.merge(ab)
-        allele1_counts = []
-        allele2_counts = []
-        for i, row in fp.iterrows():
-            allele1_counts.append(int(row[row['Allele1']]))
-            allele2_counts.append(int(row[row['Allele2']]))
-        fp['allele1_count'] = allele1_counts
-        fp['allele2_count'] = allele2_counts
-        fp['coverage'] = fp[['allele1_count', 'allele2_count']].sum(axis=1)
-        # Find Minor allele Fraction of sites with sufficent coverage
-        fp.loc[fp.coverage >= coverage_thres, 'mAF'] = fp[['allele1_count', 'allele2_count']].min(axis=1) / fp[
-            'coverage']
-        # Find Genotype
-        fp.loc[fp.mAF > homozygous_thres, 'Geno'] = fp['Allele1'] + fp['Allele2']
-        fp.loc[(fp.mAF <= homozygous_thres) & (fp.allele1_count > fp.allele2_count), 'Geno'] = fp['Allele1']
-        fp.loc[(fp.mAF <= homozygous_thres) & (fp.allele1_count < fp.allele2_count), 'Geno'] = fp['Allele2']
-        # find minor contamination
-        minor_contamination = [samplename, fp.loc[fp.mAF <= homozygous_thres, 'mAF'].mean()]
-        # Make All_FPsummary file
-        fp_summary = pd.DataFrame()
-        fp_summary['Locus'] = fp['Chrom'] + ':' + fp['Pos']
-        fp_summary[samplename + '_Counts'] = fp['Allele1'] + ':' + fp['allele1_count'].astype(str) + ' ' + fp[
-            'Allele2'] + ':' + fp['allele2_count'].astype(str)
-        fp_summary[samplename + '_Genotypes'] = fp['Geno']
-        fp_summary[samplename + '_MinorAlleleFreq'] = fp['mAF']
-        fp_summary.fillna(value='-', inplace=True)
-        return minor_contamination, fp_summary
-
     # RUN
     titlefile = read_df(titlefilepath, header='infer')
     listofsamples = titlefile.loc[titlefile[TITLE_FILE__SAMPLE_CLASS_COLUMN] == 'Tumor'][SAMPLE_ID_COLUMN].tolist()
-    config = create_fp_indices(config_file)
+    fp_indices, n = create_fp_indices(config_file)
     # Check if Waltz Directories exist
     if not (os.path.isdir(waltz_dir_a_duplex) and os.path.isdir(waltz_dir_b_duplex)):
         raise IOError(
@@ -514,25 +663,36 @@ def plot_duplex_minor_contamination(waltz_dir_a_duplex, waltz_dir_b_duplex, titl
     if not listofsamples:
         logging.warn("Duplex Minor Contamination plot: No Samples marked as Tumor in Titlefile")
         return
-    # Extract paired pileup files
+    # Extract paired pileup files, and read each pair once as one merged pileup
     pairedListOfPileups = extract_paired_list_of_pileups(waltz_dir_a_duplex, waltz_dir_b_duplex, listofsamples)
-    for i, [samplename, fileA, fileB] in enumerate(pairedListOfPileups):
-        if i == 0:
-            minor_contamination, all_fp_summary = FP_analysis(samplename, fileA, fileB, config)
-            all_minor_contamination = [minor_contamination]
-        else:
-            minor_contamination, fp_summary = FP_analysis(samplename, fileA, fileB, config)
-            all_minor_contamination.append(minor_contamination)
-            all_fp_summary = all_fp_summary.merge(fp_summary, on='Locus')
-    # Reorder snps
-    all_fp_summary.set_index('Locus', inplace=True)
-    index = all_fp_summary.index.tolist()
-    index = natural_sort(index)
-    all_fp_summary = all_fp_summary.reindex(index)
+    samplenames = [samplename for samplename, _, _ in pairedListOfPileups]
+    all_fp_raw = extract_all_raw_fp([(fileA, fileB) for _, fileA, fileB in pairedListOfPileups], fp_indices, threads)
+    loci, alleles, counts, present = fp_count_matrix(all_fp_raw, fp_indices)
+    _, minor, maf = contamination_rates(counts, alleles, present, homozygous_thres=homozygous_thres,
+                                        coverage_thres=coverage_thres)
+
+    # Make All_FPsummary file, of the sites found in all samples
+    sites = present.all(axis=0)
+    allele1 = pd.Series(np.array(FP_ALLELES)[alleles[sites, 0]])
+    allele2 = pd.Series(np.array(FP_ALLELES)[alleles[sites, 1]])
+    allele_counts = fp_allele_counts(counts, alleles)[:, sites]
+    all_fp_summary = pd.DataFrame(index=pd.Index(np.array(loci)[sites], name='Locus'))
+    for i, samplename in enumerate(samplenames):
+        allele1_count = pd.Series(allele_counts[i, :, 0])
+        allele2_count = pd.Series(allele_counts[i, :, 1])
+        sample_maf = maf[i, sites]
+        geno = np.where(sample_maf > homozygous_thres, allele1 + allele2,
+                        np.where(allele1_count > allele2_count, allele1, allele2))
+        geno[np.isnan(sample_maf)] = '-'
+        all_fp_summary[samplename + '_Counts'] = (allele1 + ':' + allele1_count.astype(str) + ' ' + allele2 + ':' +
+                                                  allele2_count.astype(str)).values
+        all_fp_summary[samplename + '_Genotypes'] = geno
+        all_fp_summary[samplename + '_MinorAlleleFreq'] = sample_maf
+    all_fp_summary.fillna(value='-', inplace=True)
     # print summary
     all_fp_summary.to_csv(fp_output_dir + '/duplex_ALL_FPsummary.txt', sep="\t", index=True)
-    # plot minor contamination
-    all_minor_contamination = [x for x in all_minor_contamination if not np.isnan(x[1])]
+    # minor contamination
+    all_minor_contamination = [[s, m] for s, m in zip(samplenames, minor) if not np.isnan(m)]
     if not len(all_minor_contamination):
         print('WARNING: no homozygous positions found for duplex minor contamination.')
 
@@ -540,8 +700,10 @@ def plot_duplex_minor_contamination(waltz_dir_a_duplex, waltz_dir_b_duplex, titl
     df_minor_contamination = pd.DataFrame(all_minor_contamination,
                                           columns=['SampleName', 'MinorContaminationRateInDuplex'])
     df_minor_contamination.to_csv(fp_output_dir + '/duplex_minor_contamination.txt', sep="\t", index=False)
+    return all_minor_contamination
 
-    plt.clf()
+
+def plot_duplex_minor_contamination(all_minor_contamination, fp_output_dir):
     y_pos = np.arange(len(all_minor_contamination))
     plt.figure(figsize=(10, 5), facecolor='white')
     plt.axhline(y=0.002, xmin=0, xmax=1, c='r', ls='--')
@@ -590,7 +752,6 @@ def plot_genotyping_matrix(geno_compare, fp_output_dir, title_file):
     plt.subplots(figsize=(8, 7))
     plt.title('Sample Mix-Ups')
     # print(matrix)
-    sns.set(font_scale=.6)
     ax = sns.heatmap(discordance_data_frame.astype(float), robust=True, xticklabels=True, yticklabels=True, annot=False,
                      fmt='.2f', cmap="Blues_r", vmax=.15,
                      cbar_kws={'label': 'Fraction Mismatch'},
@@ -644,54 +805,54 @@ def plot_genotyping_matrix(geno_compare, fp_output_dir, title_file):
 
 
 
-def find_sex_from_pileup(waltz_dir, output_dir):
+def sex_from_pileup(pileupfile):
+    """
+    :return: "Male" if more than 200 positions of the Y chromosome have at least 1 read, "Female" otherwise
+    """
+    covered = [row for row in read_chromosome_rows(pileupfile, 'Y') if int(row[3]) > 0]
+    return "Male" if len(covered) > 200 else "Female"
+
+
+def find_sex_from_pileup(waltz_dir, output_dir, threads=1):
     """
     Not Currently Used: Checks the pileups if there are more that 200 positions in the Y chromosome,
     with at least 1 read, the sample is classified as male.
 
     :param waltz_dir:
     :param output_dir:
+    :param threads: number of processes reading the pileups
     :return:
     """
-    sex = []
-    for file in os.listdir(waltz_dir):
-        if file[-10::] == 'pileup.txt':
-            data = []
-            with open(waltz_dir + '/' + file, 'r') as f:
-                reader = csv.reader(f, delimiter='\t')
-                for row in reader:
-                    if row[0] == 'Y':
-                        if int(row[3]) > 0:
-                            data.append(row[3])
-            if len(data) > 200:
-                sex.append([file[0:file.find('_bc')], "Male"])
-            else:
-                sex.append([file[0:file.find('_bc')], "Female"])
+    files = [file for file in os.listdir(waltz_dir) if file[-10::] == 'pileup.txt']
+    sexes = pool_map(sex_from_pileup, [waltz_dir + '/' + file for file in files], threads)
+    sex = [[file[0:file.find('_bc')], s] for file, s in zip(files, sexes)]
     write_csv(output_dir + '/Sample_sex_from_pileup.txt', sex)
     return sex
 
 
-def find_sex_from_interval(waltz_dir):
+def sex_from_interval(intervalfile):
+    """
+    :return: "Male" if the sum of the average coverage of the 2 intervals on Y is greater than 50, "Female" otherwise
+    """
+    # The intervals are matched on their names, whatever the chromosome is named in the build
+    with open(intervalfile, 'r') as f:
+        coverage = [int(row[5]) for row in csv.reader(f, delimiter='\t')
+                    if row[3] == 'Tiling_SRY_Y:2655301' or row[3] == 'Tiling_USP9Y_Y:14891501']
+    return "Male" if sum(coverage) > 50 else "Female"
+
+
+def find_sex_from_interval(waltz_dir, threads=1):
     """
     Used: Checks the Interval files if the sum of the average coverage per interval (2 on Y) is greater that 50,
     the sample is classified as male.
 
     :param waltz_dir:
+    :param threads: number of processes reading the interval files
     :return:
     """
-    sex = []
-    for file in os.listdir(waltz_dir):
-        if file[-13::] == 'intervals.txt':
-            data = []
-            with open(waltz_dir + '/' + file, 'r') as f:
-                reader = csv.reader(f, delimiter='\t')
-                for row in reader:
-                    if row[3] == 'Tiling_SRY_Y:2655301' or row[3] == 'Tiling_USP9Y_Y:14891501':
-                        data.append(int(row[5]))
-            if sum(data) > 50:
-                sex.append([file, "Male"])
-            else:
-                sex.append([file, "Female"])
+    files = [file for file in os.listdir(waltz_dir) if file[-13::] == 'intervals.txt']
+    sexes = pool_map(sex_from_interval, [waltz_dir + '/' + file for file in files], threads)
+    sex = [[file, s] for file, s in zip(files, sexes)]
     # writeCVS(OutputDir + '/Sample_sex_from_pileup.txt', sex)
     return sex
 
@@ -739,8 +900,11 @@ def check_sex(gender, sex, output_dir):
 # Reformat fingerprinting output for Clinical database integration
 ######################
 
-def reformat_all(listofpileups, fp_indices, fp_output_dir):
-    def FP_reformat(pileupfile, fp_indices):
+def reformat_all(listofpileups, fp_indices, fp_output_dir, all_fp_raw=None):
+    """
+    :param all_fp_raw: records from extract_all_raw_fp, the pileups are read if not given
+    """
+    def FP_reformat(fp_indices, fp_record):
         # Per Sample
 
         # Constants
@@ -749,15 +913,10 @@ def reformat_all(listofpileups, fp_indices, fp_output_dir):
         # Parameter
         thres = 0.1  # heterozygous above this threshold
         # Get Raw data
-
-        pileup = read_csv(pileupfile)
-        fpRaw = []
-        for p in pileup:
-            if p[0] + ':' + p[1] in fp_indices.keys() and p[0] + ':' + p[1] not in [f[0] + ':' + f[1] for f in fpRaw]:
-                fpRaw.append(p[0:8])
+        fpRaw = fp_record[1:]
         # Create Header
         # TODO: consider changing this to pull samplename from title file
-        samplename = os.path.basename(pileupfile).split("_cl")[0]
+        samplename = fp_record[0][0].split("_cl")[0]
         reformatted_sample = [
             ['Locus', samplename + '_Counts', samplename + '_Genotypes', samplename + '_MinorAlleleFreq']]
         # Calculate and Reformat Data
@@ -784,12 +943,15 @@ def reformat_all(listofpileups, fp_indices, fp_output_dir):
         df_reformated_sample = pd.DataFrame(reformatted_sample[1:], columns=reformatted_sample[0])
         return df_reformated_sample
 
+    if all_fp_raw is None:
+        all_fp_raw = extract_all_raw_fp(listofpileups, fp_indices)
+
     # loop for all samples
-    for i, pileupfile in enumerate(listofpileups):
+    for i, fp_record in enumerate(all_fp_raw):
         if i == 0:
-            all_reformatted = FP_reformat(pileupfile, fp_indices)
+            all_reformatted = FP_reformat(fp_indices, fp_record)
         else:
-            df_reformatted_sample = FP_reformat(pileupfile, fp_indices)
+            df_reformatted_sample = FP_reformat(fp_indices, fp_record)
             all_reformatted = all_reformatted.merge(df_reformatted_sample, on='Locus')
 
     # do natural sort
@@ -823,32 +985,45 @@ def convert_fp_maf(input_dir):
 # Main Function
 ######################
 
-def run_fp_report(output_dir, waltz_dir_a, waltz_dir_b, waltz_dir_a_duplex, waltz_dir_b_duplex, config_file, titlefile):
-    merged_dir = concatenate_a_and_b_pileups(waltz_dir_a, waltz_dir_b, output_dir, 'MergedPileup')
-    listofpileups = extract_pileup_files(merged_dir)
+def run_fp_report(output_dir, waltz_dir_a, waltz_dir_b, waltz_dir_a_duplex, waltz_dir_b_duplex, config_file, titlefile,
+                  threads=1, fp_store=None):
+    # Pool A and B pileups are read back to back, instead of writing merged copies
+    listofpileups = pair_a_and_b_pileups(waltz_dir_a, waltz_dir_b)
     fp_indices, n = create_fp_indices(config_file)
     fp_output_dir = make_output_dir(output_dir, 'FPResults')
-    all_fp, all_geno = find_fp_maf(listofpileups, fp_indices, fp_output_dir)
-    
-    # reformat for clinical database    
-    reformat_all(listofpileups, fp_indices, fp_output_dir)
+    # Each merged pileup is read once, and shared by the analyses below
+    all_fp_raw = extract_all_raw_fp(listofpileups, fp_indices, threads)
+    all_fp, all_geno = find_fp_maf(listofpileups, fp_indices, fp_output_dir, all_fp_raw)
 
     # reformat for clinical database
-    all_reformatted = reformat_all(listofpileups, fp_indices, fp_output_dir)
+    reformat_all(listofpileups, fp_indices, fp_output_dir, all_fp_raw)
 
-    # Contamination plots
+    # Contamination
     df_titlefile = read_df(titlefile, header='infer')
-    find_and_plot_minorcontamination(all_reformatted, df_titlefile, fp_output_dir, prefix='')
-    ##plot_minor_contamination(all_fp, fp_output_dir, titlefile)
-
-    plot_major_contamination(all_geno, fp_output_dir, titlefile)
+    major_contamination, minor_contamination = find_contamination(all_fp_raw, fp_indices, df_titlefile)
 
     # plotGenoCompare(geno_compare,n, fpOutputdir)
     geno_compare = compare_genotype(all_geno, n, fp_output_dir, titlefile)
-    plot_genotyping_matrix(geno_compare, fp_output_dir, titlefile)
 
-    # Duplex Plot
-    plot_duplex_minor_contamination(waltz_dir_a_duplex, waltz_dir_b_duplex, titlefile, config_file, fp_output_dir)
+    # Samples swapped with samples of earlier runs
+    if fp_store:
+        compare_to_fingerprint_store(fp_store, all_fp_raw, fp_indices, df_titlefile, fp_output_dir)
+
+    # Duplex
+    duplex_minor_contamination = find_duplex_minor_contamination(waltz_dir_a_duplex, waltz_dir_b_duplex, titlefile,
+                                                                 config_file, fp_output_dir, threads)
+
+    # The figures only depend on the results above, and are rendered side by side
+    figure_jobs = [
+        (plot_minor_contamination, (minor_contamination, fp_output_dir, ''), None),
+        (plot_major_contamination, (major_contamination, fp_output_dir), None),
+        (plot_genotyping_matrix, (geno_compare, fp_output_dir, titlefile), SEABORN_FONT_SCALE),
+    ]
+    if duplex_minor_contamination is not None:
+        # Same style as the genotyping matrix, which used to be plotted right before
+        figure_jobs.append((plot_duplex_minor_contamination, (duplex_minor_contamination, fp_output_dir),
+                            SEABORN_FONT_SCALE))
+    render_figures(figure_jobs, threads)
 
     merge_pdf_in_folder(fp_output_dir, 'FPFigures.pdf')
 
@@ -866,6 +1041,9 @@ def parse_arguments():
                         required=True)
     parser.add_argument("-c", "--fp_config", help="File with information about the SNPs for analysis", required=True)
     parser.add_argument("-t", "--title_file", help="Title File for the run", required=False)
+    parser.add_argument("-th", "--threads", help="Number of processes used to read the pileups", type=int, default=1)
+    parser.add_argument("-fs", "--fp_store", help="SQLite store of the fingerprints of earlier runs, that the samples "
+                                                  "are compared against and added to", required=False)
     args = parser.parse_args()
     return args
 
@@ -876,12 +1054,13 @@ def main():
     # Fingerprinting
     run_fp_report(output_dir=args.output_dir, waltz_dir_a=args.waltz_dir_A, waltz_dir_b=args.waltz_dir_B,
                   waltz_dir_a_duplex=args.waltz_dir_A_duplex, waltz_dir_b_duplex=args.waltz_dir_B_duplex,
-                  config_file=args.fp_config, titlefile=args.title_file)
+                  config_file=args.fp_config, titlefile=args.title_file, threads=args.threads,
+                  fp_store=args.fp_store)
 
 
     # Sex
     gender = standardize_gender(title_file=args.title_file)
-    sex = find_sex_from_interval(waltz_dir=args.waltz_dir_B)
+    sex = find_sex_from_interval(waltz_dir=args.waltz_dir_B, threads=args.threads)
     check_sex(gender, sex, output_dir=args.output_dir)
 
 
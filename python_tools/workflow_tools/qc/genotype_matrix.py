@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Compact genotype matrix of the fingerprint sites of a set of samples.
+
+Genotypes are stored as packed bitsets: one bit per site for each of A, C, G, T (homozygous) and Het,
+so that a sample takes 5 bits per site, and the sites where two samples agree or disagree are counted
+with bitwise operations on 64 bit words.
+"""
+from __future__ import division
+
+import numpy as np
+
+
+# Genotype codes, in the order of the bitset planes, -1 is used for sites without a genotype
+GENOTYPE_PLANES = ['A', 'C', 'G', 'T', 'Het']
+GENOTYPE_CODES = {genotype: i for i, genotype in enumerate(GENOTYPE_PLANES)}
+HET = GENOTYPE_CODES['Het']
+
+# Site counts of GenotypeMatrix.compare
+COMPARISON_COUNTS = ['hom_match', 'hom_mismatch', 'het_match', 'het_mismatch', 'hom_in_ref']
+
+# Reference samples are compared in batches, small enough for the intermediate bitsets to stay in cache
+COMPARE_BATCH_SIZE = 256
+
+# Masks of the bitwise popcount of 64 bit words
+M1, M2, M4, H01 = [np.uint64(m) for m in (0x5555555555555555, 0x3333333333333333, 0x0f0f0f0f0f0f0f0f,
+                                           0x0101010101010101)]
+
+
+def pack_genotypes(codes, sites=None, n_sites=None):
+    """
+    :param codes: int array of samples x loci genotype codes, -1 for no genotype
+    :param sites: int array with the site number of each locus, defaults to the position of the locus
+    :param n_sites: total number of sites, defaults to the number of loci
+    :return: uint8 array of samples x planes x bytes, with one bit per site
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    if sites is None:
+        sites = np.arange(codes.shape[1])
+    if n_sites is None:
+        n_sites = codes.shape[1]
+    planes = np.zeros((len(codes), len(GENOTYPE_PLANES), n_sites), dtype=bool)
+    samples, loci = np.nonzero(codes >= 0)
+    planes[samples, codes[samples, loci], sites[loci]] = True
+    return np.packbits(planes, axis=2)
+
+
+def as_words(bits):
+    """
+    View packed bitsets as 64 bit words, padding them with empty bytes
+    """
+    padding = -bits.shape[-1] % 8
+    if padding:
+        bits = np.concatenate([bits, np.zeros(bits.shape[:-1] + (padding,), dtype=np.uint8)], axis=-1)
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+def count_bits(words):
+    """
+    :return: number of set bits along the last axis of an array of 64 bit words
+    """
+    words = words - ((words >> np.uint64(1)) & M1)
+    words = (words & M2) + ((words >> np.uint64(2)) & M2)
+    words = (words + (words >> np.uint64(4))) & M4
+    return ((words * H01) >> np.uint64(56)).sum(axis=-1, dtype=np.int64)
+
+
+def compare_words(query, reference, counts=COMPARISON_COUNTS):
+    """
+    Count the sites where every query sample agrees or disagrees with every reference sample,
+    among the sites genotyped in both samples
+
+    :param query, reference: uint64 arrays of samples x planes x words, from as_words
+    :param counts: names in COMPARISON_COUNTS of the counts to return
+    :return: dict of int arrays of query x reference samples
+    """
+    query_hom = np.bitwise_or.reduce(query[:, :HET], axis=1)[:, None]
+    reference_hom = np.bitwise_or.reduce(reference[:, :HET], axis=1)[None]
+    query_het = query[:, None, HET]
+    reference_het = reference[None, :, HET]
+
+    # A site has at most one genotype, so the sites where both samples are homozygous
+    # for the same allele are the union of the intersections of the allele planes
+    hom_same = query[:, None, 0] & reference[None, :, 0]
+    for plane in range(1, HET):
+        hom_same |= query[:, None, plane] & reference[None, :, plane]
+
+    kernels = {
+        'hom_match': lambda: hom_same,
+        'hom_mismatch': lambda: query_hom & reference_hom & ~hom_same,
+        'het_match': lambda: query_het & reference_het,
+        'het_mismatch': lambda: (query_het & reference_hom) | (query_hom & reference_het),
+        'hom_in_ref': lambda: (query_hom | query_het) & reference_hom,
+    }
+    return {count: count_bits(kernels[count]()) for count in counts}
+
+
+class SampleRecord(object):
+    """
+    Identity of a sample of a GenotypeMatrix
+    """
+    __slots__ = ('name', 'run', 'patient_id')
+
+    def __init__(self, name, run=None, patient_id=None):
+        self.name = name
+        self.run = run
+        self.patient_id = patient_id
+
+    def __repr__(self):
+        return 'SampleRecord(%r, %r, %r)' % (self.name, self.run, self.patient_id)
+
+
+class GenotypeMatrix(object):
+    """
+    Genotypes of samples x sites, packed into one bitset per sample and genotype
+
+    e.g. genotypes = GenotypeMatrix.from_genotypes(['s1', 's2'], [['A', 'Het'], ['A', 'C']])
+         genotypes.compare(genotypes)['hom_mismatch'] --> [[0, 0], [0, 0]]
+    """
+    __slots__ = ('samples', 'bits', 'n_sites')
+
+    def __init__(self, samples, bits, n_sites):
+        """
+        :param samples: SampleRecord[], one per row
+        :param bits: uint8 array of samples x planes x bytes, from pack_genotypes
+        :param n_sites: int number of sites
+        """
+        self.samples = samples
+        self.bits = bits
+        self.n_sites = n_sites
+
+    @classmethod
+    def from_codes(cls, samples, codes, sites=None, n_sites=None):
+        """
+        :param samples: SampleRecord[] or sample names
+        :param codes, sites, n_sites: see pack_genotypes
+        """
+        samples = [s if isinstance(s, SampleRecord) else SampleRecord(s) for s in samples]
+        codes = np.asarray(codes, dtype=np.int64)
+        codes = codes.reshape(len(samples), codes.size // max(len(samples), 1))
+        if n_sites is None:
+            n_sites = codes.shape[1]
+        return cls(samples, pack_genotypes(codes, sites, n_sites), n_sites)
+
+    @classmethod
+    def from_genotypes(cls, samples, genotypes):
+        """
+        :param samples: SampleRecord[] or sample names
+        :param genotypes: rows of genotypes in GENOTYPE_PLANES, one per sample, anything else is no genotype
+        """
+        codes = [[GENOTYPE_CODES.get(g, -1) for g in row] for row in genotypes]
+        return cls.from_codes(samples, codes)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def codes(self):
+        """
+        :return: int array of samples x sites genotype codes, -1 for no genotype
+        """
+        planes = np.unpackbits(self.bits, axis=2)[:, :, :self.n_sites].astype(bool)
+        return np.where(planes.any(axis=1), planes.argmax(axis=1), -1)
+
+    def compare(self, reference, counts=COMPARISON_COUNTS, batch_size=COMPARE_BATCH_SIZE):
+        """
+        Count the sites where each sample agrees or disagrees with each reference sample.
+        Both matrices need the same sites.
+
+        :param reference: GenotypeMatrix
+        :param counts: names in COMPARISON_COUNTS of the counts to return, where hom_in_ref is the number of
+                       homozygous sites of the reference sample that are genotyped in the sample
+        :return: dict of int arrays of samples x reference samples
+        """
+        query, reference = as_words(self.bits), as_words(reference.bits)
+        batches = [compare_words(query, reference[start:start + batch_size], counts)
+                   for start in range(0, len(reference), batch_size)]
+        if not batches:
+            return {count: np.zeros((len(query), 0), dtype=np.int64) for count in counts}
+        return {count: np.concatenate([batch[count] for batch in batches], axis=1) for count in counts}
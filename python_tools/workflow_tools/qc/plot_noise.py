@@ -14,7 +14,7 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-from python_tools.util import read_df, extract_sample_name, autolabel
+from python_tools.util import read_df, SampleNameResolver, autolabel
 from python_tools.constants import *
 
 
@@ -186,13 +186,11 @@ def main():
     ]
 
     # Cleanup sample IDs (in Noise table as well as Title File)
-    sample_ids = title_file[SAMPLE_ID_COLUMN].tolist()
-    noise_table[SAMPLE_ID_COLUMN] = noise_table[SAMPLE_ID_COLUMN].apply(
-        extract_sample_name, args=(sample_ids,)
+    resolver = SampleNameResolver(title_file[SAMPLE_ID_COLUMN].tolist())
+    noise_table[SAMPLE_ID_COLUMN] = resolver.resolve(noise_table[SAMPLE_ID_COLUMN])
+    noise_by_substitution_table[SAMPLE_ID_COLUMN] = resolver.resolve(
+        noise_by_substitution_table[SAMPLE_ID_COLUMN]
     )
-    noise_by_substitution_table[SAMPLE_ID_COLUMN] = noise_by_substitution_table[
-        SAMPLE_ID_COLUMN
-    ].apply(extract_sample_name, args=(sample_ids,))
 
     # Merge noise with title file
     noise_and_title_file = noise_table.merge(title_file, on=SAMPLE_ID_COLUMN)
@@ -66,6 +66,7 @@ ENTRY_POINTS = """
         filter_vardict = cwl_tools.basicfiltering.filter_vardict:main
         tag_hotspots = cwl_tools.hotspots.tag_hotspots:main
         ACCESS_filters = python_tools.workflow_tools.ACCESS_filters:main
+        ACCESS_filters_batch = python_tools.workflow_tools.ACCESS_filters:main_batch
         remove_variants_by_annotation = cwl_tools.remove_variants_by_anno.remove_variants_by_annotation:main
         annotate_concat = cwl_tools.concatVCF.annotate_concat:main
         maf2tsv = python_tools.workflow_tools.maf2tsv:main